@@ -1,10 +1,108 @@
 """ Entry point for the application. """
 
+import click
 from flask.cli import FlaskGroup
 from src import create_app
 
 cli = FlaskGroup(create_app=create_app)
 
 
+@cli.command("build-snapshot", with_appcontext=False)
+@click.option(
+    "--source",
+    default=None,
+    help="Repository to read from (db, file, pickle, mmap or memory), "
+    "defaults to the configured one",
+)
+def build_snapshot(source: str | None) -> None:
+    """Builds the memory-mapped snapshot read by the mmap repository"""
+    from contextlib import nullcontext
+
+    from flask import Flask
+
+    from src import db
+    from src.persistence import create_repository
+    from src.persistence.db import DBRepository
+    from src.persistence.indexes import declared_indexes
+    from src.persistence.mmapped import MmapRepository
+    from src.persistence.snapshot import build
+    from utils.constants import MMAP_SNAPSHOT_FILENAME, MODEL_NAMES
+
+    if source:
+        source_repo = create_repository(source)
+    else:
+        # Only the configured repository is created, not another one
+        from src.persistence import repo as source_repo
+
+    context = nullcontext()
+
+    if isinstance(getattr(source_repo, "inner", source_repo), DBRepository):
+        # The database is read through an app, without the routes
+        from src.models import (  # noqa: F401
+            amenity,
+            city,
+            country,
+            place,
+            review,
+            user,
+        )
+
+        app = Flask(__name__)
+        app.config.from_object("src.config.DevelopmentConfig")
+        db.init_app(app)
+        context = app.app_context()
+
+    with context:
+        if isinstance(source_repo, MmapRepository):
+            # Folds the journal in and remaps the new snapshot
+            source_repo.compact()
+        else:
+            build(
+                MMAP_SNAPSHOT_FILENAME,
+                {
+                    model: [
+                        obj.to_dict() for obj in source_repo.iter_all(model)
+                    ]
+                    for model in MODEL_NAMES
+                },
+                declared_indexes(),
+            )
+
+    click.echo(f"Snapshot written to {MMAP_SNAPSHOT_FILENAME}")
+
+
+@cli.command("rebalance-shards", with_appcontext=False)
+@click.option(
+    "--from",
+    "current",
+    type=int,
+    required=True,
+    help="Number of shards the data is spread over now",
+)
+@click.option(
+    "--to",
+    "count",
+    type=int,
+    required=True,
+    help="Number of shards to spread the data over, set SHARD_COUNT "
+    "to it once done",
+)
+def rebalance_shards(current: int, count: int) -> None:
+    """Moves every object of the database shards to its new shard"""
+    from src.persistence.sharded import (
+        ShardedRepository,
+        create_shards,
+        rebalance,
+    )
+
+    source = ShardedRepository(create_shards("db", current), populate=False)
+    source.upgrade()
+
+    _, moved = rebalance(source, count, "db")
+
+    for model, total in moved.items():
+        click.echo(f"{model}: {total} moved")
+
+
 if __name__ == "__main__":
     cli()
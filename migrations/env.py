@@ -0,0 +1,67 @@
+"""
+Alembic environment of the application
+
+The app upgrades its database on start (see src/migrate.py) and passes
+its connection in config.attributes. From the command line
+(`alembic upgrade head`, `alembic revision --autogenerate`) the
+database of DATABASE_URL is used, like DevelopmentConfig does.
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from src import db
+from src.config import DevelopmentConfig
+import src.models.amenity  # noqa: F401 (registers the models)
+import src.models.city  # noqa: F401
+import src.models.country  # noqa: F401
+import src.models.place  # noqa: F401
+import src.models.review  # noqa: F401
+import src.models.user  # noqa: F401
+
+
+config = context.config
+
+if config.config_file_name and "connection" not in config.attributes:
+    fileConfig(config.config_file_name)
+
+
+def run_migrations(connection) -> None:
+    """Runs the migrations with the given connection"""
+    context.configure(
+        connection=connection,
+        target_metadata=db.metadata,
+        render_as_batch=connection.dialect.name == "sqlite",
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    """Runs the migrations with the connection of the app, or a new one"""
+    connection = config.attributes.get("connection")
+
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    engine = create_engine(DevelopmentConfig.SQLALCHEMY_DATABASE_URI)
+
+    with engine.connect() as connection:
+        run_migrations(connection)
+
+
+if context.is_offline_mode():
+    context.configure(
+        url=DevelopmentConfig.SQLALCHEMY_DATABASE_URI,
+        target_metadata=db.metadata,
+        literal_binds=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+else:
+    run_migrations_online()
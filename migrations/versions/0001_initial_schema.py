@@ -0,0 +1,116 @@
+"""
+Initial schema, as db.create_all() used to build it
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def timestamps() -> list[sa.Column]:
+    """Returns the created_at and updated_at columns of a table"""
+    return [
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    ]
+
+
+def upgrade() -> None:
+    """Applies the migration"""
+    op.create_table(
+        "amenity",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        *timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "country",
+        sa.Column("id", UUID(as_uuid=True), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("code", sa.String(length=3), nullable=False),
+        *timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("code"),
+    )
+    op.create_table(
+        "place_amenity",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column("amenity_id", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("place_id", "amenity_id"),
+    )
+    op.create_table(
+        "user",
+        sa.Column("id", UUID(as_uuid=True), nullable=False),
+        sa.Column("first_name", sa.String(length=120), nullable=False),
+        sa.Column("last_name", sa.String(length=120), nullable=False),
+        sa.Column("email", sa.String(length=120), nullable=False),
+        sa.Column("password", sa.String(length=128), nullable=False),
+        sa.Column("is_admin", sa.Boolean(), nullable=True),
+        *timestamps(),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("email"),
+    )
+    op.create_table(
+        "city",
+        sa.Column("id", UUID(as_uuid=True), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("country_code", sa.String(length=3), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(["country_code"], ["country.code"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "place",
+        sa.Column("id", UUID(as_uuid=True), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=False),
+        sa.Column("description", sa.String(length=1024), nullable=True),
+        sa.Column("address", sa.String(length=255), nullable=False),
+        sa.Column("latitude", sa.Float(), nullable=False),
+        sa.Column("longitude", sa.Float(), nullable=False),
+        sa.Column("host_id", UUID(as_uuid=True), nullable=False),
+        sa.Column("city_id", UUID(as_uuid=True), nullable=False),
+        sa.Column("price_per_night", sa.Integer(), nullable=False),
+        sa.Column("number_of_rooms", sa.Integer(), nullable=False),
+        sa.Column("number_of_bathrooms", sa.Integer(), nullable=False),
+        sa.Column("max_guests", sa.Integer(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(["city_id"], ["city.id"]),
+        sa.ForeignKeyConstraint(["host_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "review",
+        sa.Column("id", UUID(as_uuid=True), nullable=False),
+        sa.Column("place_id", UUID(as_uuid=True), nullable=False),
+        sa.Column("user_id", UUID(as_uuid=True), nullable=False),
+        sa.Column("comment", sa.String(length=1024), nullable=False),
+        sa.Column("rating", sa.Float(), nullable=False),
+        *timestamps(),
+        sa.ForeignKeyConstraint(["place_id"], ["place.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    """Reverts the migration"""
+    for table in (
+        "review",
+        "place",
+        "city",
+        "user",
+        "place_amenity",
+        "country",
+        "amenity",
+    ):
+        op.drop_table(table)
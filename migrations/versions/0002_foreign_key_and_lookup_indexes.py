@@ -0,0 +1,38 @@
+"""
+Indexes for the foreign keys and for the lookups of the list endpoints
+
+user.email and country.code already have the index of their unique
+constraint, and place_amenity.place_id the one of its primary key.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_city_country_code", "city", ["country_code"]),
+    ("ix_place_city_id", "place", ["city_id"]),
+    ("ix_place_host_id", "place", ["host_id"]),
+    ("ix_place_amenity_amenity_id", "place_amenity", ["amenity_id"]),
+    ("ix_review_place_id_created_at", "review", ["place_id", "created_at"]),
+    ("ix_review_user_id_created_at", "review", ["user_id", "created_at"]),
+]
+
+
+def upgrade() -> None:
+    """Applies the migration"""
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    """Reverts the migration"""
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -4,7 +4,6 @@ from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 import os
-from .config import config
 
 
 db = SQLAlchemy()
@@ -24,7 +23,11 @@ def create_app(config_class="src.config.DevelopmentConfig") -> Flask:
     db.init_app(app)
 
     with app.app_context():
-        db.create_all()
+        from src.engine import configure_engine
+        from src.migrate import upgrade_database
+
+        configure_engine(app)
+        upgrade_database()
         register_extensions(app)
         register_routes(app)
         register_handlers(app)
@@ -35,6 +38,21 @@ def create_app(config_class="src.config.DevelopmentConfig") -> Flask:
 def register_extensions(app: Flask) -> None:
     """Register the extensions for the Flask app"""
     cors.init_app(app, resources={r"/api/*": {"origins": "*"}})
+
+    from src import invalidation, replicas, responses, unit_of_work
+
+    unit_of_work.init_app(app)
+    replicas.init_app(app)
+    invalidation.init_app(app)
+    responses.init_app(app)
+
+    from src.persistence import repo
+
+    repo.init_app(app)
+
+    # Sessions the repository opened for the request (like the ones
+    # of database shards) are closed with it
+    app.teardown_appcontext(lambda error: repo.release())
     # Further extensions can be added here
 
 
@@ -48,6 +66,7 @@ def register_routes(app: Flask) -> None:
     from src.routes.places import places_bp
     from src.routes.amenities import amenities_bp
     from src.routes.reviews import reviews_bp
+    from src.routes.metrics import metrics_bp
 
     # Register the blueprints in the app
     app.register_blueprint(users_bp)
@@ -56,6 +75,7 @@ def register_routes(app: Flask) -> None:
     app.register_blueprint(places_bp)
     app.register_blueprint(reviews_bp)
     app.register_blueprint(amenities_bp)
+    app.register_blueprint(metrics_bp)
 
 
 def register_handlers(app: Flask) -> None:
@@ -4,13 +4,14 @@ Amenity controller module
 
 from flask import abort, request
 from src.models.amenity import Amenity
+from src.responses import json_entity, json_list
 
 
 def get_amenities():
     """Returns all amenities"""
     amenities: list[Amenity] = Amenity.get_all()
 
-    return [amenity.to_dict() for amenity in amenities]
+    return json_list(amenities)
 
 
 def create_amenity():
@@ -34,7 +35,7 @@ def get_amenity_by_id(amenity_id: str):
     if not amenity:
         abort(404, f"Amenity with ID {amenity_id} not found")
 
-    return amenity.to_dict()
+    return json_entity(amenity)
 
 
 def update_amenity(amenity_id: str):
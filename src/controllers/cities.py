@@ -4,13 +4,14 @@ Cities controller module
 
 from flask import request, abort
 from src.models.city import City
+from src.responses import json_entity, json_list
 
 
 def get_cities():
     """Returns all cities"""
     cities: list[City] = City.get_all()
 
-    return [city.to_dict() for city in cities]
+    return json_list(cities)
 
 
 def create_city():
@@ -34,7 +35,7 @@ def get_city_by_id(city_id: str):
     if not city:
         abort(404, f"City with ID {city_id} not found")
 
-    return city.to_dict()
+    return json_entity(city)
 
 
 def update_city(city_id: str):
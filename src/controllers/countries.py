@@ -5,13 +5,14 @@ Countries controller module
 from flask import abort
 from src.models.city import City
 from src.models.country import Country
+from src.responses import json_entity, json_list
 
 
 def get_countries():
     """Returns all countries"""
     countries: list[Country] = Country.get_all()
 
-    return [country.to_dict() for country in countries]
+    return json_list(countries)
 
 
 def get_country_by_code(code: str):
@@ -21,7 +22,7 @@ def get_country_by_code(code: str):
     if not country:
         abort(404, f"Country with ID {code} not found")
 
-    return country.to_dict()
+    return json_entity(country)
 
 
 def get_country_cities(code: str):
@@ -31,10 +32,6 @@ def get_country_cities(code: str):
     if not country:
         abort(404, f"Country with ID {code} not found")
 
-    cities: list[City] = City.get_all()
+    cities: list[City] = City.lookup(country_code=country.code)
 
-    country_cities = [
-        city.to_dict() for city in cities if city.country_code == country.code
-    ]
-
-    return country_cities
+    return json_list(cities)
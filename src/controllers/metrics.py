@@ -0,0 +1,10 @@
+"""
+Metrics controller module
+"""
+
+from src.metrics import collect
+
+
+def get_metrics():
+    """Returns the metrics of every registered provider"""
+    return collect(), 200
@@ -4,13 +4,14 @@ Places controller module
 
 from flask import abort, request
 from src.models.place import Place
+from src.responses import json_entity, json_list
 
 
 def get_places():
     """Returns all places"""
     places: list[Place] = Place.get_all()
 
-    return [place.to_dict() for place in places], 200
+    return json_list(places)
 
 
 def create_place():
@@ -34,7 +35,7 @@ def get_place_by_id(place_id: str):
     if not place:
         abort(404, f"Place with ID {place_id} not found")
 
-    return place.to_dict(), 200
+    return json_entity(place)
 
 
 def update_place(place_id: str):
@@ -4,13 +4,14 @@ Reviews controller module
 
 from flask import abort, request
 from src.models.review import Review
+from src.responses import json_entity, json_list
 
 
 def get_reviews():
     """Returns all reviews"""
     reviews = Review.get_all()
 
-    return [review.to_dict() for review in reviews], 200
+    return json_list(reviews)
 
 
 def create_review(place_id: str):
@@ -32,20 +33,16 @@ def create_review(place_id: str):
 
 def get_reviews_from_place(place_id: str):
     """Returns all reviews from a specific place"""
-    reviews = Review.get_all()
+    reviews = Review.lookup(place_id=place_id)
 
-    return [
-        review.to_dict() for review in reviews if review.place_id == place_id
-    ], 200
+    return json_list(reviews)
 
 
 def get_reviews_from_user(user_id: str):
     """Returns all reviews from a specific user"""
-    reviews = Review.get_all()
+    reviews = Review.lookup(user_id=user_id)
 
-    return [
-        review.to_dict() for review in reviews if review.user_id == user_id
-    ], 200
+    return json_list(reviews)
 
 
 def get_review_by_id(review_id: str):
@@ -55,7 +52,7 @@ def get_review_by_id(review_id: str):
     if not review:
         abort(404, f"Review with ID {review_id} not found")
 
-    return review.to_dict(), 200
+    return json_entity(review)
 
 
 def update_review(review_id: str):
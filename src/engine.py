@@ -0,0 +1,144 @@
+"""
+This module exports the helpers that tune the database engine
+of the app according to its configuration
+
+SQLite connections get the SQLITE_PRAGMAS of the config class
+(journal mode, synchronous, mmap_size, cache_size, temp_store,
+busy_timeout...) as soon as they are opened, through an engine
+connect event, so every pooled connection has the same profile.
+
+The statistics of the connection pool (see pool_stats) are published
+by /metrics, so connections waited for show up next to the latency.
+"""
+
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import Engine, event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+
+from src import db
+
+
+def sqlite_pragmas(pragmas: dict):
+    """Returns a connect listener that sets the given pragmas"""
+
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        """Sets the pragmas on a new connection"""
+        cursor = dbapi_connection.cursor()
+
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return set_pragmas
+
+
+def configure_engine(
+    app: Flask, engine: Engine | None = None, name: str = "db_pool"
+) -> None:
+    """
+    Applies the performance profile of the config to the engine
+    of the app and publishes its pool statistics as name, must be
+    called before the first connection is opened
+
+    Without an engine, every engine of the app is configured: the
+    primary one and those of the binds, like the read replicas
+    (see src/replicas.py), published as db_pool_<bind>
+    """
+    from src.metrics import register
+
+    if engine is None:
+        for key, bind_engine in db.engines.items():
+            configure_engine(
+                app, bind_engine, f"{name}_{key}" if key else name
+            )
+        return
+
+    # The pool is read on every collect, dispose replaces it
+    register(name, lambda: pool_stats(engine.pool))
+
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = app.config.get("SQLITE_PRAGMAS") or {}
+
+    if pragmas:
+        event.listen(engine, "connect", sqlite_pragmas(pragmas))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that measures how long checkouts wait for a connection,
+    published with the rest of the pool statistics (see pool_stats)
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        """Creates the pool with empty wait statistics"""
+        super().__init__(*args, **kwargs)
+        self.wait_stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+        self.__stats_lock = threading.Lock()
+
+    def _do_get(self):
+        """Checks a connection out, timing the wait"""
+        start = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            with self.__stats_lock:
+                self.wait_stats["timeouts"] += 1
+            raise
+
+        waited = time.perf_counter() - start
+
+        with self.__stats_lock:
+            self.wait_stats["checkouts"] += 1
+            self.wait_stats["total_wait_seconds"] += waited
+            self.wait_stats["max_wait_seconds"] = max(
+                self.wait_stats["max_wait_seconds"], waited
+            )
+
+        return connection
+
+    def recreate(self) -> "InstrumentedQueuePool":
+        """Creates a new pool on dispose, keeping the wait statistics"""
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+
+        return pool
+
+
+def pool_stats(pool: Pool) -> dict:
+    """Returns the occupation of a pool and how long checkouts wait"""
+    stats = {"pool": pool.__class__.__name__}
+
+    for name, method in (
+        ("size", "size"),
+        ("checked_in", "checkedin"),
+        ("checked_out", "checkedout"),
+        ("overflow", "overflow"),
+    ):
+        if hasattr(pool, method):
+            stats[name] = getattr(pool, method)()
+
+    wait_stats = getattr(pool, "wait_stats", None)
+
+    if wait_stats:
+        stats |= wait_stats
+        stats["avg_wait_seconds"] = (
+            wait_stats["total_wait_seconds"] / wait_stats["checkouts"]
+            if wait_stats["checkouts"]
+            else 0.0
+        )
+
+    return stats
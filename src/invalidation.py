@@ -0,0 +1,336 @@
+"""
+This module exports the invalidation bus shared by the worker processes
+of the app (gunicorn -w N), through a SQLite table
+
+Every commit to the database publishes the (model, id) of the objects
+it wrote, in one insert, and so do the repositories that store their
+data in files shared by the workers (file, pickle and mmap) once a
+write reached the files. Every worker polls the table every
+INVALIDATION_INTERVAL seconds and hands the objects written by the
+other workers to its subscribers: the caches (the repository cache and
+the JSON cache of the responses) drop them, the repositories that keep
+a copy of the shared store in memory (file, pickle, mmap and tiered)
+read them again from it. A copy is thus at most INVALIDATION_INTERVAL
+seconds older than the shared store, plus the time of a poll.
+
+Events are pruned after INVALIDATION_RETENTION seconds. A worker that
+didn't poll for that long can't know what it missed, so its subscribers
+start over instead: the caches are emptied, the copies read again.
+
+MemoryRepository has no shared store, every worker has its own data:
+it is only supported with a single worker.
+
+The bus is enabled by setting INVALIDATION_BUS_PATH to the path of
+the SQLite file, the same for every worker of a host. Published and
+received events are published by /metrics.
+"""
+
+import atexit
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator, Protocol
+import uuid
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class Subscriber(Protocol):
+    """A cache, or a copy, that can be told objects changed elsewhere"""
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Drops or reads again the given (model, id) objects"""
+
+    def clear(self) -> None:
+        """Drops, or reads again, everything"""
+
+
+_subscribers: list[Subscriber] = []
+
+
+def subscribe(subscriber: Subscriber) -> None:
+    """
+    Registers a subscriber to tell when another worker writes,
+    subscribers are told in the order they subscribed
+    """
+    if subscriber not in _subscribers:
+        _subscribers.append(subscriber)
+
+
+def unsubscribe(subscriber: Subscriber) -> None:
+    """Stops telling a subscriber"""
+    if subscriber in _subscribers:
+        _subscribers.remove(subscriber)
+
+
+class InvalidationBus:
+    """Table of change events, written and polled by every worker"""
+
+    def __init__(
+        self, path: str, interval: float = 0.5, retention: float = 60.0
+    ) -> None:
+        """Opens the table, and starts after its last event"""
+        self.path = path
+        self.interval = interval
+        self.retention = retention
+        # A pid alone could be reused by a later worker
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+        self.__connection.execute("PRAGMA busy_timeout=5000")
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS invalidations ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "origin TEXT NOT NULL, "
+            "model TEXT NOT NULL, "
+            "obj_id TEXT NOT NULL, "
+            "at REAL NOT NULL)"
+        )
+        self.__last_seq = self.__latest_seq()
+        self.__last_prune = 0.0
+        self.__stopping = threading.Event()
+        self.__stats = {
+            "published": 0,
+            "received": 0,
+            "polls": 0,
+            "resets": 0,
+            "errors": 0,
+            "last_poll_seconds": 0.0,
+        }
+        self.__thread: threading.Thread | None = None
+
+    @contextmanager
+    def __transaction(self, begin: str) -> Iterator[None]:
+        """Runs the statements of the block in one transaction"""
+        self.__connection.execute(begin)
+
+        try:
+            yield
+        except BaseException:
+            self.__connection.execute("ROLLBACK")
+            raise
+
+        self.__connection.execute("COMMIT")
+
+    def __latest_seq(self) -> int:
+        """Returns the seq of the last event, even if it was pruned"""
+        return self.__connection.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence "
+            "WHERE name = 'invalidations'"
+        ).fetchone()[0]
+
+    def start(self) -> None:
+        """Starts polling in a background thread"""
+        self.__thread = threading.Thread(
+            target=self.__run, name="invalidation-bus", daemon=True
+        )
+        self.__thread.start()
+
+    def publish(self, changes: list[tuple[str, str]]) -> None:
+        """
+        Records that this worker wrote the given (model, id) objects
+
+        The write is already committed when this is called, so a failure
+        is only counted: the other workers catch up with the TTL of
+        their caches
+        """
+        if not changes:
+            return
+
+        now = time.time()
+
+        with self.__lock:
+            try:
+                with self.__transaction("BEGIN IMMEDIATE"):
+                    self.__connection.executemany(
+                        "INSERT INTO invalidations "
+                        "(origin, model, obj_id, at) VALUES (?, ?, ?, ?)",
+                        [
+                            (self.origin, model, str(obj_id), now)
+                            for model, obj_id in changes
+                        ],
+                    )
+            except sqlite3.Error:
+                self.__stats["errors"] += 1
+                return
+
+            self.__stats["published"] += len(changes)
+
+    def poll(self) -> int:
+        """
+        Invalidates the objects the other workers wrote since the last
+        poll in every subscriber, returns how many events were read
+        """
+        start = time.perf_counter()
+
+        with self.__lock, self.__transaction("BEGIN"):
+            latest = self.__latest_seq()
+            rows = self.__connection.execute(
+                "SELECT seq, origin, model, obj_id FROM invalidations "
+                "WHERE seq > ? ORDER BY seq",
+                (self.__last_seq,),
+            ).fetchall()
+            # Seqs have no holes, so a missing one was pruned unread
+            missed = latest > self.__last_seq and (
+                not rows or rows[0][0] != self.__last_seq + 1
+            )
+            self.__last_seq = latest
+
+        events = [
+            (model, obj_id)
+            for _, origin, model, obj_id in rows
+            if origin != self.origin
+        ]
+
+        if missed:
+            for subscriber in list(_subscribers):
+                subscriber.clear()
+        else:
+            for subscriber in list(_subscribers):
+                if events:
+                    subscriber.invalidate_many(events)
+
+        self.__prune()
+
+        with self.__lock:
+            self.__stats["polls"] += 1
+            self.__stats["received"] += len(events)
+            self.__stats["resets"] += int(missed)
+            self.__stats["last_poll_seconds"] = time.perf_counter() - start
+
+        return len(events)
+
+    def __prune(self) -> None:
+        """Deletes the events older than the retention, now and then"""
+        now = time.time()
+
+        if now - self.__last_prune < self.retention / 2:
+            return
+
+        with self.__lock:
+            self.__connection.execute(
+                "DELETE FROM invalidations WHERE at < ?",
+                (now - self.retention,),
+            )
+        self.__last_prune = now
+
+    def __run(self) -> None:
+        """Polls until the bus is closed"""
+        while not self.__stopping.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                # Of the table or of a subscriber, the next poll goes on
+                with self.__lock:
+                    self.__stats["errors"] += 1
+
+    def close(self) -> None:
+        """Stops polling and closes the table, used on shutdown"""
+        self.__stopping.set()
+
+        if self.__thread is not None:
+            self.__thread.join()
+
+        with self.__lock:
+            self.__connection.close()
+
+    def stats(self) -> dict:
+        """Returns the events published and received, and the polls"""
+        with self.__lock:
+            return self.__stats | {
+                "interval": self.interval,
+                "last_seq": self.__last_seq,
+            }
+
+
+bus: InvalidationBus | None = None
+
+
+def publish(changes: list[tuple[str, Any]]) -> None:
+    """
+    Publishes the (model, id) objects written to a shared store,
+    once the write is done, nothing if the bus isn't enabled
+    """
+    if bus is not None and changes:
+        bus.publish(changes)
+
+
+def _flushed(session: Session, flush_context: Any) -> None:
+    """Collects the objects a session wrote, until it commits"""
+    from src import db
+
+    changes = session.info.setdefault("invalidations", set())
+
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, db.Model):
+            changes.add((obj.__class__.__name__.lower(), str(obj.id)))
+
+
+def _committed(session: Session) -> None:
+    """Publishes the objects of a commit"""
+    changes = session.info.pop("invalidations", None)
+
+    if changes:
+        publish(sorted(changes))
+
+
+def _rolled_back(session: Session) -> None:
+    """Forgets the objects of a transaction that was rolled back"""
+    session.info.pop("invalidations", None)
+
+
+_listeners = (
+    ("after_flush", _flushed),
+    ("after_commit", _committed),
+    ("after_rollback", _rolled_back),
+)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Starts the bus when INVALIDATION_BUS_PATH is set, and publishes
+    the commits of every session
+    """
+    global bus
+
+    path = app.config.get("INVALIDATION_BUS_PATH")
+
+    if not path or bus is not None:
+        return
+
+    from src.metrics import register
+
+    bus = InvalidationBus(
+        path,
+        interval=app.config.get("INVALIDATION_INTERVAL", 0.5),
+        retention=app.config.get("INVALIDATION_RETENTION", 60.0),
+    )
+    bus.start()
+    atexit.register(close)
+    register("invalidation_bus", bus.stats)
+
+    for name, listener in _listeners:
+        event.listen(Session, name, listener)
+
+
+def close() -> None:
+    """Stops publishing the commits and closes the bus"""
+    global bus
+
+    if bus is None:
+        return
+
+    for name, listener in _listeners:
+        event.remove(Session, name, listener)
+
+    bus.close()
+    bus = None
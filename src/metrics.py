@@ -0,0 +1,21 @@
+"""
+This module keeps the metrics providers of the application
+
+Any component can register a function returning a dict of metrics,
+they are all published together by the /metrics endpoint
+"""
+
+from typing import Callable
+
+
+providers: dict[str, Callable[[], dict]] = {}
+
+
+def register(name: str, provider: Callable[[], dict]) -> None:
+    """Registers (or replaces) a metrics provider"""
+    providers[name] = provider
+
+
+def collect() -> dict:
+    """Returns the metrics of every registered provider"""
+    return {name: provider() for name, provider in providers.items()}
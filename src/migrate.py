@@ -0,0 +1,41 @@
+"""
+This module exports the helper that brings the database of the app
+up to date with the Alembic migrations (migrations/ at the root)
+"""
+
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import Engine, inspect
+
+from src import db
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Schema that db.create_all() used to build, before the migrations
+BASELINE_REVISION = "0001"
+
+
+def upgrade_database(engine: Engine | None = None) -> None:
+    """
+    Upgrades the database of the current app, or the one of the given
+    engine (like a shard, see src/persistence/sharded.py), to the last
+    migration
+
+    Databases built by db.create_all() have the tables but no
+    migration history, they are stamped with the baseline first
+    """
+    config = Config(os.path.join(ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+
+    with (engine or db.engine).begin() as connection:
+        config.attributes["connection"] = connection
+
+        tables = inspect(connection).get_table_names()
+
+        if tables and "alembic_version" not in tables:
+            command.stamp(config, BASELINE_REVISION)
+
+        command.upgrade(config, "head")
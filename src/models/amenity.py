@@ -3,7 +3,7 @@ Amenity related functionality
 """
 
 from src.models.base import Base
-from app import db
+from src import db
 
 
 class Amenity(db.Model):
@@ -66,7 +66,7 @@ class PlaceAmenity(db.Model):
     """PlaceAmenity representation"""
 
     place_id = db.Column(db.Integer, primary_key=True)
-    amenity_id = db.Column(db.Integer, primary_key=True)
+    amenity_id = db.Column(db.Integer, primary_key=True, index=True)
 
     def __init__(self, place_id: str, amenity_id: str, **kw) -> None:
         """Dummy init"""
@@ -94,16 +94,11 @@ class PlaceAmenity(db.Model):
         """Get a PlaceAmenity object by place_id and amenity_id"""
         from src.persistence import repo
 
-        place_amenities: list[PlaceAmenity] = repo.get_all("placeamenity")
+        place_amenities: list[PlaceAmenity] = repo.lookup(
+            "placeamenity", place_id=place_id, amenity_id=amenity_id
+        )
 
-        for place_amenity in place_amenities:
-            if (
-                place_amenity.place_id == place_id
-                and place_amenity.amenity_id == amenity_id
-            ):
-                return place_amenity
-
-        return None
+        return place_amenities[0] if place_amenities else None
 
     @staticmethod
     def create(data: dict) -> "PlaceAmenity":
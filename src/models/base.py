@@ -61,6 +61,51 @@ class Base(ABC):
 
         return repo.get_all(cls.__name__.lower())
 
+    @classmethod
+    def lookup(cls, **fields) -> list["Any"]:
+        """
+        This is a common method to get all objects of a class
+        whose fields match the given values, for example
+        Review.lookup(place_id=place_id)
+
+        The repositories use their indexes when there is one
+        for the given fields
+        """
+        from src.persistence import repo
+
+        return repo.lookup(cls.__name__.lower(), **fields)
+
+    @classmethod
+    def get_by(cls, **fields) -> "Any | None":
+        """
+        This is a common method to get the object of a class
+        with the given natural key, for example User.get_by(email=email)
+        """
+        from src.persistence import repo
+
+        return repo.get_by(cls.__name__.lower(), **fields)
+
+    @classmethod
+    def get_many(cls, ids: list) -> dict[str, "Any"]:
+        """
+        This is a common method to get the objects of a class
+        with the given ids at once, by id, for example to check
+        every amenity id of a request with a single read
+        """
+        from src.persistence import repo
+
+        return repo.get_many(cls.__name__.lower(), ids)
+
+    @classmethod
+    def save_many(cls, objects: list["Any"]) -> None:
+        """
+        This is a common method to save several objects at once,
+        either all of them are saved or none is
+        """
+        from src.persistence import repo
+
+        repo.save_many(objects)
+
     @classmethod
     def delete(cls, id) -> bool:
         """
@@ -79,6 +124,18 @@ class Base(ABC):
 
         return repo.delete(obj)
 
+    @classmethod
+    def delete_many(cls, ids: list) -> int:
+        """
+        This is a common method to delete the objects of a class
+        with the given ids at once, returns how many were deleted
+        """
+        from src.persistence import repo
+
+        return repo.delete_many(
+            list(repo.get_many(cls.__name__.lower(), ids).values())
+        )
+
     @abstractmethod
     def to_dict(self) -> dict:
         """Returns the dictionary representation of the object"""
@@ -1,4 +1,4 @@
-from app import db
+from src import db
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 
@@ -7,7 +7,7 @@ class City(db.Model):
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = db.Column(db.String(255), nullable=False)
-    country_code = db.Column(db.String(3), db.ForeignKey('country.code'), nullable=False)
+    country_code = db.Column(db.String(3), db.ForeignKey('country.code'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, onupdate=db.func.current_timestamp())
 
@@ -36,22 +36,25 @@ class City(db.Model):
     @staticmethod
     def create(data: dict) -> "City":
         """Create a new city"""
-        country = Country.query.filter_by(code=data["country_code"]).first()
+        from src.persistence import repo
+
+        country = repo.get_by("country", code=data["country_code"])
 
         if not country:
             raise ValueError("Country not found")
 
         new_city = City(name=data["name"], country_code=data["country_code"])
 
-        db.session.add(new_city)
-        db.session.commit()
+        repo.save(new_city)
 
         return new_city
 
     @staticmethod
     def update(city_id: str, data: dict) -> "City":
         """Update an existing city"""
-        city = City.query.get(city_id)
+        from src.persistence import repo
+
+        city = repo.get("city", city_id)
 
         if not city:
             raise ValueError("City not found")
@@ -59,6 +62,6 @@ class City(db.Model):
         for key, value in data.items():
             setattr(city, key, value)
 
-        db.session.commit()
+        repo.update(city)
 
         return city
@@ -1,4 +1,4 @@
-from app import db
+from src import db
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 
@@ -40,19 +40,24 @@ class Country(db.Model):
     @staticmethod
     def get_all() -> list["Country"]:
         """Get all countries"""
-        return Country.query.all()
+        from src.persistence import repo
+
+        return repo.get_all("country")
 
     @staticmethod
     def get(code: str) -> "Country | None":
         """Get a country by its code"""
-        return Country.query.filter_by(code=code).first()
+        from src.persistence import repo
+
+        return repo.get_by("country", code=code)
 
     @staticmethod
     def create(name: str, code: str) -> "Country":
         """Create a new country"""
+        from src.persistence import repo
+
         new_country = Country(name=name, code=code)
 
-        db.session.add(new_country)
-        db.session.commit()
+        repo.save(new_country)
 
         return new_country
@@ -1,6 +1,10 @@
-from app import db
+from src import db
 from src.models.city import City
 from src.models.user import User
+from src.persistence.references import (
+    check_references,
+    with_stored_ids,
+)
 import uuid
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -13,8 +17,8 @@ class Place(db.Model):
     address = db.Column(db.String(255), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
-    host_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id'), nullable=False)
-    city_id = db.Column(UUID(as_uuid=True), db.ForeignKey('city.id'), nullable=False)
+    host_id = db.Column(UUID(as_uuid=True), db.ForeignKey('user.id'), nullable=False, index=True)
+    city_id = db.Column(UUID(as_uuid=True), db.ForeignKey('city.id'), nullable=False, index=True)
     price_per_night = db.Column(db.Integer, nullable=False)
     number_of_rooms = db.Column(db.Integer, nullable=False)
     number_of_bathrooms = db.Column(db.Integer, nullable=False)
@@ -64,32 +68,40 @@ class Place(db.Model):
 
     @staticmethod
     def create(data: dict) -> "Place":
-        """Create a new place"""
-        user = User.query.get(data["host_id"])
-        if not user:
-            raise ValueError(f"User with ID {data['host_id']} not found")
+        """Create a new place, its host and city are checked together"""
+        return Place.create_many([data])[0]
 
-        city = City.query.get(data["city_id"])
-        if not city:
-            raise ValueError(f"City with ID {data['city_id']} not found")
+    @staticmethod
+    def create_many(payloads: list[dict]) -> list["Place"]:
+        """
+        Create several places, the hosts and cities of all of them
+        are checked with one read per model before any is saved
+        """
+        from src.persistence import repo
+
+        found = check_references(Place, payloads)
 
-        new_place = Place(data=data)
+        new_places = [
+            Place(data=with_stored_ids(Place, data, found))
+            for data in payloads
+        ]
 
-        db.session.add(new_place)
-        db.session.commit()
+        repo.save_many(new_places)
 
-        return new_place
+        return new_places
 
     @staticmethod
     def update(place_id: str, data: dict) -> "Place | None":
         """Update an existing place"""
-        place = Place.query.get(place_id)
+        from src.persistence import repo
+
+        place = repo.get("place", place_id)
         if not place:
             raise ValueError("Place not found")
 
         for key, value in data.items():
             setattr(place, key, value)
 
-        db.session.commit()
+        repo.update(place)
 
         return place
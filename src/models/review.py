@@ -1,6 +1,10 @@
-from app import db
+from src import db
 from src.models.place import Place
 from src.models.user import User
+from src.persistence.references import (
+    check_references,
+    with_stored_ids,
+)
 import uuid
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -15,6 +19,13 @@ class Review(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, onupdate=db.func.current_timestamp())
 
+    # The reviews of a place and of a user are listed by their own
+    # endpoints, the indexes also serve the foreign keys
+    __table_args__ = (
+        db.Index("ix_review_place_id_created_at", "place_id", "created_at"),
+        db.Index("ix_review_user_id_created_at", "user_id", "created_at"),
+    )
+
     def __init__(self, place_id: str, user_id: str, comment: str, rating: float, **kwargs) -> None:
         """Initialize a Review"""
         super().__init__(**kwargs)
@@ -41,32 +52,40 @@ class Review(db.Model):
 
     @staticmethod
     def create(data: dict) -> "Review":
-        """Create a new review"""
-        user = User.query.get(data["user_id"])
-        if not user:
-            raise ValueError(f"User with ID {data['user_id']} not found")
+        """Create a new review, its user and place are checked together"""
+        return Review.create_many([data])[0]
+
+    @staticmethod
+    def create_many(payloads: list[dict]) -> list["Review"]:
+        """
+        Create several reviews, the users and places of all of them
+        are checked with one read per model before any is saved
+        """
+        from src.persistence import repo
 
-        place = Place.query.get(data["place_id"])
-        if not place:
-            raise ValueError(f"Place with ID {data['place_id']} not found")
+        found = check_references(Review, payloads)
 
-        new_review = Review(**data)
+        new_reviews = [
+            Review(**with_stored_ids(Review, data, found))
+            for data in payloads
+        ]
 
-        db.session.add(new_review)
-        db.session.commit()
+        repo.save_many(new_reviews)
 
-        return new_review
+        return new_reviews
 
     @staticmethod
     def update(review_id: str, data: dict) -> "Review | None":
         """Update an existing review"""
-        review = Review.query.get(review_id)
+        from src.persistence import repo
+
+        review = repo.get("review", review_id)
         if not review:
             raise ValueError("Review not found")
 
         for key, value in data.items():
             setattr(review, key, value)
 
-        db.session.commit()
+        repo.update(review)
 
         return review
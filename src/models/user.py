@@ -1,7 +1,6 @@
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
-from app import db
-from src.persistence import repo
+from src import db
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class User(db.Model):
@@ -42,22 +41,24 @@ class User(db.Model):
     @staticmethod
     def create(user_data: dict) -> "User":
         """Create a new user"""
-        users = User.query.filter_by(email=user_data["email"]).all()
-        if users:
+        from src.persistence import repo
+
+        if repo.get_by("user", email=user_data["email"]):
             raise ValueError("User already exists")
 
         user_data["password"] = generate_password_hash(user_data["password"])
         new_user = User(**user_data)
 
-        db.session.add(new_user)
-        db.session.commit()
+        repo.save(new_user)
 
         return new_user
 
     @staticmethod
     def update(user_id: str, data: dict) -> "User | None":
         """Update an existing user"""
-        user = User.query.get(user_id)
+        from src.persistence import repo
+
+        user = repo.get("user", user_id)
         if not user:
             return None
 
@@ -70,6 +71,6 @@ class User(db.Model):
         if "password" in data:
             user.password = generate_password_hash(data["password"])
 
-        db.session.commit()
+        repo.update(user)
 
         return user
@@ -4,25 +4,80 @@ to be used based on the environment variable REPOSITORY_ENV_VAR."""
 import os
 
 from src.persistence.repository import Repository
-from utils.constants import REPOSITORY_ENV_VAR
+from utils.constants import REPOSITORY_CACHE_ENV_VAR, REPOSITORY_ENV_VAR
 
-repo: Repository
 
-if os.getenv(key=REPOSITORY_ENV_VAR) == "db":
-    from src.persistence.db import DBRepository
+def create_cached_repository(name: str | None) -> Repository:
+    """
+    Creates the repository with the given name, behind a read-through
+    cache when REPOSITORY_CACHE is set
+    """
+    inner = create_repository(name)
+
+    if os.getenv(REPOSITORY_CACHE_ENV_VAR, "") in ("1", "true"):
+        from src.persistence.cached import CachedRepository
+
+        return CachedRepository(inner)
+
+    return inner
+
+
+def create_repository(name: str | None) -> Repository:
+    """
+    Creates the repository with the given name:
+    db, file, pickle, mmap, sharded, tiered or memory (the default)
+    """
+    if name == "db":
+        from src.persistence.db import DBRepository
+
+        return DBRepository()
+    if name == "file":
+        from src.persistence.file import FileRepository
+
+        return FileRepository()
+    if name == "pickle":
+        from src.persistence.pickled import PickleRepository
+
+        return PickleRepository()
+    if name == "mmap":
+        from src.persistence.mmapped import MmapRepository
 
-    repo = DBRepository()
-elif os.getenv(REPOSITORY_ENV_VAR) == "file":
-    from src.persistence.file import FileRepository
+        return MmapRepository()
+    if name == "tiered":
+        from src.persistence.tiered import TieredRepository
 
-    repo = FileRepository()
-elif os.getenv(REPOSITORY_ENV_VAR) == "pickle":
-    from src.persistence.pickled import PickleRepository
+        return TieredRepository()
+    if name == "sharded":
+        from src.persistence.db import DBRepository
+        from src.persistence.sharded import ShardedRepository, create_shards
+
+        shards = create_shards()
+
+        # Database shards aren't seeded, like DBRepository
+        return ShardedRepository(
+            shards, populate=not isinstance(shards[0], DBRepository)
+        )
 
-    repo = PickleRepository()
-else:
     from src.persistence.memory import MemoryRepository
 
-    repo = MemoryRepository()
+    return MemoryRepository()
+
+
+repo: Repository
+
+
+def __getattr__(name: str) -> Repository:
+    """
+    Creates the configured repository the first time it is imported
+    (from src.persistence import repo), so importing the other names
+    of the package (like create_repository) doesn't create it
+    """
+    global repo
+
+    if name != "repo":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    repo = create_cached_repository(os.getenv(REPOSITORY_ENV_VAR))
+    print(f"Using {repo.__class__.__name__} as repository")
 
-print(f"Using {repo.__class__.__name__} as repository")
+    return repo
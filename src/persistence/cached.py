@@ -0,0 +1,506 @@
+"""
+This module exports a read-through cache in front of any Repository
+(REPOSITORY_CACHE=1)
+
+get and get_many keep the objects they read. get_all and lookup (so
+get_by too) keep their results, by model and normalized filters. Every
+model has its own size and TTL (see cache_limits): expired entries are
+read again, the least recently used objects are evicted once the model
+keeps size of them, and the results of its queries are evicted once
+they hold size objects in total.
+
+Every model has a generation, bumped by each of its writes: a result is
+only used while the generation it was read at is current, so a write
+invalidates all the queries of its model at O(1) cost, and the stale
+results are dropped when they are met or evicted.
+
+save, update and delete also drop the entries of the objects right
+away. Changes are committed when the request ends (see
+src/unit_of_work.py), so the models written by the request are
+invalidated again once it did, and a read that started before a write
+never fills the cache. Objects flushed to a database by db.session,
+like the models that use it directly, are invalidated too.
+
+The objects read from a database are kept detached from its session,
+so a commit doesn't expire them; writing one merges it back (see
+DBRepository._attach). Hits, misses and evictions are published by
+/metrics.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+from flask import Flask, g, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from src import db
+from src.persistence.repository import Repository
+from utils.constants import (
+    REPOSITORY_CACHE_LIMITS_DEFAULT,
+    REPOSITORY_CACHE_LIMITS_ENV_VAR,
+    REPOSITORY_CACHE_SIZE_DEFAULT,
+    REPOSITORY_CACHE_SIZE_ENV_VAR,
+    REPOSITORY_CACHE_TTL_DEFAULT,
+    REPOSITORY_CACHE_TTL_ENV_VAR,
+)
+
+
+def cache_limits() -> dict[str | None, tuple[int, float]]:
+    """
+    Returns the (size, ttl) of every model read from the environment,
+    the None key holds the ones of the models that aren't listed
+    """
+    limits: dict[str | None, tuple[int, float]] = {
+        None: (
+            int(
+                os.getenv(
+                    REPOSITORY_CACHE_SIZE_ENV_VAR,
+                    REPOSITORY_CACHE_SIZE_DEFAULT,
+                )
+            ),
+            float(
+                os.getenv(
+                    REPOSITORY_CACHE_TTL_ENV_VAR, REPOSITORY_CACHE_TTL_DEFAULT
+                )
+            ),
+        )
+    }
+    spec = os.getenv(
+        REPOSITORY_CACHE_LIMITS_ENV_VAR, REPOSITORY_CACHE_LIMITS_DEFAULT
+    )
+
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+
+        try:
+            model, values = item.split("=")
+            size, ttl = values.split(":")
+            limits[model.strip()] = (int(size), float(ttl))
+        except ValueError as error:
+            raise ValueError(f"Invalid cache limits: {item!r}") from error
+
+    return limits
+
+
+def _detach(obj: Any) -> Any:
+    """
+    Removes an object read from a database from its session,
+    unless it has changes waiting to be written
+    """
+    state = inspect(obj, raiseerr=False)
+
+    if state is not None and state.session is not None:
+        if state.persistent and not state.modified:
+            state.session.expunge(obj)
+
+    return obj
+
+
+class CachedRepository(Repository):
+    """Read-through LRU and TTL cache of the objects of a repository"""
+
+    def __init__(
+        self,
+        inner: Repository,
+        limits: dict[str | None, tuple[int, float]] | None = None,
+    ) -> None:
+        """
+        Wraps a repository, limits maps the models to their
+        (size, ttl) and is read from the environment by default
+        """
+        self.inner = inner
+        self.limits = limits if limits is not None else cache_limits()
+
+        self.__lock = threading.Lock()
+        # model -> id -> (expires at, object), least recently used first
+        self.__entries: dict[str, OrderedDict[str, tuple[float, Any]]] = {}
+        # model -> filters -> (generation, expires at, objects), least
+        # recently used first, the filters of get_all are ()
+        self.__queries: dict[
+            str, OrderedDict[tuple, tuple[int, float, list]]
+        ] = {}
+        # model -> objects held by the results of its queries
+        self.__query_sizes: dict[str, int] = {}
+        # Bumped by every write, fills read before a bump are dropped
+        self.__generations: dict[str, int] = {}
+        self.__stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "query_hits": 0,
+            "query_misses": 0,
+            "query_evictions": 0,
+            "stale_queries": 0,
+        }
+
+    def limit(self, model_name: str) -> tuple[int, float]:
+        """Returns the size and ttl of a model"""
+        return self.limits.get(model_name, self.limits[None])
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Prepares the wrapped repository, invalidates the objects
+        db.session flushes, the writes of every app context again once
+        it ends, and the writes of the other workers (see
+        src/invalidation.py), until close is called
+        """
+        from src import invalidation
+        from src.metrics import register
+
+        self.inner.init_app(app)
+        register("repository_cache", self.stats)
+        invalidation.subscribe(self)
+        event.listen(db.session, "after_flush", self._flushed)
+        app.teardown_appcontext(self._invalidate_written)
+
+    def close(self) -> None:
+        """Stops following the flushes and the other workers"""
+        from src import invalidation
+
+        invalidation.unsubscribe(self)
+        if event.contains(db.session, "after_flush", self._flushed):
+            event.remove(db.session, "after_flush", self._flushed)
+
+    def release(self) -> None:
+        """Frees what the current thread holds in the wrapped repository"""
+        self.inner.release()
+
+    def reload(self) -> None:
+        """Reloads the wrapped repository and empties the cache"""
+        self.inner.reload()
+        self.clear()
+
+    def clear(self) -> None:
+        """Empties the cache"""
+        with self.__lock:
+            for model in set(self.__entries) | set(self.__queries):
+                self.__bump(model)
+            self.__entries.clear()
+            self.__queries.clear()
+            self.__query_sizes.clear()
+
+    def stats(self) -> dict:
+        """Returns the hits, misses, evictions and size of the cache"""
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats["entries"] = {
+                model: len(entries)
+                for model, entries in self.__entries.items()
+            }
+            stats["queries"] = {
+                model: len(queries)
+                for model, queries in self.__queries.items()
+            }
+            stats["generations"] = dict(self.__generations)
+
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        queries = stats["query_hits"] + stats["query_misses"]
+        stats["query_hit_ratio"] = (
+            stats["query_hits"] / queries if queries else 0.0
+        )
+
+        return stats
+
+    def __bump(self, model_name: str) -> None:
+        """Starts a new generation of a model, the lock must be held"""
+        self.__generations[model_name] = (
+            self.__generations.get(model_name, 0) + 1
+        )
+
+    def __cached(self, model_name: str, obj_id: str) -> tuple[bool, Any]:
+        """
+        Returns (True, object) for a fresh entry, (False, None) when
+        there is none, the lock must be held
+        """
+        entries = self.__entries.get(model_name)
+        entry = entries.get(obj_id) if entries else None
+
+        if entry is None:
+            self.__stats["misses"] += 1
+            return False, None
+
+        if entry[0] <= time.monotonic():
+            del entries[obj_id]
+            self.__stats["expirations"] += 1
+            self.__stats["misses"] += 1
+            return False, None
+
+        entries.move_to_end(obj_id)
+        self.__stats["hits"] += 1
+
+        return True, entry[1]
+
+    def __fill(self, model_name: str, generation: int, objects: list) -> None:
+        """
+        Keeps objects read from the wrapped repository, unless the model
+        was written since the read started
+        """
+        size, ttl = self.limit(model_name)
+
+        with self.__lock:
+            if not size or self.__generations.get(model_name, 0) != generation:
+                return
+
+            entries = self.__entries.setdefault(model_name, OrderedDict())
+            expires = time.monotonic() + ttl
+
+            for obj in objects:
+                entries[str(obj.id)] = (expires, _detach(obj))
+                entries.move_to_end(str(obj.id))
+
+            while len(entries) > size:
+                entries.popitem(last=False)
+                self.__stats["evictions"] += 1
+
+    def __generation(self, model_name: str) -> int:
+        """Returns the current generation of a model"""
+        with self.__lock:
+            return self.__generations.get(model_name, 0)
+
+    def get(self, model_name: str, obj_id: str) -> Any | None:
+        """Get an object by its ID, from the cache if it is there"""
+        with self.__lock:
+            found, obj = self.__cached(model_name, str(obj_id))
+
+        if found:
+            return obj
+
+        generation = self.__generation(model_name)
+        obj = self.inner.get(model_name, obj_id)
+
+        if obj is not None:
+            self.__fill(model_name, generation, [obj])
+
+        return obj
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """
+        Get the objects of a model with the given ids, by id, reading
+        only the ones that aren't cached
+        """
+        found: dict[str, Any] = {}
+        missing = []
+
+        with self.__lock:
+            for obj_id in ids:
+                hit, obj = self.__cached(model_name, str(obj_id))
+
+                if hit:
+                    found[str(obj_id)] = obj
+                else:
+                    missing.append(obj_id)
+
+        if missing:
+            generation = self.__generation(model_name)
+            read = self.inner.get_many(model_name, missing)
+            self.__fill(model_name, generation, list(read.values()))
+            found |= read
+
+        return {
+            str(obj_id): found[str(obj_id)]
+            for obj_id in ids
+            if str(obj_id) in found
+        }
+
+    @staticmethod
+    def query_key(fields: dict) -> tuple:
+        """
+        Returns the normalized filters of a query: sorted by field,
+        with the values as strings, so a uuid and its string match
+        """
+        return tuple(
+            sorted(
+                (field, value if value is None else str(value))
+                for field, value in fields.items()
+            )
+        )
+
+    def __query(
+        self, model_name: str, fields: dict, read: Callable[[], list]
+    ) -> list:
+        """
+        Returns the result of a query of a model from the cache, or
+        reads it and keeps it while the model's generation is current
+        """
+        size, ttl = self.limit(model_name)
+        key = self.query_key(fields)
+
+        with self.__lock:
+            generation = self.__generations.get(model_name, 0)
+            queries = self.__queries.get(model_name)
+            entry = queries.get(key) if queries else None
+
+            if entry is not None:
+                if entry[0] == generation and entry[1] > time.monotonic():
+                    queries.move_to_end(key)
+                    self.__stats["query_hits"] += 1
+                    return list(entry[2])
+
+                self.__drop_query(model_name, key)
+                stale = entry[0] != generation
+                self.__stats["stale_queries" if stale else "expirations"] += 1
+
+            self.__stats["query_misses"] += 1
+
+        objects = read()
+
+        if not size or len(objects) > size:
+            return objects
+
+        kept = [_detach(obj) for obj in objects]
+
+        with self.__lock:
+            if self.__generations.get(model_name, 0) == generation:
+                self.__keep_query(model_name, key, generation, ttl, kept)
+
+        return list(objects)
+
+    def __keep_query(
+        self,
+        model_name: str,
+        key: tuple,
+        generation: int,
+        ttl: float,
+        objects: list,
+    ) -> None:
+        """
+        Keeps the result of a query, evicting the least recently used
+        ones of the model past its size, the lock must be held
+        """
+        size = self.limit(model_name)[0]
+        self.__drop_query(model_name, key)
+
+        queries = self.__queries.setdefault(model_name, OrderedDict())
+        queries[key] = (generation, time.monotonic() + ttl, objects)
+        self.__query_sizes[model_name] = (
+            self.__query_sizes.get(model_name, 0) + len(objects)
+        )
+
+        while self.__query_sizes[model_name] > size:
+            _, (_, _, evicted) = queries.popitem(last=False)
+            self.__query_sizes[model_name] -= len(evicted)
+            self.__stats["query_evictions"] += 1
+
+    def __drop_query(self, model_name: str, key: tuple) -> None:
+        """Drops the result of a query, the lock must be held"""
+        entry = self.__queries.get(model_name, {}).pop(key, None)
+
+        if entry is not None:
+            self.__query_sizes[model_name] -= len(entry[2])
+
+    def get_all(self, model_name: str) -> list:
+        """Get all objects of a model, from the cache if it is there"""
+        return self.__query(
+            model_name, {}, lambda: self.inner.get_all(model_name)
+        )
+
+    def iter_all(self, model_name: str) -> Iterator:
+        """Get all objects of a model one at a time, not cached"""
+        return self.inner.iter_all(model_name)
+
+    def lookup(self, model_name: str, **fields) -> list:
+        """
+        Get the objects of a model matching the fields, from the cache
+        if the same filters were read in the current generation
+        """
+        return self.__query(
+            model_name,
+            fields,
+            lambda: self.inner.lookup(model_name, **fields),
+        )
+
+    def invalidate(self, model_name: str, obj_id: Any = None) -> None:
+        """
+        Drops the entry of an object, every entry of the model without
+        an id, and starts a new generation of the model, so none of
+        the results of its queries are used again
+        """
+        with self.__lock:
+            self.__bump(model_name)
+            entries = self.__entries.get(model_name)
+
+            if entries is None:
+                return
+
+            if obj_id is None:
+                entries.clear()
+            else:
+                entries.pop(str(obj_id), None)
+
+            self.__stats["invalidations"] += 1
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Invalidates several objects, by model and id"""
+        for model_name, obj_id in changes:
+            self.invalidate(model_name, obj_id)
+
+    def _written(self, objects: list) -> None:
+        """
+        Invalidates the objects written, and records them so they are
+        invalidated again once the app context ends
+        """
+        for obj in objects:
+            model = obj.__class__.__name__.lower()
+            self.invalidate(model, obj.id)
+
+            if has_app_context():
+                g.setdefault("cache_written", set()).add((model, obj.id))
+
+    def _flushed(self, session: Session, flush_context: Any) -> None:
+        """Invalidates the objects a session wrote to its database"""
+        self._written(
+            [
+                obj
+                for obj in (*session.new, *session.dirty, *session.deleted)
+                if isinstance(obj, db.Model)
+            ]
+        )
+
+    def _invalidate_written(self, error: BaseException | None = None):
+        """Invalidates the writes of the app context that ended"""
+        for model, obj_id in g.pop("cache_written", ()):
+            self.invalidate(model, obj_id)
+
+    def save(self, obj: Any) -> Any:
+        """Save an object in the wrapped repository"""
+        result = self.inner.save(obj)
+        self._written([obj])
+
+        return result
+
+    def save_many(self, objects: list) -> None:
+        """Save several objects in the wrapped repository"""
+        self.inner.save_many(objects)
+        self._written(objects)
+
+    def update(self, obj: Any) -> Any | None:
+        """Update an object in the wrapped repository"""
+        self._written([obj])
+        result = self.inner.update(obj)
+        self._written([obj])
+
+        return result
+
+    def delete(self, obj: Any) -> bool:
+        """Delete an object from the wrapped repository"""
+        self._written([obj])
+        result = self.inner.delete(obj)
+        self._written([obj])
+
+        return result
+
+    def delete_many(self, objects: list) -> int:
+        """Delete several objects from the wrapped repository"""
+        self._written(objects)
+        deleted = self.inner.delete_many(objects)
+        self._written(objects)
+
+        return deleted
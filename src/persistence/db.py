@@ -1,56 +1,277 @@
 """
-  Now is easy to implement the database repository. The DBRepository
-  should implement the Repository (Storage) interface and the methods defined
-  in the abstract class Storage.
-
-  The methods to implement are:
-    - get_all
-    - get
-    - save
-    - update
-    - delete
-    - reload (which can be empty)
+This module exports a Repository that stores data in a database
+with SQLAlchemy
+
+Queries are written in the SQLAlchemy 2.0 style (select()):
+
+- get uses session.get, so an object already loaded by the session
+  is returned from its identity map without a query
+- the statements of get_all and lookup are built once per model (and
+  fields) with bound parameters, so they are reused, and their compiled
+  form is found in SQLAlchemy's cache
+- iter_all streams the rows in batches of DB_STREAM_BATCH_SIZE
+  (yield_per), so going through a large table uses constant memory
+- get_many reads every id with a single IN query, save_many and
+  delete_many are flushed together, so the inserts (and deletes) of
+  a model are sent as one batched statement
+
+save, update and delete go through commit() (see src/unit_of_work.py),
+so during a request they only stage the changes.
+
+With read replicas (see src/replicas.py) the read-only methods use the
+replica session of the request, until the request writes.
 """
-from src import db
-from src.models.base import Base
+
+from typing import Any, Iterator
+import uuid
+
+from sqlalchemy import Select, bindparam, inspect, select
+from sqlalchemy.orm import Session, scoped_session
+
+from src import db, replicas
 from src.persistence.repository import Repository
-from sqlalchemy.orm import Session
+from src.unit_of_work import commit
+from utils.constants import DB_STREAM_BATCH_SIZE
+
 
 class DBRepository(Repository):
     """Repository class for interacting with SQLAlchemy models."""
 
-    def __init__(self, session: Session = None) -> None:
+    def __init__(self, session: Session | None = None) -> None:
         """Initialize with an optional SQLAlchemy session."""
         self.session = session or db.session
+        self.__statements: dict[tuple, Select] = {}
+        # Only the app's session is routed, a given one is used as is
+        self.__routed = session is None
+
+    def _reader(self) -> Session:
+        """Returns the session of a read, a replica one if possible"""
+        if self.__routed:
+            return replicas.session() or self.session
+
+        return self.session
+
+    def _writer(self) -> Session:
+        """
+        Returns the session of a write, the next reads of the request
+        will go to the primary too
+        """
+        if self.__routed:
+            replicas.stick_to_primary()
+
+        return self.session
+
+    def _attach(self, obj: Any) -> Any:
+        """
+        Returns the instance of an object in the primary session,
+        objects read from a replica, or kept detached by a cache
+        (see src/persistence/cached.py), are merged into it
+        """
+        if inspect(obj).key is not None and obj not in self.session:
+            return self.session.merge(obj)
+
+        return obj
+
+    @staticmethod
+    def _model_class(model_name: str) -> type:
+        """Returns the mapped class of a model name, like placeamenity"""
+        for mapper in db.Model.registry.mappers:
+            if mapper.class_.__name__.lower() == model_name:
+                return mapper.class_
+
+        raise ValueError(f"Unknown model: {model_name}")
+
+    @classmethod
+    def new_id(cls, model_name: str) -> Any | None:
+        """
+        Returns a new id for an object of a model, before it is saved,
+        or None if the database generates it on insert (integer ids)
+        """
+        columns = cls._model_class(model_name).__table__.columns
+
+        if "id" not in columns or columns["id"].type.python_type is int:
+            return None
+        if columns["id"].type.python_type is uuid.UUID:
+            return uuid.uuid4()
+
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def _coerce(model_class: type, field: str, value: Any) -> Any:
+        """
+        Converts a value to the python type of its column,
+        ids arrive as strings but UUID columns bind uuid.UUID values
+
+        Raises ValueError if the value isn't valid for the column
+        """
+        column = model_class.__table__.columns[field]
+
+        if column.type.python_type is uuid.UUID and isinstance(value, str):
+            return uuid.UUID(value)
+
+        return value
+
+    def _statement(self, model_name: str, fields: tuple = ()) -> Select:
+        """
+        Returns the cached select of a model, filtered by the given
+        fields with one bound parameter per field
+        """
+        key = (model_name, fields)
+
+        if key not in self.__statements:
+            model_class = self._model_class(model_name)
+            self.__statements[key] = select(model_class).where(
+                *(getattr(model_class, f) == bindparam(f) for f in fields)
+            )
+
+        return self.__statements[key]
+
+    def _many_statement(self, model_name: str) -> Select:
+        """
+        Returns the cached select of a model filtered by a list of ids,
+        bound as one expanding parameter
+        """
+        key = (model_name, "id IN")
+
+        if key not in self.__statements:
+            model_class = self._model_class(model_name)
+            self.__statements[key] = select(model_class).where(
+                model_class.id.in_(bindparam("ids", expanding=True))
+            )
+
+        return self.__statements[key]
 
     def get_all(self, model_name: str) -> list:
         """Retrieve all instances of a model."""
-        model_class = getattr(Base, model_name)
-        return self.session.query(model_class).all()
+        return list(self._reader().scalars(self._statement(model_name)))
 
-    def get(self, model_name: str, obj_id: str) -> Base | None:
+    def iter_all(self, model_name: str) -> Iterator:
+        """
+        Retrieve all instances of a model as they are read,
+        DB_STREAM_BATCH_SIZE rows at a time
+        """
+        yield from self._reader().scalars(
+            self._statement(model_name),
+            execution_options={"yield_per": DB_STREAM_BATCH_SIZE},
+        )
+
+    def get(self, model_name: str, obj_id: str) -> Any | None:
         """Retrieve a single instance of a model by ID."""
-        model_class = getattr(Base, model_name)
-        return self.session.query(model_class).filter_by(id=obj_id).first()
+        model_class = self._model_class(model_name)
+
+        try:
+            obj_id = self._coerce(model_class, "id", obj_id)
+        except ValueError:
+            return None
+
+        return self._reader().get(model_class, obj_id)
+
+    def lookup(self, model_name: str, **fields) -> list:
+        """Retrieve all instances of a model matching the given fields."""
+        model_class = self._model_class(model_name)
+        names = tuple(sorted(fields))
+
+        try:
+            params = {
+                name: self._coerce(model_class, name, fields[name])
+                for name in names
+            }
+        except ValueError:
+            return []
+
+        return list(
+            self._reader().scalars(self._statement(model_name, names), params)
+        )
 
-    def save(self, obj: Base) -> None:
+    def save(self, obj: Any) -> None:
         """Save a new instance of a model."""
-        self.session.add(obj)
-        self.session.commit()
+        self._writer().add(self._attach(obj))
+        commit(self.session)
 
-    def update(self, obj: Base) -> Base | None:
+    def save_many(self, objects: list) -> None:
+        """Save several new instances with a single commit."""
+        self._writer().add_all([self._attach(obj) for obj in objects])
+        commit(self.session)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """
+        Retrieve the instances of a model with the given IDs, by ID,
+        as the caller wrote it (any case or UUID format)
+        """
+        model_class = self._model_class(model_name)
+        # Caller's id -> canonical id of the row
+        params = {}
+
+        for obj_id in ids:
+            try:
+                params[str(obj_id)] = self._coerce(model_class, "id", obj_id)
+            except ValueError:
+                continue
+
+        if not params:
+            return {}
+
+        found = {
+            str(obj.id): obj
+            for obj in self._reader().scalars(
+                self._many_statement(model_name),
+                {"ids": list(set(params.values()))},
+            )
+        }
+
+        return {
+            obj_id: found[str(param)]
+            for obj_id, param in params.items()
+            if str(param) in found
+        }
+
+    def merge(self, obj: Any) -> Any:
+        """
+        Save the state of an instance that isn't one of the session's
+        (like an object of another repository), inserting or updating
+        its row, and return the instance of the session.
+        """
+        stored = self._writer().merge(obj)
+        commit(self.session)
+        return stored
+
+    def update(self, obj: Any) -> Any | None:
         """Update an existing instance of a model."""
-        self.session.add(obj)
-        self.session.commit()
+        obj = self._attach(obj)
+        self._writer().add(obj)
+        commit(self.session)
         return obj
 
-    def delete(self, obj: Base) -> bool:
+    def delete(self, obj: Any) -> bool:
         """Delete an instance of a model."""
-        self.session.delete(obj)
-        self.session.commit()
+        self._writer().delete(self._attach(obj))
+        commit(self.session)
         return True
 
+    def delete_many(self, objects: list) -> int:
+        """Delete several instances with a single commit."""
+        # Stored objects, even detached ones (see _attach)
+        stored = [
+            self._attach(obj)
+            for obj in objects
+            if inspect(obj).key is not None
+        ]
+
+        for obj in stored:
+            self._writer().delete(obj)
+
+        commit(self.session)
+        return len(stored)
+
+    def release(self) -> None:
+        """
+        Closes the session of the current thread when it is a scoped
+        one of its own (db.session is removed by Flask-SQLAlchemy)
+        """
+        if isinstance(self.session, scoped_session) and (
+            self.session is not db.session
+        ):
+            self.session.remove()
+
     def reload(self) -> None:
         """Optional method for reloading data."""
-        pass
-
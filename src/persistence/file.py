@@ -1,132 +1,781 @@
 """
 This module exports a Repository that persists data in a JSON file
+
+By default every change rewrites the whole file. In journaled mode
+(FILE_JOURNAL=1) every change is appended as one record to a journal
+instead, and the file is only rewritten when the journal is compacted.
+
+With the segmented layout (STORAGE_LAYOUT=segmented) every model is
+stored in its own file, and only the files of the models that changed
+are rewritten.
+
+In lazy mode (FILE_LAZY=1) the records read on start are kept as they
+are, and only turned into model instances when get, get_all or lookup
+return them. FILE_LAZY_CACHE_SIZE bounds how many of those instances
+are kept, the least recently used ones go back to being records.
+
+With write-behind (FILE_WRITE_BEHIND=1) changes don't block the request:
+they are marked as dirty and a background thread persists them in
+batches, see WriteBehind. FILE_DURABILITY chooses when data is synced
+to disk (always, batch or os, see utils/constants.py).
+
+The files are shared by the workers: once a change is written, it is
+published on the invalidation bus, and the other workers read the
+objects it wrote again from the files (see src/invalidation.py). An
+object with a change of this worker not written yet keeps it.
+
+Every write, compaction and load holds a lock shared by the workers
+(FILE_LOCK_FILENAME, see src/persistence/locking.py). Under it, before
+rewriting the file, a worker reads again what the others stored since
+it last read or wrote the files, so their writes are never replaced by
+its own copy of the data, and compaction folds the records of every
+worker into the file before emptying the journal.
 """
 
+import atexit
+from collections import OrderedDict
 from datetime import datetime
 import json
+import os
+import threading
+from typing import Any
 from src.models.base import Base
-from src.persistence.repository import Repository
-from utils.constants import FILE_STORAGE_FILENAME
+from src.persistence.indexes import IndexSet
+from src.persistence.journal import Journal
+from src.persistence.locking import FileLock
+from src.persistence.repository import (
+    Repository,
+    by_model,
+    instantiate,
+    stamp,
+)
+from src.persistence.segments import (
+    atomic_write,
+    read_segments,
+    segment_path,
+    write_segments,
+)
+from src.persistence.write_behind import WriteBehind
+from utils.constants import (
+    FILE_DURABILITY_DEFAULT,
+    FILE_DURABILITY_ENV_VAR,
+    FILE_FLUSH_INTERVAL,
+    FILE_FLUSH_MAX_CHANGES,
+    FILE_JOURNAL_COMPACT_MAX_BYTES,
+    FILE_JOURNAL_COMPACT_MIN_BYTES,
+    FILE_JOURNAL_COMPACT_RATIO,
+    FILE_JOURNAL_ENV_VAR,
+    FILE_JOURNAL_FILENAME,
+    FILE_LAZY_CACHE_SIZE_ENV_VAR,
+    FILE_LAZY_ENV_VAR,
+    FILE_LOCK_FILENAME,
+    FILE_SEGMENTS_DIRNAME,
+    FILE_STORAGE_FILENAME,
+    FILE_WRITE_BEHIND_ENV_VAR,
+    STORAGE_LAYOUT_ENV_VAR,
+)
 
 
 class FileRepository(Repository):
     """File Repository"""
 
     __filename = FILE_STORAGE_FILENAME
-    __data: dict[str, list] = {
-        "country": [],
-        "user": [],
-        "amenity": [],
-        "city": [],
-        "review": [],
-        "place": [],
-        "placeamenity": [],
+    __segments_dirname = FILE_SEGMENTS_DIRNAME
+    __data: dict[str, dict[str, Base | dict]] = {
+        "country": {},
+        "user": {},
+        "amenity": {},
+        "city": {},
+        "review": {},
+        "place": {},
+        "placeamenity": {},
     }
+    __indexes = IndexSet()
+    __lock = threading.RLock()
+    __write_lock = threading.RLock()
+    __shared_lock = FileLock(FILE_LOCK_FILENAME)
+
+    def __init__(
+        self,
+        journal: bool | None = None,
+        write_behind: bool | None = None,
+        durability: str | None = None,
+        layout: str | None = None,
+        lazy: bool | None = None,
+        lazy_cache_size: int | None = None,
+    ) -> None:
+        """
+        Calls reload method
+
+        journal, write_behind and lazy enable the journaled, write-behind
+        and lazy modes, by default they are read from the FILE_JOURNAL,
+        FILE_WRITE_BEHIND and FILE_LAZY environment variables, like
+        durability from FILE_DURABILITY, layout from STORAGE_LAYOUT
+        and lazy_cache_size from FILE_LAZY_CACHE_SIZE
+        """
+        if journal is None:
+            journal = os.getenv(FILE_JOURNAL_ENV_VAR, "") in ("1", "true")
+        if write_behind is None:
+            write_behind = os.getenv(
+                FILE_WRITE_BEHIND_ENV_VAR, ""
+            ) in ("1", "true")
+        if durability is None:
+            durability = os.getenv(
+                FILE_DURABILITY_ENV_VAR, FILE_DURABILITY_DEFAULT
+            )
+
+        if layout is None:
+            layout = os.getenv(STORAGE_LAYOUT_ENV_VAR, "single")
+        if lazy is None:
+            lazy = os.getenv(FILE_LAZY_ENV_VAR, "") in ("1", "true")
+        if lazy_cache_size is None:
+            lazy_cache_size = int(os.getenv(FILE_LAZY_CACHE_SIZE_ENV_VAR, 0))
+
+        if durability not in ("always", "batch", "os"):
+            raise ValueError(f"Unknown durability: {durability}")
+        if layout not in ("single", "segmented"):
+            raise ValueError(f"Unknown storage layout: {layout}")
+
+        self.__segmented = layout == "segmented"
+        self.__dirty_models: set[str] = set()
+        self.__segment_sizes: dict[str, int] = {}
+        # Version of the files when this worker last read or wrote them
+        self.__synced_version: tuple | None = None
+
+        self.__lazy = lazy
+        self.__cache_size = lazy_cache_size
+        self.__hydrated: OrderedDict[tuple[str, str], Base] = OrderedDict()
+        self.__hydrations = 0
+
+        self.__fsync = durability != "os"
+        self.__journal = (
+            Journal(FILE_JOURNAL_FILENAME, fsync=self.__fsync)
+            if journal
+            else None
+        )
+        self.__write_behind = None
 
-    def __init__(self) -> None:
-        """Calls reload method"""
         self.reload()
 
+        if write_behind:
+            self.__write_behind = WriteBehind(
+                self._flush,
+                interval=FILE_FLUSH_INTERVAL,
+                max_changes=FILE_FLUSH_MAX_CHANGES,
+                wait=durability == "always",
+            )
+            atexit.register(self.close)
+
+            from src.metrics import register
+
+            register("file_write_behind", self.__write_behind.stats)
+
+        if lazy:
+            from src.metrics import register
+
+            register("file_lazy", self.lazy_stats)
+
     def _save_to_file(self):
-        """Helper method to save the current object data to the file"""
-        serialized = {
-            k: [v.to_dict() for v in l if type(v) is not dict]
-            for k, l in self.__data.items()
+        """
+        Helper method to save the current object data to the file
+
+        The data is written to a temporary file that then replaces
+        the old one, so a crash never leaves a half written file.
+        With the segmented layout only the models changed since the
+        last save are written.
+        """
+        with self.__write_lock, self.__shared_lock:
+            with self.__lock:
+                models = (
+                    self.__dirty_models if self.__segmented else self.__data
+                )
+                serialized = {
+                    model: [
+                        v if isinstance(v, dict) else v.to_dict()
+                        for v in self.__data.get(model, {}).values()
+                    ]
+                    for model in models
+                }
+                self.__dirty_models = set()
+
+            if not self.__segmented:
+                self.__segment_sizes = {
+                    "": atomic_write(
+                        self.__filename,
+                        json.dumps(serialized).encode(),
+                        self.__fsync,
+                    )
+                }
+            else:
+                self.__segment_sizes |= write_segments(
+                    self.__segments_dirname,
+                    {
+                        model: json.dumps(items).encode()
+                        for model, items in serialized.items()
+                    },
+                    ".json",
+                    self.__fsync,
+                )
+
+            self.__synced_version = self._stored_version()
+
+    def _stored_version(self) -> tuple:
+        """
+        Returns the inode, modification time and size of the file, or of
+        every segment, which change whenever a worker rewrites them
+        """
+        if self.__segmented and os.path.isdir(self.__segments_dirname):
+            entries = sorted(
+                os.scandir(self.__segments_dirname), key=lambda e: e.name
+            )
+        elif os.path.exists(self.__filename):
+            entries = [os.stat(self.__filename)]
+        else:
+            entries = []
+
+        versions = []
+
+        for entry in entries:
+            stat = entry if isinstance(entry, os.stat_result) else entry.stat()
+            versions.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+        return tuple(versions)
+
+    def _persist(self, model: str, obj: Base) -> None:
+        """Helper method to persist a single change"""
+        self._persist_many([(model, str(obj.id))])
+
+    def _persist_many(self, changes: list[tuple[str, str]]) -> None:
+        """Helper method to persist several changes with a single write"""
+        if not changes:
+            return
+
+        if self.__write_behind:
+            for model, obj_id in changes:
+                self.__write_behind.mark(model, obj_id)
+        else:
+            self._flush(changes)
+
+    def _flush(self, changes: list[tuple[str, str]]) -> None:
+        """
+        Helper method to persist the objects changed since the last flush
+
+        Objects that aren't in the repository anymore were deleted.
+        Flushes don't overlap, so the last record written for an object
+        always holds its latest state.
+        """
+        if not self.__journal:
+            with self.__write_lock, self.__shared_lock:
+                if self._stored_version() != self.__synced_version:
+                    # Another worker rewrote the files since
+                    self._refresh(None, keep=set(changes))
+                self._save_to_file()
+
+            self._published(changes)
+            return
+
+        with self.__write_lock, self.__shared_lock:
+            with self.__lock:
+                records = [
+                    self._record(model, obj_id) for model, obj_id in changes
+                ]
+
+            self.__journal.append_many(records)
+
+            if self._should_compact():
+                self.compact()
+
+        self._published(changes)
+
+    @staticmethod
+    def _published(changes: list[tuple[str, str]]) -> None:
+        """Tells the other workers which objects were written"""
+        from src import invalidation
+
+        invalidation.publish(changes)
+
+    def _record(self, model: str, obj_id: str) -> dict:
+        """Builds the journal record with the current state of an object"""
+        obj = self.__data.get(model, {}).get(obj_id)
+
+        if obj is None:
+            return {"op": "delete", "model": model, "id": obj_id}
+        if not isinstance(obj, dict):
+            obj = obj.to_dict()
+
+        return {"op": "save", "model": model, "data": obj}
+
+    def _should_compact(self) -> bool:
+        """Checks if the journal reached the compaction thresholds"""
+        size = self.__journal.size
+
+        return size >= FILE_JOURNAL_COMPACT_MAX_BYTES or (
+            size >= FILE_JOURNAL_COMPACT_MIN_BYTES
+            and size
+            >= sum(self.__segment_sizes.values()) * FILE_JOURNAL_COMPACT_RATIO
+        )
+
+    def compact(self) -> None:
+        """
+        Rewrites the file with the current data and empties the journal
+
+        The records the other workers appended are read first, so they
+        are part of the new file. If there is a crash before the journal
+        is emptied, the journal is replayed over the new file on the
+        next start, which gives the same data because every record
+        holds the full object.
+        """
+        with self.__write_lock, self.__shared_lock:
+            if self.__journal:
+                self._refresh(None)
+
+            self._save_to_file()
+
+            if self.__journal:
+                self.__journal.reset()
+
+    def flush(self) -> None:
+        """Persists the pending changes when write-behind is enabled"""
+        if self.__write_behind:
+            self.__write_behind.flush()
+
+    def close(self) -> None:
+        """Flushes the pending changes and stops the background writer"""
+        if self.__write_behind:
+            self.__write_behind.close()
+
+    def lazy_stats(self) -> dict:
+        """Returns how many records were turned into instances"""
+        return {
+            "hydrations": self.__hydrations,
+            "cached_instances": len(self.__hydrated),
+            "cache_size": self.__cache_size,
         }
 
-        with open(self.__filename, "w") as file:
-            json.dump(serialized, file)
+    @staticmethod
+    def _id_of(value: Base | dict) -> str:
+        """Returns the id of an instance or of a record"""
+        return str(value["id"] if isinstance(value, dict) else value.id)
+
+    def _hydrate(self, model: str, value: Base | dict | None):
+        """
+        Returns the model instance of a stored value, building it
+        if the value is still a record (lazy mode)
+        """
+        if value is None or not self.__lazy:
+            return value
+
+        key = (model, self._id_of(value))
+
+        with self.__lock:
+            if key in self.__hydrated:
+                self.__hydrated.move_to_end(key)
+                return self.__hydrated[key]
+
+            if not isinstance(value, dict):
+                return value
+
+            instance = instantiate(model, value)
+            self.__hydrations += 1
+
+            if not self.__cache_size:
+                # Unbounded, the instance replaces the record
+                self.__data[model][key[1]] = instance
+                return instance
+
+            self.__keep(key, instance)
+
+            return instance
+
+    def __keep(self, key: tuple[str, str], instance: Base) -> None:
+        """
+        Keeps an instance in the bounded cache of the lazy mode,
+        evicted instances go back to being records
+        """
+        self.__hydrated[key] = instance
+        self.__hydrated.move_to_end(key)
+
+        while len(self.__hydrated) > self.__cache_size:
+            (model, obj_id), evicted = self.__hydrated.popitem(last=False)
+            objects = self.__data.get(model, {})
+
+            if objects.get(obj_id) is evicted:
+                objects[obj_id] = evicted.to_dict()
 
     def get_all(self, model_name: str):
         """Get all objects of a given model"""
-        return self.__data.get(model_name, [])
+        return [
+            self._hydrate(model_name, value)
+            for value in list(self.__data.get(model_name, {}).values())
+        ]
 
     def get(self, model_name: str, obj_id: str):
         """Get an object by its ID"""
-        for obj in self.get_all(model_name):
-            if obj.id == obj_id:
-                return obj
-        return None
+        return self._hydrate(
+            model_name, self.__data.get(model_name, {}).get(str(obj_id))
+        )
 
-    def reload(self):
-        """Reloads the data from the file"""
-        file_data = {}
+    def lookup(self, model_name: str, **fields) -> list:
+        """Get all objects of a given model matching the given fields"""
+        return [
+            self._hydrate(model_name, value)
+            for value in self.__indexes.filter(
+                model_name, self.__data.get(model_name, {}), fields
+            )
+        ]
+
+    def init_app(self, app) -> None:
+        """Reads again the objects the other workers write"""
+        from src import invalidation
+
+        invalidation.subscribe(self)
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Reads the objects another worker wrote again, by model and id"""
+        if any(obj_id is None for _, obj_id in changes):
+            self._refresh(None)
+            return
+
+        self._refresh({(model, str(obj_id)) for model, obj_id in changes})
+
+    def clear(self) -> None:
+        """Reads every object again, once events were missed"""
+        self._refresh(None)
+
+    def _refresh(
+        self,
+        keys: set[tuple[str, str]] | None,
+        keep: set[tuple[str, str]] = frozenset(),
+    ) -> None:
+        """
+        Replaces the given (model, id) objects, or every object if keys
+        is None, with the ones stored in the file and the journal
+
+        Objects with a change not written yet, and the ones in keep,
+        are kept, like the objects that didn't change
+        """
         try:
-            with open(self.__filename, "r") as file:
-                file_data = json.load(file)
+            file_data = self._read_snapshot(as_records=True)
         except FileNotFoundError:
+            file_data = {}
+
+        stored: dict[tuple[str, str], dict | None] = {}
+
+        for model, values in file_data.items():
+            for value in values:
+                key = (model, self._id_of(value))
+
+                if keys is None or key in keys:
+                    stored[key] = value
+
+        if self.__journal:
+            # Records may still be appended by the other workers
+            for record in self.__journal.replay(repair=False):
+                if record["op"] == "delete":
+                    key = (record["model"], record["id"])
+                    value = None
+                else:
+                    value = record["data"]
+                    key = (record["model"], self._id_of(value))
+
+                if keys is None or key in keys:
+                    stored[key] = value
+
+        with self.__write_lock, self.__lock:
+            if keys is None:
+                keys = set(stored) | {
+                    (model, obj_id)
+                    for model, objects in self.__data.items()
+                    for obj_id in objects
+                }
+
+            for model, obj_id in keys:
+                if (model, obj_id) in keep or (
+                    self.__write_behind
+                    and self.__write_behind.dirty(model, obj_id)
+                ):
+                    continue
+
+                objects = self.__data.setdefault(model, {})
+                value = stored.get((model, obj_id))
+                current = objects.get(obj_id)
+
+                if current is not None and value == (
+                    current if isinstance(current, dict) else current.to_dict()
+                ):
+                    continue
+
+                self.__hydrated.pop((model, obj_id), None)
+
+                if value is None:
+                    if objects.pop(obj_id, None) is not None:
+                        self.__indexes.remove(model, obj_id)
+                    continue
+
+                if not self.__lazy:
+                    value = instantiate(model, value)
+
+                objects[obj_id] = value
+                self.__indexes.add(model, obj_id, value)
+
+    def reload(self):
+        """
+        Reloads the data from the file and then from the journal,
+        and seeds it when nothing was stored yet
+        """
+        with self.__write_lock, self.__shared_lock:
+            if self._load():
+                return
+
             from src.models.country import Country
 
-            self.__data["country"] = [Country("Uruguay", "UY")]
+            if self.get_by("country", code="UY") is None:
+                self.save(Country("Uruguay", "UY"))
 
-            self._save_to_file()
+    def _load(self) -> bool:
+        """
+        Reads the file and replays the journal, the shared lock must be
+        held; returns False if nothing was stored yet
+        """
+        file_found = True
+
+        try:
+            file_data = self._read_snapshot()
+        except FileNotFoundError:
+            file_data = {}
+            file_found = False
+
+        self.__synced_version = self._stored_version()
+
+        with self.__lock:
+            for model, values in file_data.items():
+                objects = self.__data.setdefault(model, {})
+
+                for value in values:
+                    obj_id = self._id_of(value)
+
+                    if obj_id not in objects:
+                        objects[obj_id] = value
+                        self.__indexes.add(model, obj_id, value)
+
+        with self.__lock:
+            self.__dirty_models = set()
+
+            if self.__segmented and not os.path.isdir(
+                self.__segments_dirname
+            ):
+                # Data of the single file layout, moved on the next save
+                self.__dirty_models = set(file_data)
+
+        if self.__journal:
+            for record in self.__journal.replay():
+                self._apply(record)
+
+        return file_found or bool(self.__journal and self.__journal.records)
+
+    def _read_snapshot(
+        self, as_records: bool = False
+    ) -> dict[str, list[Base | dict]]:
+        """
+        Reads the objects stored in the file, or in the segments
+        (in parallel) with the segmented layout
+
+        In lazy mode, or with as_records, the records are returned
+        as they are
+
+        Raises FileNotFoundError if nothing was stored yet
+        """
+        def build(model: str, items: list[dict]) -> list[Base | dict]:
+            """Builds the instances of the records of a model"""
+            if self.__lazy or as_records:
+                return items
+
+            return [instantiate(model, item) for item in items]
+
+        def load(model: str, content: bytes) -> list[Base | dict]:
+            """Builds the instances stored in a segment"""
+            return build(model, json.loads(content))
+
+        if self.__segmented and os.path.isdir(self.__segments_dirname):
+            data = read_segments(self.__segments_dirname, ".json", load)
+            self.__segment_sizes = {
+                model: os.path.getsize(
+                    segment_path(self.__segments_dirname, model, ".json")
+                )
+                for model in data
+            }
+            return data
+
+        with open(self.__filename, "rb") as file:
+            content = file.read()
 
-        from src.models.amenity import Amenity, PlaceAmenity
-        from src.models.city import City
-        from src.models.country import Country
-        from src.models.place import Place
-        from src.models.review import Review
-        from src.models.user import User
-
-        models = {
-            "amenity": Amenity,
-            "city": City,
-            "country": Country,
-            "place": Place,
-            "placeamenity": PlaceAmenity,
-            "review": Review,
-            "user": User,
+        if not self.__segmented:
+            self.__segment_sizes = {"": len(content)}
+
+        return {
+            model: build(model, items)
+            for model, items in json.loads(content).items()
         }
 
-        for model, data in file_data.items():
-            for item in data:
-                instance: Base = models[model](**item)
+    def _apply(self, record: dict) -> None:
+        """Applies a journal record to the data in memory"""
+        model = record["model"]
+        objects = self.__data.setdefault(model, {})
+        self.__dirty_models.add(model)
 
-                if "created_at" in item:
-                    instance.created_at = datetime.fromisoformat(
-                        item["created_at"]
-                    )
-                if "updated_at" in item:
-                    instance.updated_at = datetime.fromisoformat(
-                        item["updated_at"]
-                    )
+        if record["op"] == "delete":
+            if objects.pop(record["id"], None) is not None:
+                self.__indexes.remove(model, record["id"])
+                self.__hydrated.pop((model, record["id"]), None)
+            return
+
+        if self.__lazy:
+            value = record["data"]
+            self.__hydrated.pop((model, str(value["id"])), None)
+        else:
+            value = instantiate(model, record["data"])
+
+        obj_id = self._id_of(value)
 
-                self.save(data=instance, save_to_file=False)
+        objects[obj_id] = value
+        self.__indexes.add(model, obj_id, value)
 
     def save(self, data: Base, save_to_file=True):
         """Save an object to the repository"""
         model: str = data.__class__.__name__.lower()
 
-        if model not in self.__data:
-            self.__data[model] = []
+        stamp(data)
 
-        self.__data[model].append(data)
+        with self.__lock:
+            objects = self.__data.setdefault(model, {})
+
+            if str(data.id) not in objects:
+                self.__indexes.check(model, data.id, data)
+                objects[str(data.id)] = data
+                self.__indexes.add(model, data.id, data)
+
+                if self.__lazy and self.__cache_size:
+                    self.__keep((model, str(data.id)), data)
+
+            self.__dirty_models.add(model)
 
         if save_to_file:
-            self._save_to_file()
+            self._persist(model, data)
+
+    def save_many(self, objects: list[Base]) -> None:
+        """
+        Save several objects to the repository, with a single write
+
+        The unique keys of every object are checked before any of them
+        is stored, so either all of them are saved or none is
+        """
+        for obj in objects:
+            stamp(obj)
+
+        groups = by_model(objects)
+        changes = []
+
+        with self.__lock:
+            for model, group in groups.items():
+                stored = self.__data.setdefault(model, {})
+                groups[model] = [
+                    obj for obj in group if str(obj.id) not in stored
+                ]
+                self.__indexes.check_many(
+                    model, [(obj.id, obj) for obj in groups[model]]
+                )
+
+            for model, group in groups.items():
+                stored = self.__data[model]
+
+                for obj in group:
+                    stored[str(obj.id)] = obj
+                    self.__indexes.add(model, obj.id, obj)
+                    changes.append((model, str(obj.id)))
+
+                    if self.__lazy and self.__cache_size:
+                        self.__keep((model, str(obj.id)), obj)
+
+                if group:
+                    self.__dirty_models.add(model)
+
+        self._persist_many(changes)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """Get the objects of a model with the given ids, by id"""
+        stored = self.__data.get(model_name, {})
+        found = {}
+
+        for obj_id in map(str, ids):
+            value = stored.get(obj_id)
+
+            if value is not None:
+                found[obj_id] = self._hydrate(model_name, value)
+
+        return found
 
     def update(self, obj: Base):
         """Update an object in the repository"""
         cls = obj.__class__.__name__.lower()
 
-        for i, o in enumerate(self.__data[cls]):
-            if o.id == obj.id:
-                obj.updated_at = datetime.now()
-                self.__data[cls][i] = obj
-                self._save_to_file()
-                return obj
+        with self.__lock:
+            objects = self.__data.get(cls, {})
+
+            if str(obj.id) not in objects:
+                return None
+
+            self.__indexes.check_update(cls, obj.id, obj)
+
+            obj.updated_at = datetime.now()
+            objects[str(obj.id)] = obj
+            self.__indexes.add(cls, obj.id, obj)
+            self.__dirty_models.add(cls)
+
+            if self.__lazy and self.__cache_size:
+                self.__keep((cls, str(obj.id)), obj)
 
-        return None
+        self._persist(cls, obj)
+
+        return obj
 
     def delete(self, obj: Base):
         """Delete an object from the repository"""
         class_name = obj.__class__.__name__.lower()
 
-        if obj not in self.__data[class_name]:
-            return False
+        with self.__lock:
+            objects = self.__data.get(class_name, {})
+
+            if objects.pop(str(obj.id), None) is None:
+                return False
 
-        self.__data[class_name].remove(obj)
+            self.__indexes.remove(class_name, obj.id)
+            self.__dirty_models.add(class_name)
+            self.__hydrated.pop((class_name, str(obj.id)), None)
 
-        self._save_to_file()
+        self._persist(class_name, obj)
 
         return True
+
+    def delete_many(self, objects: list[Base]) -> int:
+        """
+        Delete several objects from the repository, with a single write,
+        returns how many were stored
+        """
+        changes = []
+
+        with self.__lock:
+            for model, group in by_model(objects).items():
+                stored = self.__data.get(model, {})
+
+                for obj in group:
+                    if stored.pop(str(obj.id), None) is None:
+                        continue
+
+                    self.__indexes.remove(model, obj.id)
+                    self.__dirty_models.add(model)
+                    self.__hydrated.pop((model, str(obj.id)), None)
+                    changes.append((model, str(obj.id)))
+
+        self._persist_many(changes)
+
+        return len(changes)
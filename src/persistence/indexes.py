@@ -0,0 +1,295 @@
+"""
+This module exports the secondary indexes used by the
+in-process repositories (memory, file and pickle)
+
+An index maps the values of one or more fields of a model
+to the ids of the objects that have those values, so looking up
+the reviews of a place doesn't need to go through every review.
+
+A unique index maps the natural key of a model (like the email of a user)
+to a single id, so it can also reject the objects that would duplicate it.
+"""
+
+from typing import Any, Iterable
+
+
+# Fields to index by model, each tuple is one (maybe composite) index
+SECONDARY_INDEXES: dict[str, list[tuple[str, ...]]] = {
+    "review": [("place_id",), ("user_id",)],
+    "city": [("country_code",)],
+    "place": [("city_id",), ("host_id",)],
+    "placeamenity": [("place_id", "amenity_id")],
+}
+
+# Natural keys by model, no two objects of a model can share them
+UNIQUE_INDEXES: dict[str, list[tuple[str, ...]]] = {
+    "user": [("email",)],
+    "country": [("code",)],
+}
+
+
+def declared_indexes() -> dict[str, list[tuple[str, ...]]]:
+    """Returns the secondary and unique indexes of every model"""
+    return {
+        model: SECONDARY_INDEXES.get(model, []) + UNIQUE_INDEXES.get(model, [])
+        for model in SECONDARY_INDEXES | UNIQUE_INDEXES
+    }
+
+
+def field_value(obj: Any, field: str) -> Any:
+    """Returns the value of a field of an object or of a raw record"""
+    if isinstance(obj, dict):
+        return obj.get(field)
+
+    return getattr(obj, field, None)
+
+
+def normalize(value: Any) -> str | None:
+    """
+    Normalizes a value to be used as an index key
+
+    Ids can be UUID objects or strings depending on where they come from,
+    so every value is compared as a string
+    """
+    return None if value is None else str(value)
+
+
+def matches(obj: Any, query: dict) -> bool:
+    """Checks if every field of the query has the same value in obj"""
+    return all(
+        normalize(field_value(obj, field)) == normalize(value)
+        for field, value in query.items()
+    )
+
+
+class IndexSet:
+    """
+    Secondary indexes of every model of a repository
+
+    The key each object was indexed with is remembered,
+    so an object can be moved to its new key when the indexed
+    field changes, even if the object was modified in place.
+
+    Unique indexes aren't enforced by add, the repositories call check
+    before storing an object, while holding their write lock. An update
+    calls check_update instead: the stored object may be the instance
+    the caller modified, so its indexed fields are set back to the
+    values it was indexed with when the update is rejected.
+    """
+
+    def __init__(
+        self,
+        declarations: dict[str, list[tuple[str, ...]]] | None = None,
+        unique: dict[str, list[tuple[str, ...]]] | None = None,
+    ) -> None:
+        """Creates empty indexes for the given declarations"""
+        self.__declarations = (
+            SECONDARY_INDEXES if declarations is None else declarations
+        )
+        self.__unique = UNIQUE_INDEXES if unique is None else unique
+        self.__entries: dict[tuple, dict[tuple, dict[str, None]]] = {}
+        self.__keys: dict[tuple, dict[str, tuple]] = {}
+        self.__unique_entries: dict[tuple, dict[tuple, str]] = {}
+        self.__unique_keys: dict[tuple, dict[str, tuple]] = {}
+        # model -> id -> indexed field -> value it was indexed with
+        self.__values: dict[str, dict[str, dict[str, Any]]] = {}
+
+        self.clear()
+
+    def clear(self) -> None:
+        """Removes every indexed object"""
+        for model_name, indexes in self.__declarations.items():
+            for fields in indexes:
+                self.__entries[(model_name, fields)] = {}
+                self.__keys[(model_name, fields)] = {}
+
+        for model_name, indexes in self.__unique.items():
+            for fields in indexes:
+                self.__unique_entries[(model_name, fields)] = {}
+                self.__unique_keys[(model_name, fields)] = {}
+
+        self.__values.clear()
+
+    def check(self, model_name: str, obj_id: str, obj: Any) -> None:
+        """
+        Raises ValueError if another object already has
+        one of the unique keys of obj
+
+        Keys with a None value are not unique, like NULL in a database
+        """
+        for fields in self.__unique.get(model_name, []):
+            key = tuple(normalize(field_value(obj, f)) for f in fields)
+            owner = self.__unique_entries[(model_name, fields)].get(key)
+
+            if None not in key and owner not in (None, str(obj_id)):
+                values = ", ".join(
+                    f"{f}={v}" for f, v in zip(fields, key)
+                )
+                raise ValueError(f"{model_name} with {values} already exists")
+
+    def check_update(self, model_name: str, obj_id: str, obj: Any) -> None:
+        """
+        Like check, and sets the indexed fields of obj back to the values
+        it was indexed with before raising
+        """
+        try:
+            self.check(model_name, obj_id, obj)
+        except ValueError:
+            self.restore(model_name, obj_id, obj)
+            raise
+
+    def restore(self, model_name: str, obj_id: str, obj: Any) -> None:
+        """Sets the indexed fields of obj back to the indexed values"""
+        values = self.__values.get(model_name, {}).get(str(obj_id), {})
+
+        for field, value in values.items():
+            setattr(obj, field, value)
+
+    def check_many(self, model_name: str, objects: list[tuple[str, Any]]):
+        """
+        Raises ValueError if one of the (id, object) pairs would duplicate
+        a unique key of a stored object, or of another pair
+        """
+        claimed: dict[tuple, str] = {}
+
+        for obj_id, obj in objects:
+            self.check(model_name, obj_id, obj)
+
+            for fields in self.__unique.get(model_name, []):
+                key = tuple(normalize(field_value(obj, f)) for f in fields)
+
+                if None in key:
+                    continue
+
+                if claimed.setdefault((fields, key), str(obj_id)) != str(
+                    obj_id
+                ):
+                    values = ", ".join(
+                        f"{f}={v}" for f, v in zip(fields, key)
+                    )
+                    raise ValueError(
+                        f"{model_name} with {values} is duplicated"
+                    )
+
+    def add(self, model_name: str, obj_id: str, obj: Any) -> None:
+        """Indexes an object, moving it if its indexed fields changed"""
+        obj_id = str(obj_id)
+        values = {}
+
+        for fields in self.__unique.get(model_name, []):
+            entries = self.__unique_entries[(model_name, fields)]
+            keys = self.__unique_keys[(model_name, fields)]
+
+            values.update((f, field_value(obj, f)) for f in fields)
+            key = tuple(normalize(values[f]) for f in fields)
+            old_key = keys.pop(obj_id, None)
+
+            if old_key is not None and entries.get(old_key) == obj_id:
+                del entries[old_key]
+
+            if None not in key:
+                entries[key] = obj_id
+                keys[obj_id] = key
+
+        for fields in self.__declarations.get(model_name, []):
+            entries = self.__entries[(model_name, fields)]
+            keys = self.__keys[(model_name, fields)]
+
+            values.update((f, field_value(obj, f)) for f in fields)
+            key = tuple(normalize(values[f]) for f in fields)
+            old_key = keys.get(obj_id)
+
+            if old_key == key:
+                continue
+
+            if old_key is not None:
+                self.__discard(entries, old_key, obj_id)
+
+            entries.setdefault(key, {})[obj_id] = None
+            keys[obj_id] = key
+
+        if values:
+            self.__values.setdefault(model_name, {})[obj_id] = values
+
+    def remove(self, model_name: str, obj_id: str) -> None:
+        """Removes an object from every index of its model"""
+        obj_id = str(obj_id)
+        self.__values.get(model_name, {}).pop(obj_id, None)
+
+        for fields in self.__unique.get(model_name, []):
+            entries = self.__unique_entries[(model_name, fields)]
+            old_key = self.__unique_keys[(model_name, fields)].pop(
+                obj_id, None
+            )
+
+            if old_key is not None and entries.get(old_key) == obj_id:
+                del entries[old_key]
+
+        for fields in self.__declarations.get(model_name, []):
+            old_key = self.__keys[(model_name, fields)].pop(obj_id, None)
+
+            if old_key is not None:
+                self.__discard(
+                    self.__entries[(model_name, fields)], old_key, obj_id
+                )
+
+    def find(self, model_name: str, query: dict) -> Iterable[str] | None:
+        """
+        Returns the ids of the objects that may match the query
+
+        A unique index is used first, otherwise the index with the most
+        fields in the query. Returns None if the model doesn't have
+        an index usable for the query
+        """
+        for fields in self.__unique.get(model_name, []):
+            if not all(f in query for f in fields):
+                continue
+
+            key = tuple(normalize(query[f]) for f in fields)
+
+            if None not in key:
+                owner = self.__unique_entries[(model_name, fields)].get(key)
+
+                return [] if owner is None else [owner]
+
+        usable = [
+            fields
+            for fields in self.__declarations.get(model_name, [])
+            if all(f in query for f in fields)
+        ]
+
+        if not usable:
+            return None
+
+        fields = max(usable, key=len)
+        key = tuple(normalize(query[f]) for f in fields)
+
+        return list(self.__entries[(model_name, fields)].get(key, {}))
+
+    def filter(self, model_name: str, objects: dict, query: dict) -> list:
+        """
+        Returns the objects of a model that match every field of the query
+
+        objects is the id to object dict of the model
+        """
+        ids = self.find(model_name, query)
+
+        if ids is None:
+            candidates = objects.values()
+        else:
+            candidates = (objects[i] for i in ids if i in objects)
+
+        return [obj for obj in candidates if matches(obj, query)]
+
+    @staticmethod
+    def __discard(entries: dict, key: tuple, obj_id: str) -> None:
+        """Removes an id from an index key, dropping the key if empty"""
+        ids = entries.get(key)
+
+        if ids is None:
+            return
+
+        ids.pop(obj_id, None)
+
+        if not ids:
+            del entries[key]
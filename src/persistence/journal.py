@@ -0,0 +1,204 @@
+"""
+This module exports an append-only journal of repository mutations
+
+Every record is written on its own line with a checksum:
+
+    <crc32 as 8 hex digits> <record as json>
+
+A crash in the middle of an append can only leave a torn last line,
+which fails the checksum. Replay stops at the first record that can't be
+trusted and cuts it off the file, so new records are never appended
+after a broken one and every record before it is kept.
+
+PickleJournal stores the records as pickles instead, each one framed by
+its length and checksum, so they can hold model instances as they are.
+
+A journal may be appended to by several workers: appends go to the end
+of the file whatever the worker, and the file is opened again when
+another process replaced it. The repositories append, reset and replay
+with repair while holding the lock of their files (see
+src/persistence/locking.py).
+"""
+
+import json
+import os
+import pickle
+import struct
+from typing import BinaryIO, Iterator
+import zlib
+
+
+class Journal:
+    """Append-only journal stored in a file"""
+
+    def __init__(self, filename: str, fsync: bool = True) -> None:
+        """
+        Opens (or creates) the journal
+
+        If fsync is True every append is synced to disk before returning
+        """
+        self.filename = filename
+        self.fsync = fsync
+        self.records = 0
+        self.__file = open(filename, "ab")
+
+    @property
+    def size(self) -> int:
+        """Size of the journal in bytes, with the records of every worker"""
+        return os.fstat(self.__file.fileno()).st_size
+
+    def reopen(self) -> None:
+        """Opens the file again if another process replaced it"""
+        try:
+            replaced = (
+                os.stat(self.filename).st_ino
+                != os.fstat(self.__file.fileno()).st_ino
+            )
+        except FileNotFoundError:
+            replaced = True
+
+        if replaced:
+            self.__file.close()
+            self.__file = open(self.filename, "ab")
+
+    @staticmethod
+    def encode(record: dict) -> bytes:
+        """Encodes a record as a journal line"""
+        payload = json.dumps(record, separators=(",", ":")).encode()
+
+        return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+    @staticmethod
+    def decode(line: bytes) -> dict | None:
+        """Decodes a journal line, returns None if it can't be trusted"""
+        if len(line) < 10 or not line.endswith(b"\n") or line[8:9] != b" ":
+            return None
+
+        payload = line[9:-1]
+
+        try:
+            if int(line[:8], 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload)
+        except ValueError:
+            return None
+
+    def read(self, file: BinaryIO) -> Iterator[tuple[int, dict | None]]:
+        """
+        Yields the size of every stored record with the record,
+        or with None if it can't be trusted
+        """
+        for line in file:
+            yield len(line), self.decode(line)
+
+    def replay(self, repair: bool = True) -> Iterator[dict]:
+        """
+        Yields every valid record of the journal in order
+
+        Anything after the first invalid record is removed from the file,
+        unless repair is False: used to read the records other processes
+        append, where an invalid last record may still be being written
+        """
+        valid_until = 0
+        self.records = 0
+
+        with open(self.filename, "rb") as file:
+            for size, record in self.read(file):
+                if record is None:
+                    break
+
+                valid_until += size
+                self.records += 1
+
+                yield record
+
+        if not repair:
+            return
+
+        self.reopen()
+
+        if valid_until != os.path.getsize(self.filename):
+            self.__file.truncate(valid_until)
+
+        self.__file.seek(0, os.SEEK_END)
+
+    def append(self, record: dict) -> None:
+        """Appends a record to the journal"""
+        self.append_many([record])
+
+    def append_many(self, records: list[dict]) -> None:
+        """Appends several records with a single write"""
+        if not records:
+            return
+
+        self.reopen()
+        self.__file.write(b"".join(self.encode(r) for r in records))
+        self.__file.flush()
+
+        if self.fsync:
+            os.fsync(self.__file.fileno())
+
+        self.records += len(records)
+
+    def reset(self) -> None:
+        """
+        Removes every record, used once they are part of a snapshot
+
+        The file is truncated in place, so the other workers keep
+        appending to it
+        """
+        self.reopen()
+        self.__file.truncate(0)
+        self.__file.seek(0)
+        self.__file.flush()
+
+        if self.fsync:
+            os.fsync(self.__file.fileno())
+
+        self.records = 0
+
+    def close(self) -> None:
+        """Closes the journal file"""
+        self.__file.close()
+
+
+class PickleJournal(Journal):
+    """
+    Journal of pickled records
+
+    Every record is stored as <length u32> <crc32 u32> <pickle>, pickled
+    with the highest protocol
+    """
+
+    FRAME = struct.Struct("<II")
+
+    @classmethod
+    def encode(cls, record: dict) -> bytes:
+        """Encodes a record as a framed pickle"""
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+
+        return cls.FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def read(self, file: BinaryIO) -> Iterator[tuple[int, dict | None]]:
+        """
+        Yields the size of every stored record with the record,
+        or with None if it can't be trusted
+        """
+        while header := file.read(self.FRAME.size):
+            if len(header) < self.FRAME.size:
+                yield len(header), None
+                return
+
+            length, crc = self.FRAME.unpack(header)
+            payload = file.read(length)
+
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                yield self.FRAME.size + len(payload), None
+                return
+
+            try:
+                record = pickle.loads(payload)
+            except Exception:
+                record = None
+
+            yield self.FRAME.size + length, record
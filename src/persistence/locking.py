@@ -0,0 +1,67 @@
+"""
+This module exports the lock the workers sharing the files of a
+repository take around their writes
+
+The lock is an flock on a file next to the data, so it is released by
+the kernel if a worker dies while holding it. Where flock isn't
+available (Windows) only the threads of the process are serialized.
+"""
+
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock:
+    """
+    Exclusive lock shared by the processes that lock the same path,
+    reentrant within a process
+    """
+
+    def __init__(self, path: str) -> None:
+        """Creates the lock, the file is only opened when locking"""
+        self.path = path
+
+        self.__lock = threading.RLock()
+        self.__depth = 0
+        self.__file = None
+
+    def __enter__(self) -> "FileLock":
+        """
+        Waits for the lock
+
+        The file is opened again on every outermost acquire, so a forked
+        process never shares the open file (and its lock) of its parent
+        """
+        self.__lock.acquire()
+
+        if self.__depth == 0:
+            try:
+                self.__file = open(self.path, "ab")
+
+                if fcntl:
+                    fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                if self.__file:
+                    self.__file.close()
+                    self.__file = None
+                self.__lock.release()
+                raise
+
+        self.__depth += 1
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Releases the lock"""
+        self.__depth -= 1
+
+        if self.__depth == 0:
+            # Closing the file releases the flock
+            self.__file.close()
+            self.__file = None
+
+        self.__lock.release()
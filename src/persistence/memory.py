@@ -1,11 +1,45 @@
 """
-This module exports a Repository that does not persist data,
-it only stores it in memory
+This module exports a Repository that stores data in memory
+
+With background snapshots (MEMORY_SNAPSHOTS=1) the data is saved
+like Redis BGSAVE: every MEMORY_SNAPSHOT_INTERVAL seconds, or after
+MEMORY_SNAPSHOT_MAX_CHANGES changes, the process forks and the child
+writes the data it inherited, while the parent keeps serving requests.
+The last complete snapshot is loaded on start, so at most the changes
+of one interval are lost.
+
+Forking a process with several threads only copies the forking one:
+a lock held by another thread at that moment (a logging handler, the
+allocator of a C extension) stays locked forever in the child. The
+child only pickles the data, which is safe as long as no such lock is
+needed, so a child that doesn't finish in MEMORY_SNAPSHOT_TIMEOUT
+seconds is killed and the snapshot is retried on the next interval.
+Code that needs other locks must not run in the child.
+
+Every worker process has its own data (and writes its own snapshots
+over the others'), so MemoryRepository is only supported with a single
+worker, see src/invalidation.py.
 """
 
+import atexit
 from datetime import datetime
+import os
+import pickle
+import signal
+import threading
+import time
 from src.models.base import Base
-from src.persistence.repository import Repository
+from src.persistence.indexes import IndexSet
+from src.persistence.repository import Repository, by_model, stamp
+from src.persistence.segments import atomic_write
+from src.persistence.write_behind import WriteBehind
+from utils.constants import (
+    MEMORY_SNAPSHOT_FILENAME,
+    MEMORY_SNAPSHOT_INTERVAL,
+    MEMORY_SNAPSHOT_MAX_CHANGES,
+    MEMORY_SNAPSHOT_TIMEOUT,
+    MEMORY_SNAPSHOTS_ENV_VAR,
+)
 from utils.populate import populate_db
 
 
@@ -13,68 +47,317 @@ class MemoryRepository(Repository):
     """
     A Repository that does not persist data, it only stores it in memory
 
+    Objects are stored by model name and then by their id, so get, save,
+    update and delete don't depend on the amount of stored objects.
+    Dicts keep insertion order, so get_all is returned in the order
+    the objects were saved.
 
+    Foreign key fields are also indexed (see SECONDARY_INDEXES),
+    so lookup doesn't need to go through every object of a model.
+    Natural keys have unique indexes (see UNIQUE_INDEXES), saving
+    an object that would duplicate one raises a ValueError.
 
-    Every time the server is restarted, the data is lost
+    Unless background snapshots are enabled, every time the server
+    is restarted, the data is lost
     """
 
-    __data: dict[str, list] = {
-        "country": [],
-        "user": [],
-        "amenity": [],
-        "city": [],
-        "review": [],
-        "place": [],
-        "placeamenity": [],
+    __snapshot_filename = MEMORY_SNAPSHOT_FILENAME
+
+    __data: dict[str, dict[str, Base]] = {
+        "country": {},
+        "user": {},
+        "amenity": {},
+        "city": {},
+        "review": {},
+        "place": {},
+        "placeamenity": {},
     }
+    __indexes = IndexSet()
+    __lock = threading.RLock()
+
+    def __init__(
+        self, snapshots: bool | None = None, isolated: bool = False
+    ) -> None:
+        """
+        Calls reload method
+
+        snapshots enables background snapshots, by default it is read
+        from the MEMORY_SNAPSHOTS environment variable
+
+        An isolated repository has its own data instead of sharing
+        the data of the process (used by the shards of
+        ShardedRepository), it starts empty and isn't snapshotted
+        """
+        self.__snapshots = None
+        self.__isolated = isolated
+
+        if isolated:
+            self.__data = {model: {} for model in self.__data}
+            self.__indexes = IndexSet()
+            self.__lock = threading.RLock()
+            return
+
+        if snapshots is None:
+            snapshots = os.getenv(MEMORY_SNAPSHOTS_ENV_VAR, "") in (
+                "1",
+                "true",
+            )
 
-    def __init__(self) -> None:
-        """Calls reload method"""
         self.reload()
 
+        if snapshots:
+            # The snapshot thread only decides when to save,
+            # the data is written by a forked child (see bgsave)
+            self.__snapshots = WriteBehind(
+                lambda changes: self.bgsave(),
+                interval=MEMORY_SNAPSHOT_INTERVAL,
+                max_changes=MEMORY_SNAPSHOT_MAX_CHANGES,
+            )
+            atexit.register(self.close)
+
+            from src.metrics import register
+
+            register("memory_snapshots", self.__snapshots.stats)
+
+    def bgsave(self) -> None:
+        """
+        Writes a snapshot of the data from a forked child process
+
+        The child gets a copy-on-write view of the data as it was when
+        forking, so the snapshot is consistent without copying anything
+        in the parent. The caller waits for the child (the snapshot
+        thread, not a request); OSError is raised if the child failed,
+        and TimeoutError if it was killed after MEMORY_SNAPSHOT_TIMEOUT
+        seconds (see the module docstring). Where fork isn't available
+        the data is written in-process.
+        """
+        if not hasattr(os, "fork"):
+            with self.__lock:
+                data = pickle.dumps(self.__data, pickle.HIGHEST_PROTOCOL)
+            atomic_write(self.__snapshot_filename, data)
+            return
+
+        # No write is halfway done while forking
+        with self.__lock:
+            pid = os.fork()
+
+        if pid == 0:
+            status = 1
+            try:
+                atomic_write(
+                    self.__snapshot_filename,
+                    pickle.dumps(self.__data, pickle.HIGHEST_PROTOCOL),
+                )
+                status = 0
+            finally:
+                # Never run the parent's cleanup (atexit, open files)
+                os._exit(status)
+
+        deadline = time.monotonic() + MEMORY_SNAPSHOT_TIMEOUT
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            if time.monotonic() >= deadline:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                raise TimeoutError(f"Snapshot child {pid} timed out")
+            time.sleep(0.01)
+
+        if os.waitstatus_to_exitcode(status) != 0:
+            raise OSError(f"Snapshot child {pid} failed")
+
+    def flush(self) -> None:
+        """Writes a snapshot now if there are unsaved changes"""
+        if self.__snapshots:
+            self.__snapshots.flush()
+
+    def close(self) -> None:
+        """Writes the unsaved changes and stops the snapshot thread"""
+        if self.__snapshots:
+            self.__snapshots.close()
+
+    def _changed(self, model: str, obj_id: str) -> None:
+        """Counts a change towards the next snapshot"""
+        if self.__snapshots:
+            self.__snapshots.mark(model, obj_id)
+
     def get_all(self, model_name: str) -> list:
         """Get all objects of a given model"""
-        return self.__data.get(model_name, [])
+        return list(self.__data.get(model_name, {}).values())
 
     def get(self, model_name: str, obj_id: str):
         """Get an object by its ID"""
-        for obj in self.get_all(model_name):
-            if obj.id == obj_id:
-                return obj
-        return None
+        return self.__data.get(model_name, {}).get(str(obj_id))
+
+    def lookup(self, model_name: str, **fields) -> list:
+        """Get all objects of a given model matching the given fields"""
+        return self.__indexes.filter(
+            model_name, self.__data.get(model_name, {}), fields
+        )
 
     def reload(self):
-        """Populates the database with some dummy data"""
-        populate_db(self)
+        """
+        Loads the last snapshot, or populates the database
+        with some dummy data if there is none
+
+        An isolated repository has nothing to load
+        """
+        if self.__isolated:
+            return
+
+        try:
+            with open(self.__snapshot_filename, "rb") as file:
+                data = pickle.load(file)
+        except FileNotFoundError:
+            populate_db(self)
+            return
+
+        with self.__lock:
+            for model in self.__data:
+                self.__data[model] = {}
+            self.__data.update(data)
+            self.__indexes.clear()
+
+            for model, objects in self.__data.items():
+                for obj_id, obj in objects.items():
+                    self.__indexes.add(model, obj_id, obj)
 
     def save(self, obj: Base):
-        """Save an object"""
+        """
+        Save an object
+
+        Like a database insert, the id and timestamps
+        are set if the object doesn't have them yet
+        """
         cls = obj.__class__.__name__.lower()
 
-        if obj not in self.__data[cls]:
-            # print(f"Saving {obj}, {cls}")
-            self.__data[cls].append(obj)
+        stamp(obj)
+
+        with self.__lock:
+            objects = self.__data.setdefault(cls, {})
+
+            if str(obj.id) in objects:
+                return obj
+
+            self.__indexes.check(cls, obj.id, obj)
+            objects[str(obj.id)] = obj
+            self.__indexes.add(cls, obj.id, obj)
+
+        self._changed(cls, obj.id)
 
         return obj
 
+    def save_many(self, objects: list[Base]) -> None:
+        """
+        Save several objects at once
+
+        The unique keys of every object are checked before any of them
+        is stored, so either all of them are saved or none is
+        """
+        for obj in objects:
+            stamp(obj)
+
+        groups = by_model(objects)
+        changes = []
+
+        with self.__lock:
+            for cls, group in groups.items():
+                stored = self.__data.setdefault(cls, {})
+                groups[cls] = [
+                    obj for obj in group if str(obj.id) not in stored
+                ]
+                self.__indexes.check_many(
+                    cls, [(obj.id, obj) for obj in groups[cls]]
+                )
+
+            for cls, group in groups.items():
+                stored = self.__data[cls]
+
+                for obj in group:
+                    stored[str(obj.id)] = obj
+                    self.__indexes.add(cls, obj.id, obj)
+                    changes.append((cls, obj.id))
+
+        for cls, obj_id in changes:
+            self._changed(cls, obj_id)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """Get the objects of a model with the given ids, by id"""
+        stored = self.__data.get(model_name, {})
+
+        return {
+            str(obj_id): stored[str(obj_id)]
+            for obj_id in ids
+            if str(obj_id) in stored
+        }
+
     def update(self, obj: Base):
         """Update an object"""
         cls = obj.__class__.__name__.lower()
 
-        for i, o in enumerate(self.__data[cls]):
-            if o.id == obj.id:
-                obj.updated_at = datetime.now()
-                self.__data[cls][i] = obj
-                return obj
+        with self.__lock:
+            objects = self.__data.get(cls, {})
+
+            if str(obj.id) not in objects:
+                return None
+
+            self.__indexes.check_update(cls, obj.id, obj)
 
-        return None
+            obj.updated_at = datetime.now()
+            objects[str(obj.id)] = obj
+            self.__indexes.add(cls, obj.id, obj)
+
+        self._changed(cls, obj.id)
+
+        return obj
+
+    def replace(self, model_name: str, obj_id: str, obj: Base | None):
+        """
+        Stores the state of an object read from a shared store, or
+        removes it if obj is None, without counting it as a change
+
+        Used by the repositories that keep a copy of a store in memory
+        """
+        with self.__lock:
+            objects = self.__data.setdefault(model_name, {})
+
+            if obj is None:
+                if objects.pop(str(obj_id), None) is not None:
+                    self.__indexes.remove(model_name, obj_id)
+                return
+
+            objects[str(obj_id)] = obj
+            self.__indexes.add(model_name, obj_id, obj)
 
     def delete(self, obj: Base) -> bool:
         """Delete an object"""
         cls = obj.__class__.__name__.lower()
 
-        if obj in self.__data[cls]:
-            self.__data[cls].remove(obj)
-            return True
+        with self.__lock:
+            if self.__data.get(cls, {}).pop(str(obj.id), None) is None:
+                return False
+
+            self.__indexes.remove(cls, obj.id)
+
+        self._changed(cls, obj.id)
+
+        return True
+
+    def delete_many(self, objects: list[Base]) -> int:
+        """Delete several objects at once, returns how many were stored"""
+        changes = []
+
+        with self.__lock:
+            for cls, group in by_model(objects).items():
+                stored = self.__data.get(cls, {})
+
+                for obj in group:
+                    if stored.pop(str(obj.id), None) is not None:
+                        self.__indexes.remove(cls, obj.id)
+                        changes.append((cls, obj.id))
+
+        for cls, obj_id in changes:
+            self._changed(cls, obj_id)
 
-        return False
+        return len(changes)
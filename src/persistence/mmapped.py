@@ -0,0 +1,437 @@
+"""
+This module exports a Repository that reads from a memory-mapped
+binary snapshot (see src/persistence/snapshot.py)
+
+Opening the snapshot doesn't depend on the size of the data, and every
+worker process shares its pages through the OS page cache. Records are
+decoded only when they are read.
+
+Changes are kept in memory on top of the snapshot and appended to a
+journal, which is replayed on start (as records, built on first read like
+the snapshot ones). `python manage.py build-snapshot` folds them into a
+new snapshot.
+
+The journal is shared by the workers: every change appended is
+published on the invalidation bus, and the other workers read the
+objects it wrote again from the journal (see src/invalidation.py).
+"""
+
+from datetime import datetime
+import threading
+from typing import Any
+from src.models.base import Base
+from src.persistence.indexes import (
+    UNIQUE_INDEXES,
+    IndexSet,
+    declared_indexes,
+    field_value,
+    matches,
+)
+from src.persistence.journal import Journal
+from src.persistence.repository import (
+    Repository,
+    by_model,
+    instantiate,
+    stamp,
+)
+from src.persistence.snapshot import Snapshot, build
+from utils.constants import (
+    MMAP_JOURNAL_FILENAME,
+    MMAP_SNAPSHOT_FILENAME,
+    MODEL_NAMES,
+)
+
+
+class MmapRepository(Repository):
+    """Memory-mapped snapshot Repository"""
+
+    __filename = MMAP_SNAPSHOT_FILENAME
+    __journal_filename = MMAP_JOURNAL_FILENAME
+
+    def __init__(self) -> None:
+        """Calls reload method"""
+        self.__snapshot: Snapshot | None = None
+        self.__overlay: dict[str, dict[str, Base | dict]] = {}
+        self.__deleted: dict[str, set[str]] = {}
+        self.__indexes = IndexSet()
+        self.__lock = threading.RLock()
+        self.__journal = Journal(self.__journal_filename)
+
+        self.reload()
+
+    def reload(self) -> None:
+        """Maps the snapshot and replays the journal over it"""
+        with self.__lock:
+            if self.__snapshot:
+                self.__snapshot.close()
+
+            try:
+                self.__snapshot = Snapshot(self.__filename)
+            except FileNotFoundError:
+                self.__snapshot = None
+
+            self.__overlay = {model: {} for model in MODEL_NAMES}
+            self.__deleted = {model: set() for model in MODEL_NAMES}
+            self.__indexes.clear()
+
+            for record in self.__journal.replay():
+                self._apply(record)
+
+        if self.__snapshot is None and not self.__journal.records:
+            from src.models.country import Country
+
+            self.save(Country("Uruguay", "UY"))
+
+    def init_app(self, app) -> None:
+        """Reads again the objects the other workers write"""
+        from src import invalidation
+
+        invalidation.subscribe(self)
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Reads the objects another worker wrote again, by model and id"""
+        if any(obj_id is None for _, obj_id in changes):
+            self._refresh(None)
+            return
+
+        self._refresh({(model, str(obj_id)) for model, obj_id in changes})
+
+    def clear(self) -> None:
+        """Reads every object again, once events were missed"""
+        self._refresh(None)
+
+    def _refresh(self, keys: set[tuple[str, str]] | None) -> None:
+        """
+        Applies the last journal record of the given (model, id)
+        objects, or of every object if keys is None, the objects
+        without one are read from the snapshot again
+        """
+        records: dict[tuple[str, str], dict] = {}
+
+        # Records may still be appended by the other workers
+        for record in self.__journal.replay(repair=False):
+            key = (record["model"], self._id(record))
+
+            if keys is None or key in keys:
+                records[key] = record
+
+        with self.__lock:
+            if keys is None:
+                keys = set(records) | {
+                    (model, obj_id)
+                    for changed in (self.__overlay, self.__deleted)
+                    for model, ids in changed.items()
+                    for obj_id in ids
+                }
+
+            for model, obj_id in keys:
+                record = records.get((model, obj_id))
+
+                if record is not None:
+                    self._apply(record)
+                    continue
+
+                self.__overlay.get(model, {}).pop(obj_id, None)
+                self.__deleted.get(model, set()).discard(obj_id)
+                self.__indexes.remove(model, obj_id)
+
+    @staticmethod
+    def _id(record: dict) -> str:
+        """Returns the id of the object of a journal record"""
+        if record["op"] == "delete":
+            return record["id"]
+
+        return str(record["data"]["id"])
+
+    def __append(self, records: list[dict]) -> None:
+        """Appends records to the journal, and tells the other workers"""
+        from src import invalidation
+
+        self.__journal.append_many(records)
+        invalidation.publish(
+            [(record["model"], self._id(record)) for record in records]
+        )
+
+    def _apply(self, record: dict) -> None:
+        """Applies a journal record to the overlay"""
+        model = record["model"]
+
+        if record["op"] == "delete":
+            self.__forget(model, record["id"])
+            return
+
+        self.__remember(model, record["data"])
+
+    def __remember(self, model: str, obj: Base | dict) -> None:
+        """Puts an object, or the record of one, in the overlay"""
+        obj_id = str(obj["id"] if isinstance(obj, dict) else obj.id)
+
+        self.__overlay.setdefault(model, {})[obj_id] = obj
+        self.__deleted.setdefault(model, set()).discard(obj_id)
+        self.__indexes.add(model, obj_id, obj)
+
+    def __forget(self, model: str, obj_id: str) -> None:
+        """Removes an object from the overlay and hides it in the snapshot"""
+        self.__overlay.setdefault(model, {}).pop(obj_id, None)
+        self.__indexes.remove(model, obj_id)
+
+        if self.__snapshot and self.__snapshot.has(model, obj_id):
+            self.__deleted.setdefault(model, set()).add(obj_id)
+
+    def __hydrate(self, model: str, value: Base | dict) -> Base:
+        """Returns the instance of an overlay value, building it once"""
+        if not isinstance(value, dict):
+            return value
+
+        with self.__lock:
+            current = self.__overlay[model].get(str(value["id"]), value)
+
+            if isinstance(current, dict):
+                current = instantiate(model, current)
+                self.__overlay[model][str(current.id)] = current
+
+        return current
+
+    def __hidden(self, model: str, obj_id: str) -> bool:
+        """Checks if the snapshot record of an id must not be returned"""
+        return (
+            obj_id in self.__overlay.get(model, {})
+            or obj_id in self.__deleted.get(model, set())
+        )
+
+    def _check_unique(self, model: str, obj: Base) -> None:
+        """
+        Raises ValueError if another object already has one of
+        the unique keys of obj, in the snapshot or in the overlay
+        """
+        for fields in UNIQUE_INDEXES.get(model, []):
+            query = {f: field_value(obj, f) for f in fields}
+
+            if None in query.values():
+                continue
+
+            for found in self.lookup(model, **query):
+                if str(found.id) != str(obj.id):
+                    values = ", ".join(f"{f}={v}" for f, v in query.items())
+                    raise ValueError(f"{model} with {values} already exists")
+
+    def _exists(self, model: str, obj_id: str) -> bool:
+        """Checks if an object is stored, without decoding it"""
+        if obj_id in self.__overlay.get(model, {}):
+            return True
+        if obj_id in self.__deleted.get(model, set()):
+            return False
+
+        return bool(self.__snapshot and self.__snapshot.has(model, obj_id))
+
+    def get_all(self, model_name: str) -> list:
+        """Get all objects of a given model, in insertion order"""
+        overlay = dict(self.__overlay.get(model_name, {}))
+        objects = []
+
+        if self.__snapshot:
+            for record in self.__snapshot.records(model_name):
+                obj_id = str(record["id"])
+
+                if obj_id in overlay:
+                    objects.append(
+                        self.__hydrate(model_name, overlay.pop(obj_id))
+                    )
+                elif not self.__hidden(model_name, obj_id):
+                    objects.append(instantiate(model_name, record))
+
+        return objects + [
+            self.__hydrate(model_name, value) for value in overlay.values()
+        ]
+
+    def get(self, model_name: str, obj_id: str) -> Base | None:
+        """Get an object by its ID"""
+        obj_id = str(obj_id)
+
+        if obj_id in self.__overlay.get(model_name, {}):
+            return self.__hydrate(
+                model_name, self.__overlay[model_name][obj_id]
+            )
+        if obj_id in self.__deleted.get(model_name, set()):
+            return None
+        if not self.__snapshot:
+            return None
+
+        record = self.__snapshot.get(model_name, obj_id)
+
+        return instantiate(model_name, record) if record else None
+
+    def lookup(self, model_name: str, **fields) -> list:
+        """
+        Get all objects of a given model matching the given fields,
+        using the secondary indexes stored in the snapshot
+        """
+        objects = []
+
+        if self.__snapshot:
+            records = self.__snapshot.find(model_name, fields)
+
+            if records is None:
+                records = self.__snapshot.records(model_name)
+
+            objects = [
+                instantiate(model_name, record)
+                for record in records
+                if matches(record, fields)
+                and not self.__hidden(model_name, str(record["id"]))
+            ]
+
+        return objects + [
+            self.__hydrate(model_name, value)
+            for value in self.__indexes.filter(
+                model_name, self.__overlay.get(model_name, {}), fields
+            )
+        ]
+
+    def save(self, obj: Base) -> Base:
+        """Save an object"""
+        model = obj.__class__.__name__.lower()
+
+        stamp(obj)
+
+        with self.__lock:
+            if self._exists(model, str(obj.id)):
+                return obj
+
+            self._check_unique(model, obj)
+            self.__remember(model, obj)
+            self.__append(
+                [{"op": "save", "model": model, "data": obj.to_dict()}]
+            )
+
+        return obj
+
+    def save_many(self, objects: list[Base]) -> None:
+        """
+        Save several objects, appended to the journal at once
+
+        The unique keys of every object are checked before any of them
+        is stored, so either all of them are saved or none is
+        """
+        for obj in objects:
+            stamp(obj)
+
+        groups = by_model(objects)
+        records = []
+
+        with self.__lock:
+            for model, group in groups.items():
+                groups[model] = [
+                    obj
+                    for obj in group
+                    if not self._exists(model, str(obj.id))
+                ]
+
+                # Duplicates within the batch, then against the stored data
+                IndexSet().check_many(
+                    model, [(obj.id, obj) for obj in groups[model]]
+                )
+                for obj in groups[model]:
+                    self._check_unique(model, obj)
+
+            for model, group in groups.items():
+                for obj in group:
+                    self.__remember(model, obj)
+                    records.append(
+                        {"op": "save", "model": model, "data": obj.to_dict()}
+                    )
+
+            if records:
+                self.__append(records)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """Get the objects of a model with the given ids, by id"""
+        found = {}
+
+        for obj_id in map(str, ids):
+            obj = self.get(model_name, obj_id)
+
+            if obj is not None:
+                found[obj_id] = obj
+
+        return found
+
+    def update(self, obj: Base) -> Base | None:
+        """Update an object"""
+        model = obj.__class__.__name__.lower()
+
+        with self.__lock:
+            if not self._exists(model, str(obj.id)):
+                return None
+
+            try:
+                self._check_unique(model, obj)
+            except ValueError:
+                # The overlay may hold the instance the caller modified
+                self.__indexes.restore(model, str(obj.id), obj)
+                raise
+
+            obj.updated_at = datetime.now()
+
+            self.__remember(model, obj)
+            self.__append(
+                [{"op": "save", "model": model, "data": obj.to_dict()}]
+            )
+
+        return obj
+
+    def delete(self, obj: Base) -> bool:
+        """Delete an object"""
+        model = obj.__class__.__name__.lower()
+
+        with self.__lock:
+            if not self._exists(model, str(obj.id)):
+                return False
+
+            self.__forget(model, str(obj.id))
+            self.__append(
+                [{"op": "delete", "model": model, "id": str(obj.id)}]
+            )
+
+        return True
+
+    def delete_many(self, objects: list[Base]) -> int:
+        """
+        Delete several objects, appended to the journal at once,
+        returns how many were stored
+        """
+        records = []
+
+        with self.__lock:
+            for model, group in by_model(objects).items():
+                for obj in group:
+                    if not self._exists(model, str(obj.id)):
+                        continue
+
+                    self.__forget(model, str(obj.id))
+                    records.append(
+                        {"op": "delete", "model": model, "id": str(obj.id)}
+                    )
+
+            if records:
+                self.__append(records)
+
+        return len(records)
+
+    def compact(self) -> None:
+        """
+        Builds a new snapshot with the journal folded in, then empties
+        the journal and maps the new snapshot
+        """
+        with self.__lock:
+            build(
+                self.__filename,
+                {
+                    model: [obj.to_dict() for obj in self.get_all(model)]
+                    for model in MODEL_NAMES
+                },
+                declared_indexes(),
+            )
+
+            self.__journal.reset()
+            self.reload()
@@ -1,77 +1,562 @@
 """
 This module exports a Repository that persists data in a pickle file
+
+Every change is appended as a small pickled delta to a journal
+(PICKLE_DELTAS_FILENAME), so the cost of a write depends on the size
+of the change and not on the size of the data. When the deltas grow
+past the merge thresholds, a background thread merges them into the
+base file. On start the base is loaded and the deltas are applied
+over it. PICKLE_DELTAS=0 goes back to rewriting the base on every
+change.
+
+With the segmented layout (STORAGE_LAYOUT=segmented) every model is
+stored in its own file, and only the files of the models that changed
+are rewritten.
+
+The files are shared by the workers: once a change is written, it is
+published on the invalidation bus, and the other workers read the
+objects it wrote again from the files (see src/invalidation.py).
+
+Every append, merge, rewrite and load holds a lock shared by the
+workers (PICKLE_LOCK_FILENAME, see src/persistence/locking.py). Under
+it, a merge reads the deltas of every worker before writing the base
+and emptying the deltas, and without deltas a worker reads again what
+the others stored before rewriting the base with its own copy.
 """
 
+import atexit
+import os
 import pickle
-from src.persistence.repository import Repository
-from utils.constants import PICKLE_STORAGE_FILENAME
+import threading
+from typing import Any
+from src.persistence.indexes import IndexSet
+from src.persistence.journal import PickleJournal
+from src.persistence.locking import FileLock
+from src.persistence.repository import Repository, by_model, stamp
+from src.persistence.segments import (
+    atomic_write,
+    read_segments,
+    write_segments,
+)
+from utils.constants import (
+    PICKLE_DELTAS_ENV_VAR,
+    PICKLE_DELTAS_FILENAME,
+    PICKLE_LOCK_FILENAME,
+    PICKLE_MERGE_MAX_BYTES,
+    PICKLE_MERGE_MIN_BYTES,
+    PICKLE_MERGE_RATIO,
+    PICKLE_SEGMENTS_DIRNAME,
+    PICKLE_STORAGE_FILENAME,
+    STORAGE_LAYOUT_ENV_VAR,
+)
 
 
 class PickleRepository(Repository):
     """Pickle Repository"""
 
     __filename = PICKLE_STORAGE_FILENAME
-    __data: dict[str, list] = {
-        "country": [],
-        "user": [],
-        "amenity": [],
-        "city": [],
-        "review": [],
-        "place": [],
-        "placeamenity": [],
+    __segments_dirname = PICKLE_SEGMENTS_DIRNAME
+    __data: dict[str, dict] = {
+        "country": {},
+        "user": {},
+        "amenity": {},
+        "city": {},
+        "review": {},
+        "place": {},
+        "placeamenity": {},
     }
+    __indexes = IndexSet()
+    __lock = threading.RLock()
+    __shared_lock = FileLock(PICKLE_LOCK_FILENAME)
+
+    def __init__(
+        self, layout: str | None = None, deltas: bool | None = None
+    ) -> None:
+        """
+        Calls reload method
+
+        layout is read from the STORAGE_LAYOUT environment variable
+        by default, deltas from PICKLE_DELTAS (enabled unless it is 0)
+        """
+        if layout is None:
+            layout = os.getenv(STORAGE_LAYOUT_ENV_VAR, "single")
+        if deltas is None:
+            deltas = os.getenv(PICKLE_DELTAS_ENV_VAR, "1") not in (
+                "0",
+                "false",
+            )
+
+        if layout not in ("single", "segmented"):
+            raise ValueError(f"Unknown storage layout: {layout}")
+
+        self.__segmented = layout == "segmented"
+        self.__dirty_models: set[str] = set()
+        self.__segment_sizes: dict[str, int] = {}
+        self.__merger: threading.Thread | None = None
+        # Version of the files when this worker last read or wrote them
+        self.__synced_version: tuple | None = None
+
+        self.__deltas = (
+            PickleJournal(PICKLE_DELTAS_FILENAME, fsync=False)
+            if deltas
+            else None
+        )
 
-    def __init__(self) -> None:
-        """Calls reload method"""
         self.reload()
 
+        if deltas:
+            atexit.register(self.close)
+
     def _save_to_file(self):
-        """Helper method to save the current object data to the file"""
-        with open(self.__filename, "wb") as file:
-            pickle.dump(self.__data, file)
+        """
+        Helper method to save the current object data to the file
+
+        The data is written to a temporary file that then replaces
+        the old one. With the segmented layout only the models changed
+        since the last save are written.
+        """
+        with self.__lock, self.__shared_lock:
+            if not self.__segmented:
+                payload = {
+                    "": pickle.dumps(self.__data, pickle.HIGHEST_PROTOCOL)
+                }
+            else:
+                payload = {
+                    model: pickle.dumps(
+                        self.__data[model], pickle.HIGHEST_PROTOCOL
+                    )
+                    for model in self.__dirty_models
+                }
+
+            self.__dirty_models = set()
+
+            if not self.__segmented:
+                self.__segment_sizes = {
+                    "": atomic_write(self.__filename, payload[""], False)
+                }
+            else:
+                self.__segment_sizes |= write_segments(
+                    self.__segments_dirname, payload, ".pkl", False
+                )
+
+            self.__synced_version = self._stored_version()
+
+    def _stored_version(self) -> tuple:
+        """
+        Returns the inode, modification time and size of the base, or of
+        every segment, which change whenever a worker rewrites them
+        """
+        if self.__segmented and os.path.isdir(self.__segments_dirname):
+            entries = sorted(
+                os.scandir(self.__segments_dirname), key=lambda e: e.name
+            )
+        elif os.path.exists(self.__filename):
+            entries = [os.stat(self.__filename)]
+        else:
+            entries = []
+
+        versions = []
+
+        for entry in entries:
+            stat = entry if isinstance(entry, os.stat_result) else entry.stat()
+            versions.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+        return tuple(versions)
+
+    def _persist(self, model: str, record: dict) -> None:
+        """
+        Helper method to persist a single change, as a delta
+        or by rewriting the base
+        """
+        self._persist_many([record])
+
+    def _persist_many(self, records: list[dict]) -> None:
+        """
+        Helper method to persist several changes with a single write,
+        as deltas or by rewriting the base
+        """
+        if not records:
+            return
+
+        from src import invalidation
+
+        keys = [self._key(r) for r in records]
+
+        if not self.__deltas:
+            with self.__lock, self.__shared_lock:
+                if self._stored_version() != self.__synced_version:
+                    # Another worker rewrote the files since
+                    self._refresh(None, keep=set(keys))
+                self._save_to_file()
+
+            invalidation.publish(keys)
+            return
+
+        with self.__lock, self.__shared_lock:
+            self.__deltas.append_many(records)
+
+            if self._should_merge() and not (
+                self.__merger and self.__merger.is_alive()
+            ):
+                self.__merger = threading.Thread(
+                    target=self.merge, name="pickle-merge", daemon=True
+                )
+                self.__merger.start()
+
+        invalidation.publish(keys)
+
+    @staticmethod
+    def _key(record: dict) -> tuple[str, str]:
+        """Returns the (model, id) of the object of a delta"""
+        if record["op"] == "delete":
+            return record["model"], record["id"]
+
+        return record["model"], str(record["obj"].id)
+
+    def _should_merge(self) -> bool:
+        """Checks if the deltas reached the merge thresholds"""
+        size = self.__deltas.size
+
+        return size >= PICKLE_MERGE_MAX_BYTES or (
+            size >= PICKLE_MERGE_MIN_BYTES
+            and size
+            >= sum(self.__segment_sizes.values()) * PICKLE_MERGE_RATIO
+        )
+
+    def merge(self) -> None:
+        """
+        Writes the base with the deltas of every worker merged in and
+        empties the deltas
+
+        The lock shared by the workers is held throughout, so no delta
+        is appended in the meantime. If there is a crash before the
+        deltas are emptied, they are applied again over the new base,
+        which gives the same data because every delta holds the full
+        object.
+        """
+        with self.__lock, self.__shared_lock:
+            if not self.__deltas:
+                self._save_to_file()
+                return
+
+            self._refresh(None)
+            self._save_to_file()
+            self.__deltas.reset()
+
+    def close(self) -> None:
+        """Waits for a running merge, used on shutdown"""
+        merger = self.__merger
+
+        if merger and merger.is_alive():
+            merger.join()
 
     def get_all(self, model_name: str) -> list:
         """Get all objects of a given model"""
-        return self.__data[model_name]
+        return list(self.__data[model_name].values())
 
     def get(self, model_name: str, obj_id: str):
         """Get an object by its ID"""
-        for obj in self.__data[model_name]:
-            if obj.id == obj_id:
-                return obj
-        return None
+        return self.__data[model_name].get(str(obj_id))
 
-    def reload(self):
-        """Reloads the data from the pickle file"""
+    def lookup(self, model_name: str, **fields) -> list:
+        """Get all objects of a given model matching the given fields"""
+        return self.__indexes.filter(
+            model_name, self.__data[model_name], fields
+        )
+
+    def init_app(self, app) -> None:
+        """Reads again the objects the other workers write"""
+        from src import invalidation
+
+        invalidation.subscribe(self)
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Reads the objects another worker wrote again, by model and id"""
+        if any(obj_id is None for _, obj_id in changes):
+            self._refresh(None)
+            return
+
+        self._refresh({(model, str(obj_id)) for model, obj_id in changes})
+
+    def clear(self) -> None:
+        """Reads every object again, once events were missed"""
+        self._refresh(None)
+
+    def _refresh(
+        self,
+        keys: set[tuple[str, str]] | None,
+        keep: set[tuple[str, str]] = frozenset(),
+    ) -> None:
+        """
+        Replaces the given (model, id) objects, or every object if keys
+        is None, with the ones stored in the base and the deltas
+
+        The objects in keep, and the ones that didn't change, are kept
+        """
         try:
-            with open(self.__filename, "rb") as file:
-                self.__data = pickle.load(file)
+            base = self._read_base()
         except FileNotFoundError:
+            base = {}
+
+        stored = {
+            (model, obj_id): obj
+            for model, objects in base.items()
+            for obj_id, obj in objects.items()
+            if keys is None or (model, obj_id) in keys
+        }
+
+        if self.__deltas:
+            # Deltas may still be appended by the other workers
+            for record in self.__deltas.replay(repair=False):
+                key = self._key(record)
+
+                if keys is None or key in keys:
+                    stored[key] = record.get("obj")
+
+        with self.__lock:
+            if keys is None:
+                keys = set(stored) | {
+                    (model, obj_id)
+                    for model, objects in self.__data.items()
+                    for obj_id in objects
+                }
+
+            for model, obj_id in keys:
+                if (model, obj_id) in keep:
+                    continue
+
+                objects = self.__data.setdefault(model, {})
+                obj = stored.get((model, obj_id))
+                current = objects.get(obj_id)
+
+                if obj is not None and current is not None:
+                    if obj.to_dict() == current.to_dict():
+                        continue
+
+                if obj is None:
+                    if objects.pop(obj_id, None) is not None:
+                        self.__indexes.remove(model, obj_id)
+                    continue
+
+                objects[obj_id] = obj
+                self.__indexes.add(model, obj_id, obj)
+
+    def _read_base(self) -> dict[str, dict]:
+        """
+        Reads the objects of the pickle file, or of the segments,
+        by model and id
+
+        Raises FileNotFoundError if nothing was stored yet
+        """
+        if self.__segmented and os.path.isdir(self.__segments_dirname):
+            segments = read_segments(
+                self.__segments_dirname,
+                ".pkl",
+                lambda model, content: (
+                    pickle.loads(content),
+                    len(content),
+                ),
+            )
+            data = {model: s[0] for model, s in segments.items()}
+            self.__segment_sizes = {
+                model: s[1] for model, s in segments.items()
+            }
+        else:
+            with open(self.__filename, "rb") as file:
+                data = pickle.load(file)
+                self.__segment_sizes = {"": file.tell()}
+
+        # Files written before objects were stored by id hold lists
+        return {
+            model: (
+                objects
+                if isinstance(objects, dict)
+                else {str(obj.id): obj for obj in objects}
+            )
+            for model, objects in data.items()
+        }
+
+    def reload(self):
+        """
+        Reloads the data from the pickle file, or from the segments,
+        applies the deltas over it, and seeds it when nothing was
+        stored yet
+        """
+        with self.__lock, self.__shared_lock:
+            if self._load():
+                return
+
             from src.models.country import Country
 
-            self.__data["country"] = [Country("Uruguay", "UY")]
-            self._save_to_file()
+            self.save(Country("Uruguay", "UY"))
+
+    def _load(self) -> bool:
+        """
+        Reads the base and applies the deltas, the shared lock must be
+        held; returns False if nothing was stored yet
+        """
+        segments_found = self.__segmented and os.path.isdir(
+            self.__segments_dirname
+        )
+        base_found = True
+
+        try:
+            data = self._read_base()
+        except FileNotFoundError:
+            base_found = False
+            data = {}
+
+        self.__synced_version = self._stored_version()
+        self.__data = {model: {} for model in self.__data} | data
+
+        # Data of the single file layout is moved on the next save
+        self.__dirty_models = (
+            set() if segments_found or not self.__segmented else set(data)
+        )
+
+        if self.__deltas:
+            for record in self.__deltas.replay():
+                self._apply(record)
+
+        self.__indexes.clear()
+
+        for model, objects in self.__data.items():
+            for obj_id, obj in objects.items():
+                self.__indexes.add(model, obj_id, obj)
+
+        return base_found or bool(self.__deltas and self.__deltas.records)
+
+    def _apply(self, record: dict) -> None:
+        """Applies a delta to the data"""
+        model = record["model"]
+        self.__dirty_models.add(model)
+
+        if record["op"] == "delete":
+            self.__data[model].pop(record["id"], None)
+        else:
+            self.__data[model][str(record["obj"].id)] = record["obj"]
 
     def save(self, obj, save_to_file=True):
         """Save an object"""
-        self.__data[obj.__class__.__name__.lower()].append(obj)
-        if save_to_file:
-            self._save_to_file()
+        model = obj.__class__.__name__.lower()
+
+        stamp(obj)
+
+        with self.__lock:
+            objects = self.__data.setdefault(model, {})
+
+            if str(obj.id) in objects:
+                return
+
+            self.__indexes.check(model, obj.id, obj)
+            objects[str(obj.id)] = obj
+            self.__indexes.add(model, obj.id, obj)
+            self.__dirty_models.add(model)
+
+            if save_to_file:
+                self._persist(
+                    model, {"op": "save", "model": model, "obj": obj}
+                )
+
+    def save_many(self, objects: list) -> None:
+        """
+        Save several objects, with a single write
+
+        The unique keys of every object are checked before any of them
+        is stored, so either all of them are saved or none is
+        """
+        for obj in objects:
+            stamp(obj)
+
+        groups = by_model(objects)
+        records = []
+
+        with self.__lock:
+            for model, group in groups.items():
+                stored = self.__data.setdefault(model, {})
+                groups[model] = [
+                    obj for obj in group if str(obj.id) not in stored
+                ]
+                self.__indexes.check_many(
+                    model, [(obj.id, obj) for obj in groups[model]]
+                )
+
+            for model, group in groups.items():
+                for obj in group:
+                    self.__data[model][str(obj.id)] = obj
+                    self.__indexes.add(model, obj.id, obj)
+                    records.append({"op": "save", "model": model, "obj": obj})
+
+                if group:
+                    self.__dirty_models.add(model)
+
+            self._persist_many(records)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """Get the objects of a model with the given ids, by id"""
+        stored = self.__data[model_name]
+
+        return {
+            str(obj_id): stored[str(obj_id)]
+            for obj_id in ids
+            if str(obj_id) in stored
+        }
 
     def update(self, obj):
         """Update an object"""
-        for i, o in enumerate(self.__data[obj.__class__.__name__.lower()]):
-            if o.id == obj.id:
-                self.__data[obj.__class__.__name__.lower()][i] = obj
-                self._save_to_file()
-                return
+        model = obj.__class__.__name__.lower()
+
+        with self.__lock:
+            objects = self.__data[model]
+
+            if str(obj.id) not in objects:
+                return None
+
+            self.__indexes.check_update(model, obj.id, obj)
+            objects[str(obj.id)] = obj
+            self.__indexes.add(model, obj.id, obj)
+            self.__dirty_models.add(model)
+
+            self._persist(model, {"op": "save", "model": model, "obj": obj})
+
+        return obj
 
     def delete(self, obj) -> bool:
-        """Delete an object"""
-        for i, o in enumerate(self.__data[obj.__class__.__name__.lower()]):
-            if o.id == obj.id:
-                del self.__data[obj.__class__.__name__.lower()][i]
-                break
+        """Delete an object, nothing is written if it wasn't stored"""
+        model = obj.__class__.__name__.lower()
+
+        with self.__lock:
+            if self.__data[model].pop(str(obj.id), None) is None:
+                return False
+
+            self.__indexes.remove(model, obj.id)
+            self.__dirty_models.add(model)
+
+            self._persist(
+                model, {"op": "delete", "model": model, "id": str(obj.id)}
+            )
 
-        self._save_to_file()
         return True
+
+    def delete_many(self, objects: list) -> int:
+        """
+        Delete several objects, with a single write,
+        returns how many were stored
+        """
+        records = []
+
+        with self.__lock:
+            for model, group in by_model(objects).items():
+                for obj in group:
+                    if self.__data[model].pop(str(obj.id), None) is None:
+                        continue
+
+                    self.__indexes.remove(model, obj.id)
+                    self.__dirty_models.add(model)
+                    records.append(
+                        {"op": "delete", "model": model, "id": str(obj.id)}
+                    )
+
+            self._persist_many(records)
+
+        return len(records)
@@ -0,0 +1,81 @@
+"""
+This module checks that the ids a payload refers to exist
+
+The foreign keys of a model (for example host_id and city_id of a
+place) are read from its table. All the ids of every payload that
+point to the same model are fetched with a single get_many, so
+checking a place costs one read per referenced model, and checking
+a batch of places costs the same.
+"""
+
+from typing import Iterable
+
+from src.persistence.repository import Repository
+
+
+def foreign_keys(model_class: type) -> dict[str, str]:
+    """
+    Returns the fields of a model that refer to the id of another
+    model, with the name of that model, for example
+    {"host_id": "user", "city_id": "city"} for Place
+
+    Foreign keys to other columns (like City.country_code) are left
+    out, they are natural keys and are checked with get_by
+    """
+    return {
+        key.parent.name: key.column.table.name
+        for key in model_class.__table__.foreign_keys
+        if key.column.name == "id"
+    }
+
+
+def check_references(
+    model_class: type,
+    payloads: Iterable[dict],
+    repo: Repository | None = None,
+) -> dict[str, dict]:
+    """
+    Checks that every id the payloads refer to exists, with one
+    get_many per referenced model
+
+    Returns the referenced objects by model name and then by id.
+    Raises ValueError, naming the first missing id, otherwise.
+    """
+    if repo is None:
+        from src.persistence import repo
+
+    fields = foreign_keys(model_class)
+    wanted: dict[str, dict[str, None]] = {}
+
+    for payload in payloads:
+        for field, model in fields.items():
+            if payload.get(field) is not None:
+                wanted.setdefault(model, {})[str(payload[field])] = None
+
+    found = {}
+
+    for model, ids in wanted.items():
+        found[model] = repo.get_many(model, list(ids))
+
+        for obj_id in ids:
+            if obj_id not in found[model]:
+                raise ValueError(
+                    f"{model.capitalize()} with ID {obj_id} not found"
+                )
+
+    return found
+
+
+def with_stored_ids(
+    model_class: type, payload: dict, found: dict[str, dict]
+) -> dict:
+    """
+    Returns a copy of a payload whose references hold the ids of the
+    objects returned by check_references, so they have the type the
+    repository stores (for example uuid.UUID with DBRepository)
+    """
+    return payload | {
+        field: found[model][str(payload[field])].id
+        for field, model in foreign_keys(model_class).items()
+        if payload.get(field) is not None
+    }
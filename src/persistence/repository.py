@@ -1,6 +1,9 @@
 """ Repository pattern for data access layer """
 
 from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Iterator
+import uuid
 
 
 class Repository(ABC):
@@ -14,14 +17,70 @@ class Repository(ABC):
     def get_all(self, model_name: str) -> list:
         """Get all objects of a model"""
 
+    def iter_all(self, model_name: str) -> Iterator:
+        """
+        Get all objects of a model one at a time, repositories that
+        read from a database stream them instead of loading them all
+        """
+        yield from self.get_all(model_name)
+
+    def init_app(self, app) -> None:
+        """
+        Prepares the repository once the app is created (the repository
+        is created first, on import), nothing by default
+        """
+
+    def release(self) -> None:
+        """
+        Frees what the current thread holds once its work is done,
+        like a database session at the end of a request, nothing
+        by default
+        """
+
     @abstractmethod
     def get(self, model_name: str, id: str) -> None:
         """Get an object by id"""
 
+    @abstractmethod
+    def lookup(self, model_name: str, **fields) -> list:
+        """Get all objects of a model whose fields match the given values"""
+
+    def get_by(self, model_name: str, **fields):
+        """
+        Get the object of a model whose fields match the given values,
+        like a natural key: repo.get_by("user", email=email)
+
+        Returns None if there is none, raises ValueError if there are
+        more than one. Unique indexes make this a single dict access
+        in the in-process repositories
+        """
+        objects = self.lookup(model_name, **fields)
+
+        if len(objects) > 1:
+            raise ValueError(f"More than one {model_name} matches {fields}")
+
+        return objects[0] if objects else None
+
     @abstractmethod
     def save(self, obj) -> None:
         """Save an object"""
 
+    @abstractmethod
+    def save_many(self, objects: list) -> None:
+        """
+        Save several objects, of one or more models, at once
+
+        Either every object is saved or, if one of them would duplicate
+        a unique key, none is
+        """
+
+    @abstractmethod
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """
+        Get the objects of a model with the given ids at once,
+        by id (as a string), the ids that aren't found are left out
+        """
+
     @abstractmethod
     def update(self, obj) -> None:
         """Update an object"""
@@ -29,3 +88,70 @@ class Repository(ABC):
     @abstractmethod
     def delete(self, obj) -> bool:
         """Delete an object"""
+
+    @abstractmethod
+    def delete_many(self, objects: list) -> int:
+        """Delete several objects at once, returns how many were stored"""
+
+
+def instantiate(model_name: str, item: dict):
+    """
+    Builds a model instance from its dictionary representation (to_dict)
+
+    Used by the repositories that store the objects serialized
+    """
+    from src.models.amenity import Amenity, PlaceAmenity
+    from src.models.city import City
+    from src.models.country import Country
+    from src.models.place import Place
+    from src.models.review import Review
+    from src.models.user import User
+
+    models = {
+        "amenity": Amenity,
+        "city": City,
+        "country": Country,
+        "place": Place,
+        "placeamenity": PlaceAmenity,
+        "review": Review,
+        "user": User,
+    }
+
+    instance = models[model_name](**item)
+
+    if "created_at" in item:
+        instance.created_at = datetime.fromisoformat(item["created_at"])
+    if "updated_at" in item:
+        instance.updated_at = datetime.fromisoformat(item["updated_at"])
+
+    return instance
+
+
+def model_name(obj) -> str:
+    """Returns the model name of an object, as used by the repositories"""
+    return obj.__class__.__name__.lower()
+
+
+def by_model(objects: list) -> dict[str, list]:
+    """Groups objects by model name, keeping their order"""
+    groups: dict[str, list] = {}
+
+    for obj in objects:
+        groups.setdefault(model_name(obj), []).append(obj)
+
+    return groups
+
+
+def stamp(obj) -> None:
+    """
+    Sets the id and timestamps of an object that doesn't have them yet,
+    like the column defaults do on a database insert
+
+    Used by the repositories that don't persist to a database
+    """
+    if obj.id is None:
+        obj.id = str(uuid.uuid4())
+    if obj.created_at is None:
+        obj.created_at = datetime.now()
+    if obj.updated_at is None:
+        obj.updated_at = obj.created_at
@@ -0,0 +1,118 @@
+"""
+This module exports the helpers of the segmented storage layout,
+where every model is stored in its own file inside a directory
+
+Only the segments of the models that changed need to be rewritten,
+so the cost of a write depends on the size of the changed model
+and not on the size of the whole database.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Callable, TypeVar
+
+
+T = TypeVar("T")
+
+
+def sync_directory(directory: str) -> None:
+    """Makes the renames and truncations inside a directory durable"""
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(
+    filename: str,
+    data: bytes,
+    fsync: bool = True,
+    sync_parent: bool = True,
+) -> int:
+    """
+    Writes a file through a temporary file and an atomic rename,
+    so readers and crashes only ever see the old or the new content
+
+    With fsync, the directory is synced too (unless sync_parent is
+    False, for callers that sync it once after several writes), so
+    a crash can't undo the rename after the writes that follow it.
+
+    Returns the size of the written file
+    """
+    temp_filename = f"{filename}.tmp"
+
+    with open(temp_filename, "wb") as file:
+        file.write(data)
+
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+
+    os.replace(temp_filename, filename)
+
+    if fsync and sync_parent:
+        sync_directory(os.path.dirname(filename))
+
+    return len(data)
+
+
+def segment_path(directory: str, model: str, extension: str) -> str:
+    """Returns the path of the segment of a model"""
+    return os.path.join(directory, f"{model}{extension}")
+
+
+def write_segments(
+    directory: str,
+    segments: dict[str, bytes],
+    extension: str,
+    fsync: bool = True,
+) -> dict[str, int]:
+    """
+    Atomically rewrites the given segments, the others are left untouched
+
+    Returns the size of every written segment
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    sizes = {
+        model: atomic_write(
+            segment_path(directory, model, extension), data, fsync, False
+        )
+        for model, data in segments.items()
+    }
+
+    if fsync and segments:
+        # The renames are only durable once the directory is synced
+        sync_directory(directory)
+
+    return sizes
+
+
+def read_segments(
+    directory: str, extension: str, load: Callable[[str, bytes], T]
+) -> dict[str, T]:
+    """
+    Reads every segment of a directory in parallel
+
+    load receives the model name and the content of its segment,
+    what it returns is collected by model name
+    """
+    models = sorted(
+        name[: -len(extension)]
+        for name in os.listdir(directory)
+        if name.endswith(extension)
+    )
+
+    def read(model: str) -> T:
+        """Reads and loads a single segment"""
+        with open(segment_path(directory, model, extension), "rb") as file:
+            return load(model, file.read())
+
+    if len(models) < 2:
+        return {model: read(model) for model in models}
+
+    workers = min(len(models), os.cpu_count() or 1)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(models, pool.map(read, models)))
@@ -0,0 +1,355 @@
+"""
+This module exports a Repository that partitions the data between
+several child repositories, the shards
+
+Every object lives in the shard given by a hash of its id (crc32, so it
+is the same in every process), so get, save, update and delete only
+touch one shard. get_all, lookup and get_many ask every shard in
+parallel and merge the answers, in shard order.
+
+Models whose ids are generated by the database on insert (integer ids,
+like Amenity) can't be placed before they are saved, all their objects
+live in the first shard.
+
+The shards are built from the environment (REPOSITORY=sharded):
+SHARD_COUNT of them, of the SHARD_BACKEND kind, memory (isolated
+MemoryRepository) or db (a DBRepository per database, the URL of
+shard n is SHARD_DATABASE_URL with {shard} replaced by n).
+
+Unique keys are checked by each shard, and a batch spanning several
+shards is saved shard by shard. When SHARD_COUNT changes, move the
+objects to their new shard with `python manage.py rebalance-shards`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Any, Callable, Iterator
+import uuid
+import zlib
+
+from flask import g, has_app_context
+
+from src.persistence.repository import Repository
+from utils.constants import (
+    MODEL_NAMES,
+    SHARD_BACKEND_DEFAULT,
+    SHARD_BACKEND_ENV_VAR,
+    SHARD_COUNT_DEFAULT,
+    SHARD_COUNT_ENV_VAR,
+    SHARD_DATABASE_URL_DEFAULT,
+    SHARD_DATABASE_URL_ENV_VAR,
+)
+
+
+def unsharded(model: str) -> bool:
+    """Checks if the ids of a model are only known after the insert"""
+    from src.persistence.db import DBRepository
+
+    return DBRepository.new_id(model) is None
+
+
+def create_shards(
+    backend: str | None = None, count: int | None = None, start: int = 0
+) -> list[Repository]:
+    """
+    Builds the shards from start to count, by default the SHARD_COUNT
+    shards of the SHARD_BACKEND kind read from the environment
+    """
+    if backend is None:
+        backend = os.getenv(SHARD_BACKEND_ENV_VAR, SHARD_BACKEND_DEFAULT)
+    if count is None:
+        count = int(os.getenv(SHARD_COUNT_ENV_VAR, SHARD_COUNT_DEFAULT))
+
+    if count < 1:
+        raise ValueError(f"Invalid shard count: {count}")
+
+    if backend == "memory":
+        from src.persistence.memory import MemoryRepository
+
+        return [
+            MemoryRepository(isolated=True) for _ in range(start, count)
+        ]
+
+    if backend == "db":
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.orm import scoped_session, sessionmaker
+
+        from src.config import Config
+        from src.engine import sqlite_pragmas
+        from src.persistence.db import DBRepository
+
+        url = os.getenv(SHARD_DATABASE_URL_ENV_VAR, SHARD_DATABASE_URL_DEFAULT)
+        shards: list[Repository] = []
+
+        for shard in range(start, count):
+            engine = create_engine(url.format(shard=shard))
+
+            if engine.dialect.name == "sqlite":
+                event.listen(
+                    engine, "connect", sqlite_pragmas(Config.SQLITE_PRAGMAS)
+                )
+
+            shards.append(
+                DBRepository(scoped_session(sessionmaker(bind=engine)))
+            )
+
+        return shards
+
+    raise ValueError(f"Unknown shard backend: {backend}")
+
+
+class ShardedRepository(Repository):
+    """Repository that hash-partitions the objects between shards"""
+
+    def __init__(self, shards: list[Repository], populate: bool = True):
+        """
+        Calls reload method
+
+        populate saves the dummy data once the shards are loaded,
+        like MemoryRepository does
+        """
+        if not shards:
+            raise ValueError("A ShardedRepository needs at least one shard")
+
+        self.shards = shards
+        self.__populate = populate
+        self.__executor = ThreadPoolExecutor(
+            max_workers=len(shards), thread_name_prefix="shard"
+        )
+
+        self.reload()
+
+    def shard_index(self, model: str, obj_id: Any) -> int:
+        """Returns the position of the shard of an object"""
+        if len(self.shards) == 1 or unsharded(model):
+            return 0
+
+        return zlib.crc32(str(obj_id).encode()) % len(self.shards)
+
+    def shard_of(self, model: str, obj_id: Any) -> Repository:
+        """Returns the shard of an object"""
+        return self.shards[self.shard_index(model, obj_id)]
+
+    def _scatter(self, read: Callable[[Repository], Any]) -> list:
+        """
+        Runs a read on every shard, in parallel, and returns the answers
+        in shard order
+
+        Once the app context wrote, its reads run in its own thread,
+        so they see its changes that aren't committed yet
+        """
+        if len(self.shards) == 1 or (
+            has_app_context() and g.get("shard_writes")
+        ):
+            return [read(shard) for shard in self.shards]
+
+        def run(shard: Repository) -> Any:
+            """Runs the read, then frees what the worker thread holds"""
+            try:
+                return read(shard)
+            finally:
+                shard.release()
+
+        return list(self.__executor.map(run, self.shards))
+
+    @staticmethod
+    def _wrote() -> None:
+        """Records that the current app context wrote"""
+        if has_app_context():
+            g.shard_writes = True
+
+    def _place(self, obj: Any) -> int:
+        """
+        Returns the position of the shard an object goes to, giving it
+        an id first if it doesn't have one yet
+        """
+        model = obj.__class__.__name__.lower()
+
+        if obj.id is None and not unsharded(model):
+            from src.persistence.db import DBRepository
+
+            obj.id = (
+                DBRepository.new_id(model)
+                if isinstance(self.shards[0], DBRepository)
+                else str(uuid.uuid4())
+            )
+
+        return self.shard_index(model, obj.id)
+
+    def reload(self) -> None:
+        """Reloads every shard, then populates them if needed"""
+        for shard in self.shards:
+            shard.reload()
+
+        if self.__populate:
+            from utils.populate import populate_db
+
+            populate_db(self)
+
+    def upgrade(self) -> None:
+        """Upgrades the schema of the database shards to the last migration"""
+        from src.migrate import upgrade_database
+        from src.persistence.db import DBRepository
+
+        for shard in self.shards:
+            if isinstance(shard, DBRepository):
+                upgrade_database(shard.session.get_bind())
+
+    def init_app(self, app) -> None:
+        """Upgrades the database shards along with the app's database"""
+        self.upgrade()
+
+    def release(self) -> None:
+        """Frees what the current thread holds in every shard"""
+        for shard in self.shards:
+            shard.release()
+
+    def get_all(self, model_name: str) -> list:
+        """Get all objects of a model, from every shard"""
+        return [
+            obj
+            for objects in self._scatter(lambda s: s.get_all(model_name))
+            for obj in objects
+        ]
+
+    def iter_all(self, model_name: str) -> Iterator:
+        """Get all objects of a model one at a time, shard after shard"""
+        for shard in self.shards:
+            yield from shard.iter_all(model_name)
+
+    def get(self, model_name: str, obj_id: str) -> Any | None:
+        """Get an object by its ID, from its shard"""
+        return self.shard_of(model_name, obj_id).get(model_name, obj_id)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """
+        Get the objects of a model with the given ids, by id,
+        with one get_many per shard
+        """
+        wanted: dict[Repository, list] = {}
+
+        for obj_id in ids:
+            wanted.setdefault(self.shard_of(model_name, obj_id), []).append(
+                obj_id
+            )
+
+        found: dict[str, Any] = {}
+
+        for answer in self._scatter(
+            lambda s: s.get_many(model_name, wanted[s]) if s in wanted else {}
+        ):
+            found |= answer
+
+        return {
+            str(obj_id): found[str(obj_id)]
+            for obj_id in ids
+            if str(obj_id) in found
+        }
+
+    def lookup(self, model_name: str, **fields) -> list:
+        """Get the objects of a model matching the fields, from every shard"""
+        return [
+            obj
+            for objects in self._scatter(
+                lambda s: s.lookup(model_name, **fields)
+            )
+            for obj in objects
+        ]
+
+    def save(self, obj: Any) -> Any:
+        """Save an object in its shard"""
+        shard = self.shards[self._place(obj)]
+        self._wrote()
+
+        shard.save(obj)
+
+        return obj
+
+    def save_many(self, objects: list) -> None:
+        """Save several objects, with one save_many per shard"""
+        batches: dict[int, list] = {}
+
+        for obj in objects:
+            batches.setdefault(self._place(obj), []).append(obj)
+
+        self._wrote()
+
+        for index, batch in sorted(batches.items()):
+            self.shards[index].save_many(batch)
+
+    def update(self, obj: Any) -> Any | None:
+        """Update an object in its shard"""
+        model = obj.__class__.__name__.lower()
+        self._wrote()
+
+        return self.shard_of(model, obj.id).update(obj)
+
+    def delete(self, obj: Any) -> bool:
+        """Delete an object from its shard"""
+        model = obj.__class__.__name__.lower()
+        self._wrote()
+
+        return self.shard_of(model, obj.id).delete(obj)
+
+    def delete_many(self, objects: list) -> int:
+        """Delete several objects, with one delete_many per shard"""
+        batches: dict[int, list] = {}
+
+        for obj in objects:
+            batches.setdefault(
+                self.shard_index(obj.__class__.__name__.lower(), obj.id), []
+            ).append(obj)
+
+        self._wrote()
+
+        return sum(
+            self.shards[index].delete_many(batch)
+            for index, batch in sorted(batches.items())
+        )
+
+
+def rebalance(
+    source: ShardedRepository, count: int, backend: str | None = None
+) -> tuple[ShardedRepository, dict[str, int]]:
+    """
+    Moves the objects of a sharded repository to their shard in
+    a layout of count shards, returns the repository of the new
+    layout and how many objects moved, by model
+
+    The new layout keeps the first shards of the source (the missing
+    ones are built like create_shards does), and the objects that
+    still belong to them stay where they are. Objects are saved in
+    their new shard before they are deleted from the old one, so an
+    interrupted rebalance loses nothing and can be run again. Shards
+    left out of a smaller layout are empty afterwards.
+    """
+    target = ShardedRepository(
+        source.shards[:count]
+        + create_shards(backend, count, start=len(source.shards)),
+        populate=False,
+    )
+    target.upgrade()
+    moved = {}
+
+    for model in MODEL_NAMES:
+        moved[model] = 0
+
+        for shard in source.shards:
+            leaving: dict[int, list] = {}
+
+            for obj in list(shard.iter_all(model)):
+                index = target.shard_index(model, obj.id)
+
+                if target.shards[index] is not shard:
+                    leaving.setdefault(index, []).append(obj)
+
+            # Deleting commits, and a commit expires the objects
+            # of the shard, so they are all copied first
+            for index, objects in sorted(leaving.items()):
+                target.shards[index].save_many(objects)
+
+            moved[model] += shard.delete_many(
+                [obj for objects in leaving.values() for obj in objects]
+            )
+
+    return target, moved
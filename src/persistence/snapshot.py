@@ -0,0 +1,300 @@
+"""
+This module exports the fixed-layout binary snapshot read by MmapRepository
+
+The file is memory-mapped read-only, so every worker process shares the
+same pages of the OS page cache, and opening it only reads the header:
+records are decoded when they are read.
+
+Layout (little endian, offsets are from the start of the file):
+
+    header      magic "HBNBSNP1", version u32, model count u32, 8 reserved
+    models      per model: name (24 bytes), record count u32,
+                index count u32, records offset u64, ids offset u64,
+                indexes offset u64
+    records     per record, in insertion order: offset u64, length u32, 4
+                reserved (the record is its to_dict() as json)
+    ids         per record, sorted by id: id offset u64, id length u32,
+                record number u32
+    indexes     per secondary index: fields (64 bytes, comma separated),
+                entries offset u64, then its entries sorted by key, with
+                the same layout as the ids
+    data        the ids, index keys and records themselves
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Callable, Iterator
+
+from src.persistence.indexes import normalize
+from src.persistence.segments import atomic_write
+
+
+MAGIC = b"HBNBSNP1"
+VERSION = 1
+
+HEADER = struct.Struct("<8sII8x")
+MODEL = struct.Struct("<24sIIQQQ")
+RECORD = struct.Struct("<QI4x")
+ENTRY = struct.Struct("<QII")
+INDEX = struct.Struct("<64sQ")
+
+# Separates the values of a composite index key
+KEY_SEPARATOR = b"\x1f"
+
+
+def index_key(values: list) -> bytes:
+    """Encodes the values of an index key"""
+    return KEY_SEPARATOR.join(
+        b"\x00" if v is None else normalize(v).encode() for v in values
+    )
+
+
+def build(
+    filename: str,
+    data: dict[str, list[dict]],
+    indexes: dict[str, list[tuple[str, ...]]],
+) -> None:
+    """
+    Writes a snapshot of the given records (by model name)
+    with the given secondary indexes
+    """
+    models = list(data)
+
+    # The size of the tables only depends on the number of records,
+    # so they are laid out first and the data is appended after them
+    offset = HEADER.size + MODEL.size * len(models)
+    layout = {}
+
+    for model in models:
+        count = len(data[model])
+        index_count = len(indexes.get(model, []))
+
+        records_offset = offset
+        ids_offset = records_offset + RECORD.size * count
+        indexes_offset = ids_offset + ENTRY.size * count
+        offset = indexes_offset + INDEX.size * index_count
+
+        index_offsets = []
+        for _ in range(index_count):
+            index_offsets.append(offset)
+            offset += ENTRY.size * count
+
+        layout[model] = (
+            records_offset, ids_offset, indexes_offset, index_offsets
+        )
+
+    out = bytearray(offset)
+
+    def append(payload: bytes) -> int:
+        """Appends to the data region, returns the offset of the payload"""
+        position = len(out)
+        out.extend(payload)
+        return position
+
+    HEADER.pack_into(out, 0, MAGIC, VERSION, len(models))
+
+    for position, model in enumerate(models):
+        records = data[model]
+        fields_list = indexes.get(model, [])
+        records_offset, ids_offset, indexes_offset, index_offsets = (
+            layout[model]
+        )
+
+        MODEL.pack_into(
+            out,
+            HEADER.size + MODEL.size * position,
+            model.encode(),
+            len(records),
+            len(fields_list),
+            records_offset,
+            ids_offset,
+            indexes_offset,
+        )
+
+        for number, record in enumerate(records):
+            payload = json.dumps(record, separators=(",", ":")).encode()
+            RECORD.pack_into(
+                out,
+                records_offset + RECORD.size * number,
+                append(payload),
+                len(payload),
+            )
+
+        pack_entries(
+            out, ids_offset, [str(r["id"]).encode() for r in records], append
+        )
+
+        for number, fields in enumerate(fields_list):
+            INDEX.pack_into(
+                out,
+                indexes_offset + INDEX.size * number,
+                ",".join(fields).encode(),
+                index_offsets[number],
+            )
+            pack_entries(
+                out,
+                index_offsets[number],
+                [index_key([r.get(f) for f in fields]) for r in records],
+                append,
+            )
+
+    atomic_write(filename, bytes(out))
+
+
+def pack_entries(
+    out: bytearray,
+    table_offset: int,
+    keys: list[bytes],
+    append: Callable[[bytes], int],
+) -> None:
+    """Writes a table of keys sorted, each pointing to its record number"""
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+
+    for position, number in enumerate(order):
+        key = keys[number]
+        ENTRY.pack_into(
+            out,
+            table_offset + ENTRY.size * position,
+            append(key),
+            len(key),
+            number,
+        )
+
+
+class Snapshot:
+    """Read-only view of a snapshot file"""
+
+    def __init__(self, filename: str) -> None:
+        """Maps the file and reads its header and model table"""
+        self.filename = filename
+        self.models: dict[str, tuple] = {}
+
+        with open(filename, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                self.__map = b""
+                return
+
+            self.__map = mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+        magic, version, count = HEADER.unpack_from(self.__map, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{filename} is not a snapshot")
+
+        for position in range(count):
+            name, *layout = MODEL.unpack_from(
+                self.__map, HEADER.size + MODEL.size * position
+            )
+            self.models[name.rstrip(b"\x00").decode()] = tuple(layout)
+
+    def count(self, model: str) -> int:
+        """Returns the number of records of a model"""
+        return self.models[model][0] if model in self.models else 0
+
+    def record(self, model: str, number: int) -> dict:
+        """Decodes the record with the given number"""
+        records_offset = self.models[model][2]
+        offset, length = RECORD.unpack_from(
+            self.__map, records_offset + RECORD.size * number
+        )
+
+        return json.loads(self.__map[offset: offset + length])
+
+    def records(self, model: str) -> Iterator[dict]:
+        """Decodes every record of a model in insertion order"""
+        for number in range(self.count(model)):
+            yield self.record(model, number)
+
+    def has(self, model: str, obj_id: str) -> bool:
+        """Checks if there is a record with the given id, without decoding"""
+        if model not in self.models:
+            return False
+
+        count, _, _, ids_offset, _ = self.models[model]
+
+        return bool(self.__search(ids_offset, count, str(obj_id).encode()))
+
+    def get(self, model: str, obj_id: str) -> dict | None:
+        """Returns the record with the given id, using the id table"""
+        if model not in self.models:
+            return None
+
+        count, _, _, ids_offset, _ = self.models[model]
+        numbers = self.__search(ids_offset, count, str(obj_id).encode())
+
+        return self.record(model, numbers[0]) if numbers else None
+
+    def find(self, model: str, query: dict) -> list[dict] | None:
+        """
+        Returns the records matching the query using a secondary index,
+        or None if the model has no index for the fields of the query
+        """
+        if model not in self.models:
+            return []
+
+        count, index_count, _, _, indexes_offset = self.models[model]
+        best = None
+
+        for position in range(index_count):
+            fields, entries_offset = INDEX.unpack_from(
+                self.__map, indexes_offset + INDEX.size * position
+            )
+            fields = tuple(fields.rstrip(b"\x00").decode().split(","))
+
+            if all(f in query for f in fields) and (
+                best is None or len(fields) > len(best[0])
+            ):
+                best = (fields, entries_offset)
+
+        if best is None:
+            return None
+
+        fields, entries_offset = best
+        key = index_key([query[f] for f in fields])
+
+        return [
+            self.record(model, number)
+            for number in sorted(self.__search(entries_offset, count, key))
+        ]
+
+    def __key(self, table_offset: int, position: int) -> tuple[bytes, int]:
+        """Returns the key and record number of a table entry"""
+        offset, length, number = ENTRY.unpack_from(
+            self.__map, table_offset + ENTRY.size * position
+        )
+
+        return self.__map[offset: offset + length], number
+
+    def __search(self, table_offset: int, count: int, key: bytes) -> list:
+        """Binary search of every entry of a sorted table with a key"""
+        low, high = 0, count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.__key(table_offset, middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        numbers = []
+
+        while low < count:
+            found, number = self.__key(table_offset, low)
+
+            if found != key:
+                break
+
+            numbers.append(number)
+            low += 1
+
+        return numbers
+
+    def close(self) -> None:
+        """Unmaps the file"""
+        if isinstance(self.__map, mmap.mmap):
+            self.__map.close()
@@ -0,0 +1,314 @@
+"""
+This module exports a Repository with a memory tier in front of the
+database (REPOSITORY=tiered)
+
+Every read is served by an isolated MemoryRepository, loaded from the
+database when the app starts. Writes are applied to it right away and
+drained to DBRepository by a background thread (see WriteBehind), in
+batches of one transaction, in the order the objects were first
+changed. Many writes to an object within a batch cost a single one.
+
+The database is eventually durable: the backlog is flushed on shutdown,
+and changes not flushed yet are lost if the process dies. When
+TIERED_MAX_BACKLOG objects are waiting, writers block until their change
+is flushed (back-pressure). The backlog is published by /metrics.
+
+Models whose ids are generated by the database on insert (integer ids,
+like Amenity) are written through, so they get their id before they are
+stored in memory.
+
+With several workers, the commits of the others are received through
+the invalidation bus (see src/invalidation.py), and the objects they
+wrote are read again from the database. An object with a change of this
+worker not flushed yet keeps it: the last write to the database wins.
+"""
+
+import atexit
+import os
+from typing import Any, Iterator
+
+from flask import Flask
+
+from src.persistence.db import DBRepository
+from src.persistence.memory import MemoryRepository
+from src.persistence.repository import Repository
+from src.persistence.write_behind import WriteBehind
+from utils.constants import (
+    MODEL_NAMES,
+    TIERED_FLUSH_INTERVAL,
+    TIERED_FLUSH_MAX_CHANGES,
+    TIERED_MAX_BACKLOG_DEFAULT,
+    TIERED_MAX_BACKLOG_ENV_VAR,
+)
+
+
+class TieredRepository(Repository):
+    """Memory tier in front of a DBRepository, written behind"""
+
+    def __init__(self, max_backlog: int | None = None) -> None:
+        """
+        Creates the empty memory tier, the database is attached
+        by init_app
+
+        max_backlog is read from TIERED_MAX_BACKLOG by default
+        """
+        if max_backlog is None:
+            max_backlog = int(
+                os.getenv(
+                    TIERED_MAX_BACKLOG_ENV_VAR, TIERED_MAX_BACKLOG_DEFAULT
+                )
+            )
+
+        self.max_backlog = max_backlog
+        self.__front = MemoryRepository(isolated=True)
+        self.__back = DBRepository()
+        self.__app: Flask | None = None
+        self.__writer: WriteBehind | None = None
+        # Changes made before the app exists, drained once it does
+        self.__pending: dict[tuple[str, str], None] = {}
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Loads the database in the memory tier, seeds it, starts draining
+        the changes to the database, and reads again the objects the
+        other workers write
+        """
+        from src import invalidation
+        from utils.populate import populate_db
+
+        self.__app = app
+        self.reload()
+
+        self.__writer = WriteBehind(
+            self._drain,
+            interval=TIERED_FLUSH_INTERVAL,
+            max_changes=TIERED_FLUSH_MAX_CHANGES,
+            max_backlog=self.max_backlog,
+        )
+        atexit.register(self.close)
+
+        from src.metrics import register
+
+        register("tiered_write_behind", self.__writer.stats)
+
+        for model, obj_id in self.__pending:
+            self.__writer.mark(model, obj_id)
+        self.__pending = {}
+
+        populate_db(self)
+        invalidation.subscribe(self)
+
+    def _changed(self, model: str, obj_id: Any) -> None:
+        """Queues a change to be drained to the database"""
+        if self.__writer:
+            self.__writer.mark(model, str(obj_id))
+        else:
+            self.__pending[(model, str(obj_id))] = None
+
+    def _drain(self, changes: list[tuple[str, str]]) -> None:
+        """
+        Writes a batch of changes to the database, in one transaction
+
+        Objects that aren't in the memory tier anymore were deleted
+        """
+        from src.unit_of_work import transaction
+
+        with self.__app.app_context(), transaction():
+            for model, obj_id in changes:
+                obj = self.__front.get(model, obj_id)
+
+                if obj is not None:
+                    self.__back.merge(obj)
+                    continue
+
+                stored = self.__back.get(model, obj_id)
+
+                if stored is not None:
+                    self.__back.delete(stored)
+
+    def flush(self) -> None:
+        """Drains the backlog to the database now"""
+        if self.__writer:
+            self.__writer.flush()
+
+    def close(self) -> None:
+        """Drains the backlog and stops the writer, used on shutdown"""
+        if self.__writer:
+            self.__writer.close()
+
+    def backlog(self) -> int:
+        """Returns how many changed objects wait to be drained"""
+        if self.__writer:
+            return self.__writer.stats()["queue_depth"]
+
+        return len(self.__pending)
+
+    def reload(self) -> None:
+        """Loads every object of the database in the memory tier"""
+        if self.__app is None:
+            return
+
+        from src import db
+
+        # Maps every model, the routes that import them come later
+        from src.models import (  # noqa: F401
+            amenity,
+            city,
+            country,
+            place,
+            review,
+            user,
+        )
+
+        with self.__app.app_context():
+            for model in MODEL_NAMES:
+                self.__front.save_many(list(self.__back.iter_all(model)))
+
+            # The objects stay in memory, detached from the database
+            db.session.expunge_all()
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Reads the objects another worker wrote again, by model and id"""
+        if self.__app is None:
+            return
+
+        if any(obj_id is None for _, obj_id in changes):
+            self.clear()
+            return
+
+        ids: dict[str, list[str]] = {}
+        for model, obj_id in changes:
+            ids.setdefault(model, []).append(str(obj_id))
+
+        with self.__app.app_context():
+            for model, model_ids in ids.items():
+                self._refresh(model, model_ids, self.__back.get_many)
+
+    def clear(self) -> None:
+        """Reads every object again, once events were missed"""
+        if self.__app is None:
+            return
+
+        with self.__app.app_context():
+            for model in MODEL_NAMES:
+                ids = [str(obj.id) for obj in self.__front.get_all(model)]
+                self._refresh(
+                    model,
+                    ids,
+                    lambda model, ids: {
+                        str(obj.id): obj
+                        for obj in self.__back.iter_all(model)
+                    },
+                )
+
+    def _refresh(self, model: str, ids: list[str], read) -> None:
+        """
+        Replaces the objects of a model in memory with the ones read
+        from the database, read(model, ids) returns them by id (it may
+        return others, they are stored too), the ids it doesn't return
+        were deleted
+
+        Objects with a change not flushed yet are kept
+        """
+        from src import db
+
+        stored = read(model, ids)
+        # The objects stay in memory, detached from the database
+        db.session.expunge_all()
+
+        for obj_id in dict.fromkeys([*ids, *stored]):
+            if self.__writer and self.__writer.dirty(model, obj_id):
+                continue
+
+            self.__front.replace(model, obj_id, stored.get(obj_id))
+
+    def get_all(self, model_name: str) -> list:
+        """Get all objects of a model, from memory"""
+        return self.__front.get_all(model_name)
+
+    def iter_all(self, model_name: str) -> Iterator:
+        """Get all objects of a model one at a time, from memory"""
+        return self.__front.iter_all(model_name)
+
+    def get(self, model_name: str, obj_id: str) -> Any | None:
+        """Get an object by its ID, from memory"""
+        return self.__front.get(model_name, obj_id)
+
+    def get_many(self, model_name: str, ids: list) -> dict:
+        """Get the objects of a model with the given ids, from memory"""
+        return self.__front.get_many(model_name, ids)
+
+    def lookup(self, model_name: str, **fields) -> list:
+        """Get the objects of a model matching the fields, from memory"""
+        return self.__front.lookup(model_name, **fields)
+
+    def _prepare(self, obj: Any) -> bool:
+        """
+        Gives a new object the kind of id the database stores,
+        returns False if only the database can give it one
+        """
+        if obj.id is not None:
+            return True
+
+        obj.id = DBRepository.new_id(obj.__class__.__name__.lower())
+
+        return obj.id is not None
+
+    def _write_through(self, obj: Any) -> None:
+        """Saves an object in the database now, to get its id"""
+        with self.__app.app_context():
+            obj.id = self.__back.merge(obj).id
+
+    def save(self, obj: Any) -> Any:
+        """Save an object in memory, the database follows"""
+        if not self._prepare(obj) and self.__app:
+            self._write_through(obj)
+
+        self.__front.save(obj)
+        self._changed(obj.__class__.__name__.lower(), obj.id)
+
+        return obj
+
+    def save_many(self, objects: list) -> None:
+        """Save several objects in memory, the database follows"""
+        for obj in objects:
+            if not self._prepare(obj) and self.__app:
+                self._write_through(obj)
+
+        self.__front.save_many(objects)
+
+        for obj in objects:
+            self._changed(obj.__class__.__name__.lower(), obj.id)
+
+    def update(self, obj: Any) -> Any | None:
+        """Update an object in memory, the database follows"""
+        if self.__front.update(obj) is None:
+            return None
+
+        self._changed(obj.__class__.__name__.lower(), obj.id)
+
+        return obj
+
+    def delete(self, obj: Any) -> bool:
+        """Delete an object from memory, the database follows"""
+        if not self.__front.delete(obj):
+            return False
+
+        self._changed(obj.__class__.__name__.lower(), obj.id)
+
+        return True
+
+    def delete_many(self, objects: list) -> int:
+        """Delete several objects from memory, the database follows"""
+        stored = [
+            obj
+            for obj in objects
+            if self.__front.get(obj.__class__.__name__.lower(), obj.id)
+            is not None
+        ]
+        deleted = self.__front.delete_many(stored)
+
+        for obj in stored:
+            self._changed(obj.__class__.__name__.lower(), obj.id)
+
+        return deleted
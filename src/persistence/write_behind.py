@@ -0,0 +1,232 @@
+"""
+This module exports a background writer that groups the changes
+of a repository and persists them in batches (group commit)
+
+Changes are only marked as dirty by (model, id), so many writes to the
+same object within a batch cost a single write. A batch is flushed every
+`interval` seconds, or as soon as `max_changes` objects are dirty.
+
+If `wait` is True, mark blocks until the change has been flushed:
+the callers that arrive while a flush is running share the next one.
+With `max_backlog`, only the callers that find that many objects
+waiting block (back-pressure), until their change is flushed.
+
+A batch that fails to flush is kept and retried after `interval`
+seconds. A blocked caller gets the error once `max_failures` flushes
+failed while it waited; its change stays dirty and is retried.
+"""
+
+import threading
+import time
+from typing import Callable
+
+
+class WriteBehind:
+    """Dedicated thread that flushes the dirty objects of a repository"""
+
+    def __init__(
+        self,
+        flush: Callable[[list[tuple[str, str]]], None],
+        interval: float = 1.0,
+        max_changes: int = 500,
+        wait: bool = False,
+        max_backlog: int | None = None,
+        max_failures: int = 3,
+    ) -> None:
+        """
+        Starts the writer thread
+
+        flush receives the (model, id) pairs changed since the last batch,
+        in the order they were first changed
+        """
+        self.__flush = flush
+        self.interval = interval
+        self.max_changes = max_changes
+        self.wait = wait
+        self.max_backlog = max_backlog
+        self.max_failures = max_failures
+
+        self.__dirty: dict[tuple[str, str], None] = {}
+        # The batch being flushed, it isn't stored yet
+        self.__flushing: set[tuple[str, str]] = set()
+        self.__condition = threading.Condition()
+        self.__flush_lock = threading.Lock()
+        self.__marked = 0
+        self.__flushed = 0
+        self.__waiters = 0
+        self.__stopping = False
+        self.__closed = False
+        self.__error: Exception | None = None
+
+        self.__stats = {
+            "flushes": 0,
+            "changes": 0,
+            "flushed_objects": 0,
+            "errors": 0,
+            "throttled_writes": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+
+        self.__thread = threading.Thread(
+            target=self.__run, name="write-behind", daemon=True
+        )
+        self.__thread.start()
+
+    def mark(self, model: str, obj_id: str) -> None:
+        """Marks an object as changed"""
+        with self.__condition:
+            self.__dirty[(model, str(obj_id))] = None
+            self.__marked += 1
+            self.__stats["changes"] += 1
+            ticket = self.__marked
+            throttled = bool(self.max_backlog) and (
+                len(self.__dirty) >= self.max_backlog
+            )
+
+            if self.wait or throttled or (
+                len(self.__dirty) >= self.max_changes
+            ):
+                self.__condition.notify_all()
+
+            if not (self.wait or throttled):
+                return
+
+            if throttled:
+                self.__stats["throttled_writes"] += 1
+
+            errors = self.__stats["errors"]
+            self.__waiters += 1
+            try:
+                while self.__flushed < ticket:
+                    failed = self.__stats["errors"] - errors
+                    if self.__error is not None and (
+                        failed >= self.max_failures or self.__closed
+                    ):
+                        raise self.__error
+                    if self.__closed:
+                        return
+                    self.__condition.wait()
+            finally:
+                self.__waiters -= 1
+
+    def flush(self) -> None:
+        """Flushes the dirty objects right away"""
+        with self.__flush_lock:
+            with self.__condition:
+                batch = list(self.__dirty)
+                ticket = self.__marked
+                self.__dirty = {}
+                self.__flushing = set(batch)
+
+            if batch:
+                start = time.perf_counter()
+                try:
+                    self.__flush(batch)
+                except Exception as error:
+                    with self.__condition:
+                        self.__flushing = set()
+                        self.__stats["errors"] += 1
+                        self.__error = error
+                        # Keep the changes so the next batch retries them
+                        self.__dirty = dict.fromkeys(batch) | self.__dirty
+                        self.__condition.notify_all()
+                    raise
+                self.__record(len(batch), time.perf_counter() - start)
+
+            with self.__condition:
+                self.__flushing = set()
+                self.__flushed = max(self.__flushed, ticket)
+                self.__error = None
+                self.__condition.notify_all()
+
+    def dirty(self, model: str, obj_id: str) -> bool:
+        """Checks if a change of an object isn't flushed yet"""
+        key = (model, str(obj_id))
+
+        with self.__condition:
+            return key in self.__dirty or key in self.__flushing
+
+    def close(self) -> None:
+        """
+        Stops the thread and flushes what is left, used on shutdown
+
+        The waiting callers are only released after that last flush
+        """
+        with self.__condition:
+            if self.__stopping:
+                return
+            self.__stopping = True
+            self.__condition.notify_all()
+
+        self.__thread.join()
+
+        try:
+            self.flush()
+        finally:
+            with self.__condition:
+                self.__closed = True
+                self.__condition.notify_all()
+
+    def stats(self) -> dict:
+        """Returns the flush latency, batch size and queue depth"""
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats["queue_depth"] = len(self.__dirty)
+            stats["waiting_writers"] = self.__waiters
+            stats["max_backlog"] = self.max_backlog
+
+        flushes = stats["flushes"]
+        stats["avg_flush_seconds"] = (
+            stats["total_flush_seconds"] / flushes if flushes else 0.0
+        )
+        stats["avg_batch_size"] = (
+            stats["flushed_objects"] / flushes if flushes else 0.0
+        )
+
+        return stats
+
+    def __record(self, size: int, seconds: float) -> None:
+        """Records the metrics of a flush"""
+        with self.__condition:
+            self.__stats["flushes"] += 1
+            self.__stats["flushed_objects"] += size
+            self.__stats["last_batch_size"] = size
+            self.__stats["max_batch_size"] = max(
+                self.__stats["max_batch_size"], size
+            )
+            self.__stats["last_flush_seconds"] = seconds
+            self.__stats["total_flush_seconds"] += seconds
+
+    def __run(self) -> None:
+        """Waits for a batch to be ready and flushes it"""
+        while True:
+            with self.__condition:
+                deadline = time.monotonic() + self.interval
+
+                while not self.__stopping:
+                    if self.__dirty and (
+                        self.__waiters
+                        or len(self.__dirty) >= self.max_changes
+                    ):
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+
+                    self.__condition.wait(remaining)
+
+                if self.__stopping:
+                    return
+
+            try:
+                self.flush()
+            except Exception:
+                # Counted in the stats, the batch is retried after a pause
+                with self.__condition:
+                    self.__condition.wait_for(
+                        lambda: self.__stopping, self.interval
+                    )
@@ -0,0 +1,111 @@
+"""
+This module exports the routing of reads to the read replicas
+
+The replicas are the Flask-SQLAlchemy binds built from
+DATABASE_REPLICA_URLS (see src/config.py). The read-only calls of
+DBRepository (get, get_all, iter_all, lookup, get_many) use session(),
+which opens one session on a replica per app context (so per request),
+taking the replicas in turns. A request reads from a single replica,
+so its reads are consistent with each other.
+
+Once a request writes (see stick_to_primary), the rest of its reads
+go to the primary, so it reads its own writes. Without replicas,
+session() returns None and everything goes to the primary.
+
+The reads of every replica and of the primary are published by /metrics.
+"""
+
+import itertools
+import threading
+
+from flask import Flask, g, has_app_context
+from sqlalchemy.orm import Session
+
+from src import db
+from utils.constants import REPLICA_BIND_PREFIX
+
+
+_turns = itertools.count()
+_stats_lock = threading.Lock()
+_stats = {
+    "sessions": {},
+    "primary_reads": 0,
+}
+
+
+def replica_keys() -> list[str]:
+    """Returns the bind keys of the replicas of the current app"""
+    return sorted(
+        key
+        for key in db.engines
+        if key and key.startswith(REPLICA_BIND_PREFIX)
+    )
+
+
+def session() -> Session | None:
+    """
+    Returns the replica session of the current app context, or None
+    if reads must go to the primary: there are no replicas, there is
+    no app context, or the context already wrote
+    """
+    if not has_app_context() or g.get("replica_primary"):
+        _count_primary_read()
+        return None
+
+    if "replica_session" not in g:
+        keys = replica_keys()
+        g.replica_session = None
+
+        if keys:
+            key = keys[next(_turns) % len(keys)]
+            g.replica_session = Session(db.engines[key])
+            _count_session(key)
+
+    if g.replica_session is None:
+        _count_primary_read()
+
+    return g.replica_session
+
+
+def stick_to_primary() -> None:
+    """Sends the next reads of the current app context to the primary"""
+    if has_app_context():
+        g.replica_primary = True
+
+
+def close(error: BaseException | None = None) -> None:
+    """Closes the replica session of the app context that ended"""
+    replica_session = g.pop("replica_session", None)
+    g.pop("replica_primary", None)
+
+    if replica_session is not None:
+        replica_session.close()
+
+
+def init_app(app: Flask) -> None:
+    """Closes the replica sessions with their app context"""
+    from src.metrics import register
+
+    register("db_replicas", stats)
+    app.teardown_appcontext(close)
+
+
+def stats() -> dict:
+    """Returns the sessions opened on every replica and the primary reads"""
+    with _stats_lock:
+        return {
+            "sessions": dict(_stats["sessions"]),
+            "primary_reads": _stats["primary_reads"],
+        }
+
+
+def _count_session(key: str) -> None:
+    """Counts a session opened on a replica"""
+    with _stats_lock:
+        _stats["sessions"][key] = _stats["sessions"].get(key, 0) + 1
+
+
+def _count_primary_read() -> None:
+    """Counts a read sent to the primary"""
+    with _stats_lock:
+        _stats["primary_reads"] += 1
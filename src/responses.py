@@ -0,0 +1,324 @@
+"""
+This module exports the JSON responses of the read endpoints, built
+from a cache of the JSON of every entity
+
+json_list splices the encoded entities together instead of building
+the dict of each one (to_dict) and encoding the whole list again,
+json_entity returns the encoded entity as is.
+An entity is encoded once, and kept by (model, id) along with its
+updated_at and the digest of its JSON: an entry is only used while
+updated_at didn't change.
+
+Setting any column of an entity drops its entry right away, whatever
+the repository that stores it, so changes saved in the same second
+(the resolution of some database timestamps) are never missed. When
+the entity belongs to a database session, its entry is dropped again
+once the session commits, in case another thread encoded the row as
+it was before the commit. The entries of deleted entities are never
+read again and age out.
+
+The cache holds at most RESPONSE_CACHE_MAX_BYTES of JSON (see
+src/config.py), the least recently used entries are evicted first,
+and 0 turns it off. Hits, misses and evictions are published by
+/metrics.
+
+Both responses are conditional: their ETag is a digest of the digests
+of the entities (so it changes with any change of an entity, even
+within the second of its updated_at), and their Last-Modified is the
+latest updated_at. A GET whose If-None-Match (or, without it,
+If-Modified-Since) still matches gets a 304 without a body: the
+entities are only encoded when they aren't cached, and the body is
+never spliced.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
+import threading
+from typing import Any, Callable
+
+from flask import Flask, Response, current_app, request
+from sqlalchemy import event, inspect
+
+
+class FragmentCache:
+    """Bounded LRU cache of the JSON of the entities, by (model, id)"""
+
+    def __init__(self, max_bytes: int = 0) -> None:
+        """Creates an empty cache holding up to max_bytes of JSON"""
+        self.max_bytes = max_bytes
+
+        self.__lock = threading.Lock()
+        # (model, id) -> (updated_at, json, digest of the json), least
+        # recently used first
+        self.__entries: OrderedDict[
+            tuple[str, str], tuple[Any, bytes, bytes]
+        ] = OrderedDict()
+        self.__bytes = 0
+        # Bumped by every forget, an entity encoded meanwhile isn't kept
+        self.__generation = 0
+        self.__watched: set[type] = set()
+        self.__stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+        }
+
+    @staticmethod
+    def key(obj: Any) -> tuple[str, str]:
+        """Returns the key of an entity"""
+        return obj.__class__.__name__.lower(), str(obj.id)
+
+    def fragment(self, obj: Any) -> bytes:
+        """Returns the JSON of an entity, encoding it if needed"""
+        return self.encoded(obj)[0]
+
+    def encoded(self, obj: Any) -> tuple[bytes, bytes]:
+        """
+        Returns the JSON of an entity and its digest, encoding it
+        if needed
+        """
+        key = self.key(obj)
+        updated_at = obj.updated_at
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is not None and entry[0] == updated_at:
+                self.__entries.move_to_end(key)
+                self.__stats["hits"] += 1
+                return entry[1], entry[2]
+
+            self.__stats["misses"] += 1
+            generation = self.__generation
+
+        data = current_app.json.dumps(
+            obj.to_dict(), separators=(",", ":")
+        ).encode()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+
+        if self.max_bytes:
+            self._watch(obj.__class__)
+            self._keep(key, updated_at, data, digest, generation)
+
+        return data, digest
+
+    def _keep(
+        self,
+        key: tuple[str, str],
+        updated_at: Any,
+        data: bytes,
+        digest: bytes,
+        generation: int,
+    ) -> None:
+        """Stores the JSON of an entity, evicting the oldest ones"""
+        if len(data) > self.max_bytes:
+            return
+
+        with self.__lock:
+            if generation != self.__generation:
+                return
+
+            previous = self.__entries.pop(key, None)
+
+            if previous is not None:
+                self.__bytes -= len(previous[1])
+
+            self.__entries[key] = (updated_at, data, digest)
+            self.__bytes += len(data)
+
+            while self.__bytes > self.max_bytes:
+                _, (_, evicted, _) = self.__entries.popitem(last=False)
+                self.__bytes -= len(evicted)
+                self.__stats["evictions"] += 1
+
+    def forget(self, obj: Any) -> None:
+        """Drops the entry of an entity"""
+        if obj.id is not None:
+            self.invalidate(*self.key(obj))
+
+    def invalidate(self, model_name: str, obj_id: Any = None) -> None:
+        """
+        Drops the entry of an entity by its model and id, every entry
+        of the model without an id
+        """
+        with self.__lock:
+            self.__generation += 1
+            keys = (
+                [key for key in self.__entries if key[0] == model_name]
+                if obj_id is None
+                else [(model_name, str(obj_id))]
+            )
+
+            for key in keys:
+                entry = self.__entries.pop(key, None)
+
+                if entry is not None:
+                    self.__bytes -= len(entry[1])
+                    self.__stats["invalidations"] += 1
+
+    def invalidate_many(self, changes: list[tuple[str, Any]]) -> None:
+        """Drops the entries of several entities, by model and id"""
+        for model_name, obj_id in changes:
+            self.invalidate(model_name, obj_id)
+
+    def _watch(self, model_class: type) -> None:
+        """
+        Drops the entry of an entity of the class whenever one of its
+        columns is set, once the first entity of the class is cached
+        """
+        with self.__lock:
+            if model_class in self.__watched:
+                return
+            self.__watched.add(model_class)
+
+        for column in inspect(model_class).column_attrs:
+            event.listen(
+                getattr(model_class, column.key), "set", self._changed
+            )
+
+    def _changed(self, target: Any, value: Any, oldvalue: Any, initiator):
+        """
+        Listener of the columns of the watched classes, reads the id
+        without loading anything from the database
+        """
+        obj_id = target.__dict__.get("id")
+
+        if obj_id is None and inspect(target).identity:
+            obj_id = inspect(target).identity[0]
+
+        if obj_id is not None:
+            key = (target.__class__.__name__.lower(), str(obj_id))
+            self.invalidate(*key)
+            self._until_commit(inspect(target).session, key)
+
+    def _until_commit(self, session: Any, key: tuple[str, str]) -> None:
+        """Drops the entry of an entity again once its session commits"""
+        if session is None:
+            return
+
+        session.info.setdefault("response_fragments", set()).add(key)
+
+        if not event.contains(session, "after_commit", self._committed):
+            event.listen(session, "after_commit", self._committed)
+            event.listen(session, "after_rollback", self._rolled_back)
+
+    def _committed(self, session: Any) -> None:
+        """Drops the entries of the entities a session committed"""
+        self.invalidate_many(session.info.pop("response_fragments", ()))
+
+    def _rolled_back(self, session: Any) -> None:
+        """Forgets the entities of a transaction that was rolled back"""
+        session.info.pop("response_fragments", None)
+
+    def clear(self) -> None:
+        """Drops every entry"""
+        with self.__lock:
+            self.__generation += 1
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self) -> dict:
+        """Returns the hits, misses, evictions and size of the cache"""
+        with self.__lock:
+            return self.__stats | {
+                "entries": len(self.__entries),
+                "bytes": self.__bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+cache = FragmentCache()
+
+
+def validators(
+    digests: list[bytes], objects: list
+) -> tuple[str, datetime | None]:
+    """
+    Returns the ETag and the Last-Modified of a response built from the
+    entities, digests are the ones of their JSON
+    """
+    etag = hashlib.blake2b(b"".join(digests), digest_size=16).hexdigest()
+    last_modified = None
+
+    for obj in objects:
+        changed = obj.updated_at or obj.created_at
+
+        if last_modified is None or changed > last_modified:
+            last_modified = changed
+
+    return etag, last_modified
+
+
+def not_modified(etag: str, last_modified: datetime | None) -> bool:
+    """Checks if the client of the current request has the response"""
+    if request.method not in ("GET", "HEAD"):
+        return False
+
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    if request.if_modified_since and last_modified:
+        if last_modified.tzinfo is None:
+            # Like Response.last_modified, naive datetimes are UTC
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+        # HTTP dates have no fractions of a second
+        return last_modified.replace(microsecond=0) <= (
+            request.if_modified_since
+        )
+
+    return False
+
+
+def conditional(
+    objects: list, splice: Callable[[list[bytes]], bytes]
+) -> Response:
+    """
+    Returns the JSON response of the entities with its validators,
+    splice builds the body from the JSON of the entities, and is only
+    called when the client doesn't have it already
+    """
+    encoded = [cache.encoded(obj) for obj in objects]
+    etag, last_modified = validators([e[1] for e in encoded], objects)
+
+    if not_modified(etag, last_modified):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(
+            splice([e[0] for e in encoded]),
+            mimetype=current_app.json.mimetype,
+        )
+
+    response.set_etag(etag)
+
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+    return response
+
+
+def json_list(objects: list) -> Response:
+    """Returns the conditional JSON response of a list of entities"""
+    return conditional(
+        objects, lambda fragments: b"[" + b",".join(fragments) + b"]"
+    )
+
+
+def json_entity(obj: Any) -> Response:
+    """Returns the conditional JSON response of an entity"""
+    return conditional([obj], lambda fragments: fragments[0])
+
+
+def init_app(app: Flask) -> None:
+    """
+    Sizes the cache from the app's config, and invalidates it when
+    another worker writes (see src/invalidation.py)
+    """
+    from src import invalidation
+    from src.metrics import register
+
+    cache.max_bytes = app.config.get("RESPONSE_CACHE_MAX_BYTES", 0)
+    register("response_cache", cache.stats)
+    invalidation.subscribe(cache)
@@ -0,0 +1,10 @@
+"""
+This module contains the routes for the metrics endpoint
+"""
+
+from flask import Blueprint
+from src.controllers.metrics import get_metrics
+
+metrics_bp = Blueprint("metrics", __name__, url_prefix="/metrics")
+
+metrics_bp.route("/", methods=["GET"])(get_metrics)
@@ -0,0 +1,231 @@
+"""
+This module exports the request-scoped unit of work of the app
+
+With UNIT_OF_WORK enabled (the default, see src/config.py) the
+repositories and models only stage their changes: commit() flushes
+them, so ids and constraints are checked right away, and the request
+commits once when it succeeds, or rolls back when it fails (an error
+status or an exception). Outside of a request, transaction() groups
+several operations in a single commit the same way.
+
+Sessions other than db.session (like the ones of the shards, see
+src/persistence/sharded.py) that are flushed during a unit of work
+are committed or rolled back with it, one after the other. A unit of
+work without changes (like a GET) doesn't commit, its sessions are
+only closed.
+
+The number of commits of every request is published by /metrics.
+"""
+
+from contextlib import contextmanager
+import threading
+from typing import Iterator
+
+from flask import Flask, Response, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, SessionTransaction
+
+from src import db
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "commits": 0,
+    "rollbacks": 0,
+    "last_commits_per_request": 0,
+    "max_commits_per_request": 0,
+}
+
+
+def active() -> bool:
+    """Checks if the changes are part of an open unit of work"""
+    return has_app_context() and g.get("unit_of_work_depth", 0) > 0
+
+
+def commit(session: Session | None = None) -> None:
+    """
+    Commits the changes of the session, or only flushes them
+    if they are part of an open unit of work
+    """
+    session = session or db.session
+
+    if active():
+        session.flush()
+        _enlist(session)
+        return
+
+    session.commit()
+    _count_commit()
+
+
+def _enlist(session: Session) -> None:
+    """Adds a session to the ones the unit of work ends"""
+    if session is db.session:
+        return
+
+    enlisted = g.setdefault("unit_of_work_sessions", [])
+
+    if not any(s is session for s in enlisted):
+        enlisted.append(session)
+
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session: Session, flush_context) -> None:
+    """Records that the transaction of a session has changes"""
+    session.info["unit_of_work_flushed"] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _ended(session: Session, transaction: SessionTransaction) -> None:
+    """Forgets the changes of a transaction once it is committed or not"""
+    if transaction.parent is None:
+        session.info.pop("unit_of_work_flushed", None)
+
+
+def _changed(sessions: list[Session]) -> bool:
+    """Checks if any of the sessions has changes, flushed or not"""
+    return any(
+        s.new or s.dirty or s.deleted or s.info.get("unit_of_work_flushed")
+        for s in sessions
+    )
+
+
+def _end(sessions: list[Session]) -> None:
+    """
+    Commits the sessions if they have changes, only closes them
+    otherwise, rolls them back if a commit fails
+    """
+    if not _changed(sessions):
+        for session in sessions:
+            session.close()
+        return
+
+    try:
+        for session in sessions:
+            session.commit()
+    except Exception:
+        for session in sessions:
+            session.rollback()
+        _count_rollback()
+        raise
+
+    _count_commit()
+
+
+def _sessions(session: Session) -> list[Session]:
+    """Returns the sessions the unit of work ends, session first"""
+    return [session] + [
+        s for s in g.pop("unit_of_work_sessions", []) if s is not session
+    ]
+
+
+@contextmanager
+def transaction(session: Session | None = None) -> Iterator[None]:
+    """
+    Runs the block in a single transaction: commits once at the end,
+    rolls back if it raises. Nested blocks (or a block inside a
+    request) are part of the outer unit of work.
+    """
+    session = session or db.session
+    depth = g.get("unit_of_work_depth", 0)
+    g.unit_of_work_depth = depth + 1
+
+    try:
+        yield
+    except BaseException:
+        g.unit_of_work_depth = depth
+        if depth == 0:
+            for s in _sessions(session):
+                s.rollback()
+            _count_rollback()
+        raise
+
+    g.unit_of_work_depth = depth
+
+    if depth == 0:
+        _end(_sessions(session))
+
+
+def init_app(app: Flask) -> None:
+    """
+    Counts the commits of every request, and opens a unit of work
+    for every request if UNIT_OF_WORK is set
+    """
+    from src.metrics import register
+
+    register("unit_of_work", stats)
+    enabled = bool(app.config.get("UNIT_OF_WORK"))
+
+    @app.before_request
+    def begin() -> None:
+        """Opens the unit of work of the request"""
+        g.request_commits = 0
+        if enabled:
+            g.unit_of_work_depth = 1
+
+    @app.after_request
+    def finish(response: Response) -> Response:
+        """Commits the request if it succeeded, rolls it back otherwise"""
+        if g.pop("unit_of_work_depth", 0) > 0:
+            sessions = _sessions(db.session)
+
+            if response.status_code >= 400:
+                for session in sessions:
+                    session.rollback()
+                _count_rollback()
+            else:
+                _end(sessions)
+
+        _count_request()
+
+        return response
+
+    @app.teardown_request
+    def discard(error: BaseException | None) -> None:
+        """Rolls back a request that raised before it could finish"""
+        if g.pop("unit_of_work_depth", 0) > 0:
+            for session in _sessions(db.session):
+                session.rollback()
+            _count_rollback()
+        if "request_commits" in g:
+            _count_request()
+
+
+def stats() -> dict:
+    """Returns the commits and rollbacks done, by request"""
+    with _stats_lock:
+        result = dict(_stats)
+
+    result["avg_commits_per_request"] = (
+        result["commits"] / result["requests"] if result["requests"] else 0.0
+    )
+
+    return result
+
+
+def _count_commit() -> None:
+    """Counts a commit, and attributes it to the current request"""
+    with _stats_lock:
+        _stats["commits"] += 1
+
+    if has_app_context() and "request_commits" in g:
+        g.request_commits += 1
+
+
+def _count_rollback() -> None:
+    """Counts a rollback"""
+    with _stats_lock:
+        _stats["rollbacks"] += 1
+
+
+def _count_request() -> None:
+    """Records the number of commits of the request that ended"""
+    commits = g.pop("request_commits", 0)
+
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["last_commits_per_request"] = commits
+        _stats["max_commits_per_request"] = max(
+            _stats["max_commits_per_request"], commits
+        )
@@ -0,0 +1,287 @@
+""" Checks the read-through CachedRepository """
+
+import os
+import unittest
+from unittest import mock
+import uuid
+
+from flask import Flask
+from sqlalchemy import event
+
+from src import db, invalidation
+from src.models.country import Country
+from src.models.review import Review
+from src.persistence.cached import CachedRepository, cache_limits
+from src.persistence.db import DBRepository
+from src.persistence.memory import MemoryRepository
+
+
+def make_review() -> Review:
+    """Builds a review that isn't stored anywhere yet"""
+    return Review(place_id="place-1", user_id="user-1", comment="Ok", rating=3)
+
+
+class TestCachedRepository(unittest.TestCase):
+    """Tests of the cache in front of an isolated memory repository"""
+
+    def setUp(self):
+        """Wraps an empty memory repository, counting its reads"""
+        self.inner = MemoryRepository(isolated=True)
+        self.repo = CachedRepository(
+            self.inner, {None: (3, 60.0), "country": (0, 60.0)}
+        )
+        self.reads = mock.patch.object(
+            self.inner, "get", wraps=self.inner.get
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_reads_are_cached(self):
+        """The second get of an object doesn't reach the repository"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.assertIs(self.repo.get("review", review.id), review)
+        self.assertIs(self.repo.get("review", review.id), review)
+
+        self.assertEqual(self.reads.call_count, 1)
+        self.assertEqual(self.repo.stats()["hits"], 1)
+        self.assertEqual(self.repo.stats()["misses"], 1)
+
+    def test_entries_expire(self):
+        """An entry older than the ttl is read again"""
+        review = make_review()
+        self.repo.save(review)
+
+        with mock.patch("src.persistence.cached.time.monotonic") as clock:
+            clock.return_value = 0.0
+            self.repo.get("review", review.id)
+            clock.return_value = 61.0
+            self.repo.get("review", review.id)
+
+        self.assertEqual(self.reads.call_count, 2)
+        self.assertEqual(self.repo.stats()["expirations"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """A full model drops the entry read the longest time ago"""
+        reviews = [make_review() for _ in range(4)]
+        self.repo.save_many(reviews)
+
+        for review in reviews[:3]:
+            self.repo.get("review", review.id)
+        self.repo.get("review", reviews[0].id)
+        self.repo.get("review", reviews[3].id)
+        self.reads.reset_mock()
+
+        self.repo.get("review", reviews[0].id)
+        self.repo.get("review", reviews[1].id)
+
+        self.reads.assert_called_once_with("review", reviews[1].id)
+        self.assertEqual(self.repo.stats()["evictions"], 2)
+
+    def test_writes_invalidate(self):
+        """update and delete drop the entry of the object at once"""
+        review = make_review()
+        self.repo.save(review)
+        self.repo.get("review", review.id)
+
+        review.comment = "Changed"
+        self.repo.update(review)
+        self.repo.get("review", review.id)
+        self.repo.delete(review)
+
+        self.assertEqual(self.reads.call_count, 2)
+        self.assertIsNone(self.repo.get("review", review.id))
+
+    def test_lists_and_batches(self):
+        """get_all is cached until the model changes, get_many merges"""
+        reviews = [make_review() for _ in range(2)]
+        self.repo.save_many(reviews)
+
+        with mock.patch.object(
+            self.inner, "get_all", wraps=self.inner.get_all
+        ) as get_all:
+            self.assertEqual(self.repo.get_all("review"), reviews)
+            self.assertEqual(self.repo.get_all("review"), reviews)
+            self.assertEqual(get_all.call_count, 1)
+
+            self.repo.save(make_review())
+
+            self.assertEqual(len(self.repo.get_all("review")), 3)
+            self.assertEqual(get_all.call_count, 2)
+
+        self.repo.get("review", reviews[0].id)
+
+        with mock.patch.object(
+            self.inner, "get_many", wraps=self.inner.get_many
+        ) as get_many:
+            found = self.repo.get_many(
+                "review", [reviews[1].id, reviews[0].id, "missing"]
+            )
+
+        get_many.assert_called_once_with("review", [reviews[1].id, "missing"])
+        self.assertEqual(list(found), [reviews[1].id, reviews[0].id])
+
+    def test_queries_are_cached_by_generation(self):
+        """A lookup is read again only once its model was written"""
+        self.repo.save_many([make_review() for _ in range(2)])
+        self.repo.save(Country(name="Uruguay", code="UY"))
+
+        with mock.patch.object(
+            self.inner, "lookup", wraps=self.inner.lookup
+        ) as lookup:
+            first = self.repo.lookup("review", user_id="user-1")
+            self.assertEqual(
+                self.repo.lookup("review", user_id="user-1"), first
+            )
+            self.assertEqual(lookup.call_count, 1)
+
+            self.repo.save(make_review())
+
+            self.assertEqual(
+                len(self.repo.lookup("review", user_id="user-1")), 3
+            )
+            self.assertEqual(lookup.call_count, 2)
+            self.assertEqual(self.repo.stats()["stale_queries"], 1)
+
+        stats = self.repo.stats()
+        self.assertEqual(stats["query_hits"], 1)
+        self.assertEqual(stats["query_hit_ratio"], 1 / 3)
+        same_id = uuid.UUID(int=1)
+        self.assertEqual(
+            CachedRepository.query_key({"b": same_id, "a": None}),
+            CachedRepository.query_key({"a": None, "b": str(same_id)}),
+        )
+
+    def test_queries_are_bounded_by_model(self):
+        """The results of a model hold at most its size in objects"""
+        reviews = [make_review() for _ in range(3)]
+        for position, review in enumerate(reviews):
+            review.user_id = f"user-{position}"
+        self.repo.save_many(reviews)
+
+        self.repo.lookup("review", user_id="user-0")
+        self.repo.get_all("review")
+
+        self.assertEqual(self.repo.stats()["query_evictions"], 1)
+        self.assertEqual(self.repo.stats()["queries"]["review"], 1)
+
+        self.repo.save(make_review())
+        self.assertEqual(len(self.repo.get_all("review")), 4)
+        self.assertEqual(self.repo.stats()["queries"]["review"], 0)
+
+    def test_models_can_be_left_out(self):
+        """A size of 0 keeps nothing of the model"""
+        country = Country(name="Uruguay", code="UY")
+        self.repo.save(country)
+
+        self.repo.get("country", country.id)
+        self.repo.get("country", country.id)
+
+        self.assertEqual(self.reads.call_count, 2)
+
+    def test_limits_from_the_environment(self):
+        """Sizes and ttls are read by model"""
+        env = {
+            "REPOSITORY_CACHE_SIZE": "10",
+            "REPOSITORY_CACHE_TTL": "5",
+            "REPOSITORY_CACHE_LIMITS": "country=0:1, user=20:2.5",
+        }
+
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(
+                cache_limits(),
+                {None: (10, 5.0), "country": (0, 1.0), "user": (20, 2.5)},
+            )
+
+        with mock.patch.dict(os.environ, {"REPOSITORY_CACHE_LIMITS": "x=1"}):
+            self.assertRaises(ValueError, cache_limits)
+
+
+class TestCachedDatabase(unittest.TestCase):
+    """Tests of the cache in front of a DBRepository"""
+
+    def setUp(self):
+        """Creates the schema in a fresh in-memory database"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            db.create_all()
+
+        self.repo = CachedRepository(DBRepository(), {None: (10, 60.0)})
+        self.repo.init_app(self.app)
+        self.addCleanup(self.repo.close)
+
+    def tearDown(self):
+        """Drops the database"""
+        with self.app.app_context():
+            db.drop_all()
+
+    def test_objects_outlive_their_session(self):
+        """Cached objects are read and written by the next requests"""
+        with self.app.app_context():
+            country = Country(name="Uruguay", code="UY")
+            self.repo.save(country)
+            country_id = str(country.id)
+
+        with self.app.app_context():
+            cached = self.repo.get("country", country_id)
+
+        with self.app.app_context():
+            self.repo.save(Country(name="Chile", code="CL"))
+
+            self.assertIs(self.repo.get("country", country_id), cached)
+            self.assertEqual(cached.name, "Uruguay")
+
+            cached.name = "Changed"
+            self.repo.update(cached)
+
+        with self.app.app_context():
+            self.assertEqual(
+                self.repo.get_by("country", code="UY").name, "Changed"
+            )
+            self.assertIsNot(self.repo.get("country", country_id), cached)
+
+    def test_delete_many_of_cached_objects(self):
+        """Objects read by an earlier request are deleted"""
+        with self.app.app_context():
+            country = Country(name="Uruguay", code="UY")
+            self.repo.save(country)
+            country_id = str(country.id)
+
+        with self.app.app_context():
+            cached = self.repo.get_many("country", [country_id])
+
+        with self.app.app_context():
+            self.assertEqual(self.repo.delete_many(list(cached.values())), 1)
+
+        with self.app.app_context():
+            self.assertIsNone(self.repo.get("country", country_id))
+            self.assertIsNone(db.session.get(Country, country.id))
+
+    def test_direct_writes_invalidate(self):
+        """Objects written through the session change their generation"""
+        with self.app.app_context():
+            self.assertEqual(self.repo.get_all("country"), [])
+
+            db.session.add(Country(name="Chile", code="CL"))
+            db.session.commit()
+
+            self.assertEqual(len(self.repo.get_all("country")), 1)
+
+    def test_closed_caches_stop_listening(self):
+        """close removes the flush listener and the bus subscription"""
+        self.repo.close()
+
+        self.assertFalse(
+            event.contains(db.session, "after_flush", self.repo._flushed)
+        )
+        self.assertNotIn(self.repo, invalidation._subscribers)
+
+        # Closing twice is harmless
+        self.repo.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+""" Checks DBRepository against an in-memory SQLite database """
+
+import types
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+
+from src import db
+from src.models.city import City
+from src.models.country import Country
+from src.persistence.db import DBRepository
+
+
+class TestDBRepository(unittest.TestCase):
+    """Tests of the SQLAlchemy repository"""
+
+    def setUp(self):
+        """Creates the schema in a fresh in-memory database"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.repo = DBRepository()
+        self.country = Country(name="Uruguay", code="UY")
+        self.repo.save(self.country)
+
+        self.queries = []
+        event.listen(db.engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        """Drops the database"""
+        event.remove(db.engine, "before_cursor_execute", self.count)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def count(self, conn, cursor, statement, *args):
+        """Records every statement sent to the database"""
+        self.queries.append(statement)
+
+    def test_get_uses_the_identity_map(self):
+        """A loaded object is returned again without a query"""
+        city = City(name="Montevideo", country_code="UY")
+        self.repo.save(city)
+        first = self.repo.get("city", str(city.id))
+        self.queries.clear()
+
+        second = self.repo.get("city", str(city.id))
+
+        self.assertIs(first, second)
+        self.assertEqual(self.queries, [])
+        self.assertIsNone(self.repo.get("city", "not-a-uuid"))
+
+    def test_lookup(self):
+        """lookup filters by the given fields, converting uuid strings"""
+        montevideo = City(name="Montevideo", country_code="UY")
+        salto = City(name="Salto", country_code="UY")
+        self.repo.save(montevideo)
+        self.repo.save(salto)
+
+        self.assertEqual(
+            self.repo.lookup("city", country_code="UY"), [montevideo, salto]
+        )
+        self.assertEqual(
+            self.repo.lookup("city", id=str(salto.id), name="Salto"), [salto]
+        )
+        self.assertEqual(self.repo.get_by("country", code="UY"), self.country)
+        self.assertEqual(self.repo.lookup("city", country_code="AR"), [])
+
+    def test_statements_are_reused(self):
+        """The select of a model and fields is only built once"""
+        first = self.repo._statement("city", ("country_code",))
+        second = self.repo._statement("city", ("country_code",))
+
+        self.assertIs(first, second)
+
+    def test_iter_all_streams(self):
+        """iter_all is a generator that yields every object"""
+        cities = [City(name=f"City {n}", country_code="UY") for n in range(5)]
+        for city in cities:
+            self.repo.save(city)
+
+        rows = self.repo.iter_all("city")
+
+        self.assertIsInstance(rows, types.GeneratorType)
+        self.assertEqual(
+            sorted(c.name for c in rows), sorted(c.name for c in cities)
+        )
+
+    def test_batches(self):
+        """get_many reads every id with one query, invalid ids are skipped"""
+        cities = [City(name=f"City {n}", country_code="UY") for n in range(3)]
+        self.repo.save_many(cities)
+        ids = [str(cities[2].id), "not-a-uuid", str(cities[0].id)]
+        db.session.expire_all()
+        self.queries.clear()
+
+        found = self.repo.get_many("city", ids)
+
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(
+            [c.name for c in found.values()], ["City 2", "City 0"]
+        )
+
+        unsaved = City(name="New", country_code="UY")
+
+        self.assertEqual(self.repo.delete_many(cities[:2] + [unsaved]), 2)
+        self.assertEqual(self.repo.get_all("city"), [cities[2]])
+
+    def test_batches_of_ids_in_other_formats(self):
+        """get_many finds ids in upper case or without hyphens"""
+        city = City(name="Montevideo", country_code="UY")
+        self.repo.save(city)
+        upper = str(city.id).upper()
+
+        found = self.repo.get_many("city", [upper, city.id.hex])
+
+        self.assertEqual(list(found), [upper, city.id.hex])
+        self.assertIs(found[upper], city)
+
+    def test_delete(self):
+        """A deleted object can't be fetched anymore"""
+        city = City(name="Montevideo", country_code="UY")
+        self.repo.save(city)
+
+        self.assertTrue(self.repo.delete(city))
+        self.assertIsNone(self.repo.get("city", str(city.id)))
+        self.assertEqual(self.repo.get_all("city"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
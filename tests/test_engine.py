@@ -0,0 +1,157 @@
+""" Checks the SQLite profile and the connection pool of the engine """
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy import create_engine, exc, text
+
+from src import db
+from src.config import DevelopmentConfig, TestingConfig, pool_options
+from src.engine import InstrumentedQueuePool, configure_engine, pool_stats
+
+
+def make_app(config_class, uri: str | None = None) -> Flask:
+    """Builds an app with the database and engine of a config class"""
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    if uri:
+        app.config["SQLALCHEMY_DATABASE_URI"] = uri
+
+    db.init_app(app)
+
+    with app.app_context():
+        configure_engine(app)
+
+    return app
+
+
+def pragma(name: str):
+    """Reads a pragma with a connection of the current app"""
+    with db.engine.connect() as connection:
+        return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+
+class TestSQLiteProfile(unittest.TestCase):
+    """Tests of the SQLite pragmas set by configure_engine"""
+
+    def test_file_database(self):
+        """A file database gets the profile of DevelopmentConfig"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hbnb.db")
+            app = make_app(DevelopmentConfig, f"sqlite:///{path}")
+
+            with app.app_context():
+                self.assertEqual(pragma("journal_mode"), "wal")
+                self.assertEqual(pragma("synchronous"), 1)  # NORMAL
+                self.assertEqual(pragma("temp_store"), 2)  # MEMORY
+                self.assertEqual(pragma("busy_timeout"), 5000)
+                self.assertEqual(
+                    pragma("cache_size"),
+                    DevelopmentConfig.SQLITE_PRAGMAS["cache_size"],
+                )
+                db.engine.dispose()
+
+    def test_memory_database_is_shared(self):
+        """Every thread of a test sees the same in-memory database"""
+        app = make_app(TestingConfig)
+        seen = []
+
+        def read() -> None:
+            """Reads the table from another thread"""
+            with app.app_context():
+                with db.engine.connect() as connection:
+                    seen.append(
+                        connection.execute(text("SELECT n FROM t")).scalar()
+                    )
+
+        with app.app_context():
+            self.assertEqual(pragma("synchronous"), 0)  # OFF
+
+            with db.engine.begin() as connection:
+                connection.execute(text("CREATE TABLE t (n INTEGER)"))
+                connection.execute(text("INSERT INTO t VALUES (42)"))
+
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+
+            with db.engine.begin() as connection:
+                connection.execute(text("DROP TABLE t"))
+
+        self.assertEqual(seen, [42])
+
+
+class TestPool(unittest.TestCase):
+    """Tests of the pool options and statistics"""
+
+    def test_defaults_follow_workers_and_threads(self):
+        """Each worker keeps a connection per thread within the budget"""
+        env = {
+            "WEB_CONCURRENCY": "4",
+            "GUNICORN_THREADS": "8",
+            "DB_MAX_CONNECTIONS": "40",
+        }
+
+        with mock.patch.dict(os.environ, env):
+            options = pool_options()
+
+        self.assertEqual(options["pool_size"], 8)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_environment_overrides(self):
+        """Every option can be set from the environment"""
+        env = {
+            "DB_POOL_SIZE": "3",
+            "DB_MAX_OVERFLOW": "0",
+            "DB_POOL_TIMEOUT": "2.5",
+            "DB_POOL_RECYCLE": "60",
+            "DB_POOL_PRE_PING": "0",
+        }
+
+        with mock.patch.dict(os.environ, env):
+            options = pool_options()
+
+        self.assertEqual(
+            (
+                options["pool_size"],
+                options["max_overflow"],
+                options["pool_timeout"],
+                options["pool_recycle"],
+                options["pool_pre_ping"],
+            ),
+            (3, 0, 2.5, 60, False),
+        )
+
+    def test_pool_stats(self):
+        """Checkouts, their waits and timeouts are counted"""
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(
+                f"sqlite:///{os.path.join(tmp, 'pool.db')}",
+                poolclass=InstrumentedQueuePool,
+                pool_size=1,
+                max_overflow=0,
+                pool_timeout=0.05,
+            )
+
+            with engine.connect():
+                with self.assertRaises(exc.TimeoutError):
+                    engine.connect()
+
+                stats = pool_stats(engine.pool)
+
+            engine.dispose()
+
+        self.assertEqual(stats["checked_out"], 1)
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["pool"], "InstrumentedQueuePool")
+
+
+if __name__ == "__main__":
+    unittest.main()
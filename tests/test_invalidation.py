@@ -0,0 +1,156 @@
+""" Checks the invalidation bus shared by the workers """
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from src import db, invalidation
+from src.invalidation import InvalidationBus
+from src.models.country import Country
+from src.models.review import Review
+from src.persistence.cached import CachedRepository
+from src.persistence.db import DBRepository
+from src.persistence.memory import MemoryRepository
+
+
+class Recorder:
+    """Subscriber that remembers what it was told"""
+
+    def __init__(self):
+        """Starts with nothing recorded"""
+        self.invalidated = []
+        self.cleared = 0
+
+    def invalidate_many(self, changes):
+        """Records the invalidated objects"""
+        self.invalidated.extend(changes)
+
+    def clear(self):
+        """Records a reset"""
+        self.cleared += 1
+
+
+class TestInvalidationBus(unittest.TestCase):
+    """Tests of two workers sharing a bus file"""
+
+    def setUp(self):
+        """Opens the bus of two workers, and subscribes a recorder"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "bus.db")
+        self.first = InvalidationBus(self.path)
+        self.second = InvalidationBus(self.path)
+
+        self.recorder = Recorder()
+        invalidation.subscribe(self.recorder)
+
+    def tearDown(self):
+        """Closes the buses"""
+        invalidation.unsubscribe(self.recorder)
+        self.first.close()
+        self.second.close()
+        self.tmp.cleanup()
+
+    def test_events_reach_the_other_workers(self):
+        """A worker receives the events of the others, not its own"""
+        self.first.publish([("review", "1"), ("place", "2")])
+
+        self.assertEqual(self.first.poll(), 0)
+        self.assertEqual(self.second.poll(), 2)
+        self.assertEqual(self.second.poll(), 0)
+
+        self.assertEqual(
+            self.recorder.invalidated, [("review", "1"), ("place", "2")]
+        )
+        self.assertEqual(self.first.stats()["published"], 2)
+        self.assertEqual(self.second.stats()["received"], 2)
+
+    def test_pruned_events_reset_the_caches(self):
+        """A worker that missed events empties its caches"""
+        self.first.retention = 0
+        self.first.publish([("review", "1")])
+        self.first.poll()
+
+        self.second.poll()
+
+        self.assertEqual(self.recorder.invalidated, [])
+        self.assertEqual(self.recorder.cleared, 1)
+        self.assertEqual(self.second.stats()["resets"], 1)
+
+        # Later events are read again one by one
+        self.first.publish([("review", "2")])
+        self.second.poll()
+        self.assertEqual(self.recorder.invalidated, [("review", "2")])
+
+    def test_repository_cache_follows_the_other_workers(self):
+        """An object written elsewhere is read again"""
+        inner = MemoryRepository(isolated=True)
+        cached = CachedRepository(inner, {None: (10, 60.0)})
+        invalidation.subscribe(cached)
+        self.addCleanup(invalidation.unsubscribe, cached)
+
+        review = Review(
+            place_id="place-1", user_id="user-1", comment="Ok", rating=3
+        )
+        cached.save(review)
+
+        with mock.patch.object(inner, "get", wraps=inner.get) as get:
+            cached.get("review", review.id)
+            cached.get("review", review.id)
+            self.first.publish([("review", review.id)])
+            self.second.poll()
+            cached.get("review", review.id)
+
+        self.assertEqual(get.call_count, 2)
+
+
+class TestPublishedCommits(unittest.TestCase):
+    """Tests of the events published by the database commits"""
+
+    def setUp(self):
+        """Starts the bus of an app, and opens the one of another worker"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["INVALIDATION_BUS_PATH"] = os.path.join(
+            self.tmp.name, "bus.db"
+        )
+        db.init_app(self.app)
+        invalidation.init_app(self.app)
+
+        self.other = InvalidationBus(self.app.config["INVALIDATION_BUS_PATH"])
+        self.recorder = Recorder()
+        invalidation.subscribe(self.recorder)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Stops the buses and drops the database"""
+        db.drop_all()
+        self.context.pop()
+        invalidation.unsubscribe(self.recorder)
+        invalidation.close()
+        self.other.close()
+        self.tmp.cleanup()
+
+    def test_commits_are_published(self):
+        """Committed objects are published, rolled back ones are not"""
+        country = Country(name="Uruguay", code="UY")
+        DBRepository().save(country)
+
+        db.session.add(Country(name="Chile", code="CL"))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertEqual(self.other.poll(), 1)
+        self.assertEqual(
+            self.recorder.invalidated, [("country", str(country.id))]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
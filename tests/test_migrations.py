@@ -0,0 +1,98 @@
+""" Checks the migrations and the query plans of the hot queries """
+
+import unittest
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask import Flask
+from sqlalchemy import bindparam, select
+
+from src import db
+from src.migrate import upgrade_database
+from src.persistence.db import DBRepository
+
+# Model and fields of the queries run by the endpoints
+HOT_QUERIES = [
+    ("review", ("place_id",)),
+    ("review", ("user_id",)),
+    ("city", ("country_code",)),
+    ("place", ("city_id",)),
+    ("place", ("host_id",)),
+    ("placeamenity", ("amenity_id", "place_id")),
+    ("placeamenity", ("amenity_id",)),
+    ("user", ("email",)),
+    ("country", ("code",)),
+]
+
+
+class TestMigrations(unittest.TestCase):
+    """Tests of the schema built by the migrations"""
+
+    def setUp(self):
+        """Migrates a fresh in-memory database"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        upgrade_database()
+
+    def tearDown(self):
+        """Drops the database"""
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def plan(self, statement) -> list[str]:
+        """Returns the details of the SQLite query plan of a statement"""
+        compiled = statement.compile(dialect=db.engine.dialect)
+        params = tuple("x" for _ in compiled.positiontup)
+
+        with db.engine.connect() as connection:
+            rows = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {compiled}", params
+            )
+            return [row[-1] for row in rows]
+
+    def test_models_match_the_migrations(self):
+        """The migrated schema has every table and index of the models"""
+        with db.engine.connect() as connection:
+            context = MigrationContext.configure(
+                connection, opts={"compare_type": False}
+            )
+
+            self.assertEqual(compare_metadata(context, db.metadata), [])
+
+    def test_upgrade_is_idempotent(self):
+        """Upgrading an up to date database does nothing"""
+        upgrade_database()
+
+    def test_hot_queries_use_an_index(self):
+        """No hot query becomes a full table scan"""
+        repo = DBRepository()
+        statements = [
+            repo._statement(model, fields) for model, fields in HOT_QUERIES
+        ]
+        statements += [
+            select(mapper.class_).where(
+                *(
+                    column == bindparam(column.key)
+                    for column in mapper.primary_key
+                )
+            )
+            for mapper in db.Model.registry.mappers
+        ]
+
+        for statement in statements:
+            with self.subTest(statement=str(statement)):
+                plan = self.plan(statement)
+
+                self.assertTrue(plan)
+                self.assertFalse(
+                    [step for step in plan if step.startswith("SCAN")], plan
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
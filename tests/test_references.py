@@ -0,0 +1,176 @@
+""" Checks the referential checks of Place and Review creation """
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy import event
+
+from src import db
+from src.models.city import City
+from src.models.country import Country
+from src.models.place import Place
+from src.models.review import Review
+from src.models.user import User
+from src.persistence.db import DBRepository
+from src.persistence.memory import MemoryRepository
+from src.persistence.references import check_references, foreign_keys
+
+
+def place_data(host_id, city_id, name="Cabin") -> dict:
+    """Builds the payload of a place"""
+    return {
+        "name": name,
+        "address": "Street 1",
+        "host_id": host_id,
+        "city_id": city_id,
+    }
+
+
+class TestForeignKeys(unittest.TestCase):
+    """Tests of the references read from the tables"""
+
+    def test_foreign_keys(self):
+        """Only the foreign keys to ids are checked"""
+        self.assertEqual(
+            foreign_keys(Place), {"host_id": "user", "city_id": "city"}
+        )
+        self.assertEqual(
+            foreign_keys(Review), {"place_id": "place", "user_id": "user"}
+        )
+        self.assertEqual(foreign_keys(City), {})
+
+
+class TestInProcessReferences(unittest.TestCase):
+    """Tests of check_references with an in-process repository"""
+
+    def setUp(self):
+        """Stores a host and a city in a memory repository"""
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        self.repo = MemoryRepository()
+        self.host = User("host@example.com", "Ana", "Diaz", "secret")
+        self.city = City(name="Salto", country_code="UY")
+        self.repo.save_many([self.host, self.city])
+
+    def tearDown(self):
+        """Removes the stored objects"""
+        self.repo.delete_many([self.host, self.city])
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_existing_references(self):
+        """The referenced objects are returned by model and id"""
+        found = check_references(
+            Place,
+            [place_data(self.host.id, self.city.id)] * 2,
+            self.repo,
+        )
+
+        self.assertEqual(
+            found,
+            {
+                "user": {self.host.id: self.host},
+                "city": {self.city.id: self.city},
+            },
+        )
+
+    def test_missing_reference(self):
+        """A missing id raises a ValueError naming it"""
+        payloads = [
+            place_data(self.host.id, self.city.id),
+            place_data(self.host.id, "missing"),
+        ]
+
+        with self.assertRaisesRegex(ValueError, "City with ID missing"):
+            check_references(Place, payloads, self.repo)
+
+
+class TestDBReferences(unittest.TestCase):
+    """Tests of the queries run by Place and Review creation"""
+
+    def setUp(self):
+        """Stores a host and a city in a fresh in-memory database"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.repo = DBRepository()
+        self.patch = mock.patch("src.persistence.repo", self.repo)
+        self.patch.start()
+
+        self.host = User("host@example.com", "Ana", "Diaz", "secret")
+        self.repo.save_many(
+            [self.host, Country(name="Uruguay", code="UY")]
+        )
+        self.city = City(name="Salto", country_code="UY")
+        self.repo.save(self.city)
+        self.host_id, self.city_id = str(self.host.id), str(self.city.id)
+        db.session.expunge_all()
+
+        self.selects = []
+        event.listen(db.engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        """Drops the database"""
+        event.remove(db.engine, "before_cursor_execute", self.count)
+        self.patch.stop()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def count(self, conn, cursor, statement, *args):
+        """Records the selects sent to the database"""
+        if statement.startswith("SELECT"):
+            self.selects.append(statement)
+
+    def test_one_select_per_referenced_table(self):
+        """A batch of places checks its hosts and cities in two selects"""
+        places = Place.create_many(
+            [
+                place_data(self.host_id, self.city_id, f"P{n}")
+                for n in range(3)
+            ]
+        )
+
+        self.assertEqual(len(self.selects), 2)
+        self.assertEqual(len(self.repo.get_all("place")), 3)
+
+        self.selects.clear()
+        Review.create(
+            {
+                "place_id": str(places[0].id),
+                "user_id": self.host_id,
+                "comment": "Nice",
+                "rating": 5.0,
+            }
+        )
+
+        self.assertEqual(len(self.selects), 2)
+
+    def test_missing_reference_saves_nothing(self):
+        """No place of a batch is saved if one of them has a missing city"""
+        host_id, city_id = self.host_id, self.city_id
+        missing = "00000000-0000-0000-0000-000000000000"
+
+        with self.assertRaisesRegex(ValueError, f"City with ID {missing}"):
+            Place.create_many(
+                [
+                    place_data(host_id, city_id),
+                    place_data(host_id, missing),
+                ]
+            )
+
+        self.assertEqual(self.repo.get_all("place"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
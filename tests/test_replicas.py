@@ -0,0 +1,152 @@
+""" Checks the routing of reads to the read replicas """
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import uuid
+
+from flask import Flask
+from sqlalchemy import select
+
+from src import db, replicas
+from src.config import replica_binds
+from src.models.country import Country
+from src.persistence.db import DBRepository
+
+
+class TestReplicas(unittest.TestCase):
+    """Tests of DBRepository with SQLite files as primary and replicas"""
+
+    def setUp(self):
+        """
+        Builds a primary and two replicas, each with its own name
+        for the same country
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "{}.db")
+
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + (
+            path.format("primary")
+        )
+        self.app.config["SQLALCHEMY_BINDS"] = {
+            key: "sqlite:///" + path.format(key)
+            for key in ("replica_0", "replica_1")
+        }
+        db.init_app(self.app)
+        replicas.init_app(self.app)
+
+        country_id = uuid.uuid4()
+
+        with self.app.app_context():
+            for key, engine in db.engines.items():
+                db.metadata.create_all(engine)
+
+                with engine.begin() as connection:
+                    connection.execute(
+                        Country.__table__.insert(),
+                        {
+                            "id": country_id,
+                            "name": key or "primary",
+                            "code": "UY",
+                        },
+                    )
+
+        self.repo = DBRepository()
+
+    def tearDown(self):
+        """Closes every engine and removes the files"""
+        with self.app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+        # init_app registers a metadata per bind on the shared extension,
+        # the apps of the other tests don't have these binds
+        for key in self.app.config["SQLALCHEMY_BINDS"]:
+            db.metadatas.pop(key, None)
+
+        self.tmp.cleanup()
+
+    def read(self) -> str:
+        """Returns the name of the country of the database read from"""
+        return self.repo.get_by("country", code="UY").name
+
+    def test_reads_take_the_replicas_in_turns(self):
+        """Every app context reads from the next replica"""
+        seen = []
+
+        for _ in range(4):
+            with self.app.app_context():
+                # A request stays on its replica
+                seen.append(self.read())
+                self.assertEqual(self.read(), seen[-1])
+
+        self.assertEqual(set(seen), {"replica_0", "replica_1"})
+        self.assertNotEqual(seen[0], seen[1])
+        self.assertEqual(seen[0], seen[2])
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        """A context that wrote reads its own writes"""
+        with self.app.app_context():
+            self.assertTrue(self.read().startswith("replica_"))
+
+            self.repo.save(Country(name="Chile", code="CL"))
+
+            self.assertEqual(self.read(), "primary")
+            self.assertEqual(
+                self.repo.get_by("country", code="CL").name, "Chile"
+            )
+
+        with self.app.app_context():
+            self.assertTrue(self.read().startswith("replica_"))
+
+    def test_replica_objects_are_written_to_the_primary(self):
+        """An object read from a replica is updated in the primary"""
+        with self.app.app_context():
+            country = self.repo.get_by("country", code="UY")
+            country.name = "Changed"
+
+            self.repo.update(country)
+
+            self.assertEqual(self.read(), "Changed")
+            self.assertIsNone(self.repo.get_by("country", code="CL"))
+
+        names = {}
+        statement = select(Country.__table__.c.name)
+
+        with self.app.app_context():
+            for key, engine in db.engines.items():
+                with engine.connect() as connection:
+                    names[key] = connection.scalar(statement)
+
+        self.assertEqual(names[None], "Changed")
+        self.assertEqual(names["replica_0"], "replica_0")
+
+    def test_replica_binds(self):
+        """The replicas are read from DATABASE_REPLICA_URLS"""
+        env = {"DATABASE_REPLICA_URLS": "sqlite:///a.db, sqlite:///b.db,"}
+
+        with mock.patch.dict(os.environ, env):
+            self.assertEqual(
+                replica_binds(),
+                {"replica_0": "sqlite:///a.db", "replica_1": "sqlite:///b.db"},
+            )
+
+
+class TestWithoutReplicas(unittest.TestCase):
+    """Tests of the routing when there are no replicas"""
+
+    def test_reads_go_to_the_primary(self):
+        """session() returns None, so reads use the app's session"""
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(app)
+
+        with app.app_context():
+            self.assertIsNone(replicas.session())
+            self.assertIs(DBRepository()._reader(), db.session)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,908 @@
+""" Checks the contract shared by the in-process repositories """
+
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from unittest import mock
+import uuid
+
+from src.models.country import Country
+from src import invalidation
+from src.models.review import Review
+from src.persistence.file import FileRepository
+from src.persistence.journal import Journal
+from src.persistence.memory import MemoryRepository
+from src.persistence.mmapped import MmapRepository
+from src.persistence.pickled import PickleRepository
+
+
+def make_review(place_id="place-1", user_id="user-1") -> Review:
+    """Builds a review that isn't stored anywhere yet"""
+    return Review(
+        place_id=place_id, user_id=user_id, comment="Nice", rating=4.0
+    )
+
+
+def make_country() -> Country:
+    """Builds a country with a code no other test uses"""
+    return Country(name="Testland", code=uuid.uuid4().hex)
+
+
+def forget_shared_data() -> None:
+    """
+    Empties the data the instances of the repositories share in the
+    process, like a restart
+    """
+    for cls in (MemoryRepository, FileRepository, PickleRepository):
+        for objects in getattr(cls, f"_{cls.__name__}__data").values():
+            objects.clear()
+        getattr(cls, f"_{cls.__name__}__indexes").clear()
+
+
+class RepositoryContract:
+    """Tests every in-process repository has to pass"""
+
+    repository_class: type
+
+    def setUp(self):
+        """Starts every test with a fresh repository in a temp directory"""
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        forget_shared_data()
+        self.repo = self.repository_class()
+
+    def tearDown(self):
+        """Goes back to the original directory"""
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_save_and_get(self):
+        """A saved object can be fetched by its id"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.assertIsNotNone(review.id)
+        self.assertIs(self.repo.get("review", review.id), review)
+        self.assertIsNone(self.repo.get("review", "missing"))
+
+    def test_get_all_keeps_insertion_order(self):
+        """get_all returns the objects in the order they were saved"""
+        reviews = [make_review() for _ in range(5)]
+        for review in reviews:
+            self.repo.save(review)
+
+        self.repo.update(reviews[2])
+
+        self.assertEqual(self.repo.get_all("review"), reviews)
+
+    def test_save_twice_keeps_one_copy(self):
+        """Saving the same object again doesn't duplicate it"""
+        review = make_review()
+        self.repo.save(review)
+        self.repo.save(review)
+
+        self.assertEqual(self.repo.get_all("review"), [review])
+
+    def test_update(self):
+        """An updated object is returned by get"""
+        review = make_review()
+        self.repo.save(review)
+        review.comment = "Changed"
+
+        self.repo.update(review)
+
+        self.assertEqual(self.repo.get("review", review.id).comment, "Changed")
+
+    def test_delete(self):
+        """A deleted object can't be fetched anymore"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.assertTrue(self.repo.delete(review))
+        self.assertIsNone(self.repo.get("review", review.id))
+
+    def test_lookup_follows_writes(self):
+        """Indexed lookups stay correct through save, update and delete"""
+        first = make_review(place_id="place-1")
+        second = make_review(place_id="place-1", user_id="user-2")
+        self.repo.save(first)
+        self.repo.save(second)
+
+        self.assertEqual(
+            self.repo.lookup("review", place_id="place-1"), [first, second]
+        )
+        self.assertEqual(
+            self.repo.lookup("review", user_id="user-2"), [second]
+        )
+
+        first.place_id = "place-2"
+        self.repo.update(first)
+
+        self.assertEqual(
+            self.repo.lookup("review", place_id="place-1"), [second]
+        )
+        self.assertEqual(
+            self.repo.lookup("review", place_id="place-2"), [first]
+        )
+
+        self.repo.delete(second)
+
+        self.assertEqual(self.repo.lookup("review", place_id="place-1"), [])
+        self.assertEqual(
+            self.repo.lookup("review", place_id="place-2", user_id="user-1"),
+            [first],
+        )
+
+    def test_unique_keys(self):
+        """Natural keys can be looked up and can't be duplicated"""
+        country, other = make_country(), make_country()
+        self.repo.save(country)
+        self.repo.save(other)
+
+        self.assertIs(self.repo.get_by("country", code=country.code), country)
+        self.assertIsNone(self.repo.get_by("country", code="missing"))
+
+        duplicate = Country(name="Copy", code=country.code)
+        with self.assertRaises(ValueError):
+            self.repo.save(duplicate)
+        self.assertIsNone(self.repo.get("country", duplicate.id))
+
+        code = other.code
+        other.code = country.code
+        with self.assertRaises(ValueError):
+            self.repo.update(other)
+
+        # The rejected change of the stored instance is undone
+        self.assertEqual(other.code, code)
+        self.assertIs(self.repo.get_by("country", code=code), other)
+
+        self.repo.delete(country)
+        other.code = country.code
+        self.repo.update(other)
+
+        self.assertIs(self.repo.get_by("country", code=other.code), other)
+
+    def test_batches(self):
+        """save_many, get_many and delete_many act like their single calls"""
+        reviews = [make_review(place_id="place-3") for _ in range(3)]
+        country = make_country()
+        self.repo.save_many(reviews + [country])
+
+        self.assertEqual(self.repo.get_all("review"), reviews)
+        self.assertEqual(
+            self.repo.lookup("review", place_id="place-3"), reviews
+        )
+        self.assertEqual(
+            self.repo.get_many(
+                "review", [reviews[2].id, "missing", reviews[0].id]
+            ),
+            {reviews[2].id: reviews[2], reviews[0].id: reviews[0]},
+        )
+        self.assertIs(self.repo.get_by("country", code=country.code), country)
+
+        self.assertEqual(
+            self.repo.delete_many(reviews[:2] + [make_review()]), 2
+        )
+        self.assertEqual(self.repo.get_all("review"), reviews[2:])
+        self.assertEqual(self.repo.get_many("review", [reviews[0].id]), {})
+
+    def test_batches_are_all_or_nothing(self):
+        """A batch with a duplicated unique key saves nothing"""
+        country = make_country()
+        self.repo.save(country)
+        review = make_review()
+
+        for duplicate in (country.code, "batch-" + country.code):
+            batch = [
+                review,
+                Country(name="Copy", code=duplicate),
+                Country(name="Copy", code="batch-" + country.code),
+            ]
+
+            with self.assertRaises(ValueError):
+                self.repo.save_many(batch)
+
+            self.assertEqual(self.repo.get_all("review"), [])
+            self.assertEqual(
+                self.repo.get_many("country", [c.id for c in batch[1:]]), {}
+            )
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "workers are forked")
+class SharedFilesContract:
+    """Tests of the repositories whose files are shared by the workers"""
+
+    def in_other_worker(self, write) -> None:
+        """Runs write(repo) in a forked process, like another worker"""
+        pid = os.fork()
+
+        if pid == 0:
+            status = 1
+            try:
+                write(self.repo)
+                status = 0
+            finally:
+                os._exit(status)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+    def in_both_workers(self, write) -> None:
+        """Runs write(repo) in this process and in a forked one at once"""
+        pid = os.fork()
+
+        if pid == 0:
+            status = 1
+            try:
+                write(self.repo)
+                status = 0
+            finally:
+                os._exit(status)
+
+        try:
+            write(self.repo)
+        finally:
+            _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+    def save_in_both_workers(self) -> None:
+        """Both workers save 40 reviews at the same time"""
+        def write(repo):
+            """Saves the reviews of a worker"""
+            for _ in range(40):
+                repo.save(make_review())
+            repo.close()
+
+        self.in_both_workers(write)
+
+    def save_around_other_worker(self) -> list[Review]:
+        """
+        Saves a review, another worker saves one without this worker
+        hearing of it, then saves a third one, returns the three
+        """
+        first, other, last = [make_review() for _ in range(3)]
+        other.id = str(uuid.uuid4())
+
+        self.repo.save(first)
+        self.in_other_worker(lambda repo: repo.save(other))
+        self.repo.save(last)
+
+        return [first, other, last]
+
+    def write_elsewhere(self) -> tuple[Review, Review, Review, Review]:
+        """
+        Saves three reviews, then another worker updates one, deletes
+        one and adds one, returns them with the one left untouched
+        """
+        kept, changed, deleted = [make_review() for _ in range(3)]
+        added = make_review(place_id="place-2")
+        added.id = str(uuid.uuid4())
+
+        for review in (kept, changed, deleted):
+            self.repo.save(review)
+
+        def write(repo):
+            """Writes the changes of the other worker"""
+            review = repo.get("review", changed.id)
+            review.comment = "Elsewhere"
+            repo.update(review)
+            repo.delete(repo.get("review", deleted.id))
+            repo.save(added)
+
+        self.in_other_worker(write)
+
+        return kept, changed, deleted, added
+
+    def assert_read_again(self, kept, changed, deleted, added) -> None:
+        """Checks the changes of the other worker are seen"""
+        self.assertIs(self.repo.get("review", kept.id), kept)
+        self.assertEqual(
+            self.repo.get("review", changed.id).comment, "Elsewhere"
+        )
+        self.assertIsNone(self.repo.get("review", deleted.id))
+        self.assertEqual(
+            [r.id for r in self.repo.lookup("review", place_id="place-2")],
+            [added.id],
+        )
+
+    def test_writes_are_published(self):
+        """Every write tells the other workers which objects it wrote"""
+        review = make_review()
+
+        with mock.patch.object(invalidation, "bus") as bus:
+            self.repo.save(review)
+            self.repo.delete(review)
+
+        self.assertEqual(
+            [call.args[0] for call in bus.publish.call_args_list],
+            [[("review", review.id)], [("review", review.id)]],
+        )
+
+    def test_writes_of_other_workers_are_read_again(self):
+        """The objects of the events are read again from the files"""
+        kept, changed, deleted, added = self.write_elsewhere()
+
+        self.repo.invalidate_many(
+            [("review", r.id) for r in (changed, deleted, added)]
+        )
+
+        self.assert_read_again(kept, changed, deleted, added)
+
+    def test_everything_is_read_again_after_missed_events(self):
+        """Missed events read every object again"""
+        kept, changed, deleted, added = self.write_elsewhere()
+
+        self.repo.clear()
+
+        self.assertEqual(
+            self.repo.get("review", changed.id).comment, "Elsewhere"
+        )
+        self.assertIsNone(self.repo.get("review", deleted.id))
+        self.assertIsNotNone(self.repo.get("review", added.id))
+        self.assertIsNotNone(self.repo.get("review", kept.id))
+
+
+class TestMemoryRepository(RepositoryContract, unittest.TestCase):
+    """Runs the contract against MemoryRepository"""
+
+    repository_class = MemoryRepository
+
+    def test_missing_objects(self):
+        """Objects that aren't stored can't be updated or deleted"""
+        self.assertIsNone(self.repo.update(make_review()))
+        self.assertFalse(self.repo.delete(make_review()))
+
+
+class TestSnapshottedMemoryRepository(RepositoryContract, unittest.TestCase):
+    """Runs the contract against MemoryRepository with snapshots"""
+
+    def repository_class(self):
+        """Builds a MemoryRepository with background snapshots"""
+        return MemoryRepository(snapshots=True)
+
+    def tearDown(self):
+        """Stops the snapshot thread before removing its files"""
+        self.repo.close()
+        super().tearDown()
+
+    def test_restart_loads_the_snapshot(self):
+        """The data written by the forked child is loaded on start"""
+        reviews = [make_review() for _ in range(3)]
+        for review in reviews:
+            self.repo.save(review)
+        self.repo.delete(reviews[1])
+
+        self.repo.flush()
+
+        forget_shared_data()
+        restarted = MemoryRepository()
+
+        self.assertEqual(
+            [r.id for r in restarted.get_all("review")],
+            [reviews[0].id, reviews[2].id],
+        )
+        self.assertEqual(
+            [r.id for r in restarted.lookup("review", place_id="place-1")],
+            [reviews[0].id, reviews[2].id],
+        )
+
+    def test_snapshots_are_only_written_after_changes(self):
+        """A flush without changes doesn't fork a new snapshot"""
+        self.repo.save(make_review())
+        self.repo.flush()
+        stat = os.stat("data.memory.pkl")
+
+        self.repo.flush()
+
+        self.assertEqual(os.stat("data.memory.pkl").st_ino, stat.st_ino)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "snapshots are forked")
+    def test_stuck_snapshot_children_are_killed(self):
+        """A child that doesn't finish in time is killed and reaped"""
+        children = []
+        fork = os.fork
+
+        def remember_fork():
+            pid = fork()
+            if pid:
+                children.append(pid)
+            return pid
+
+        with mock.patch(
+            "src.persistence.memory.MEMORY_SNAPSHOT_TIMEOUT", 0.2
+        ), mock.patch(
+            "src.persistence.memory.atomic_write",
+            lambda *args: time.sleep(60),
+        ), mock.patch("os.fork", remember_fork):
+            with self.assertRaises(TimeoutError):
+                self.repo.bgsave()
+
+        # Already reaped by bgsave
+        with self.assertRaises(ChildProcessError):
+            os.waitpid(children[0], os.WNOHANG)
+
+
+class TestFileRepository(
+    SharedFilesContract, RepositoryContract, unittest.TestCase
+):
+    """Runs the contract against FileRepository"""
+
+    repository_class = FileRepository
+
+    def test_saves_keep_the_writes_of_other_workers(self):
+        """Rewriting the file doesn't drop what another worker wrote"""
+        reviews = self.save_around_other_worker()
+
+        forget_shared_data()
+        restarted = FileRepository()
+
+        for review in reviews:
+            self.assertIsNotNone(restarted.get("review", review.id))
+
+    def test_concurrent_saves(self):
+        """Two workers saving at once keep every object"""
+        self.save_in_both_workers()
+
+        forget_shared_data()
+        self.assertEqual(len(FileRepository().get_all("review")), 80)
+
+
+class TestJournaledFileRepository(
+    SharedFilesContract, RepositoryContract, unittest.TestCase
+):
+    """Runs the contract against FileRepository in journaled mode"""
+
+    def repository_class(self):
+        """Builds a journaled FileRepository"""
+        return FileRepository(journal=True)
+
+    def restart(self) -> FileRepository:
+        """Forgets the data in memory and loads it again from disk"""
+        forget_shared_data()
+
+        return FileRepository(journal=True)
+
+    def test_replay_after_restart(self):
+        """Changes are replayed from the journal on start"""
+        review = make_review()
+        self.repo.save(review)
+        review.comment = "Changed"
+        self.repo.update(review)
+        deleted = make_review()
+        self.repo.save(deleted)
+        self.repo.delete(deleted)
+
+        repo = self.restart()
+
+        self.assertEqual(repo.get("review", review.id).comment, "Changed")
+        self.assertIsNone(repo.get("review", deleted.id))
+        self.assertEqual(len(repo.get_all("country")), 1)
+
+    def test_compaction_keeps_the_records_of_other_workers(self):
+        """The records another worker appended are part of the file"""
+        reviews = self.save_around_other_worker()
+
+        self.repo.compact()
+
+        self.assertEqual(os.path.getsize("data.json.journal"), 0)
+        restarted = self.restart()
+        for review in reviews:
+            self.assertIsNotNone(restarted.get("review", review.id))
+
+    def test_concurrent_compactions(self):
+        """Two workers compacting while they append keep every object"""
+        with mock.patch(
+            "src.persistence.file.FILE_JOURNAL_COMPACT_MAX_BYTES", 2048
+        ):
+            self.save_in_both_workers()
+
+        self.assertEqual(len(self.restart().get_all("review")), 80)
+
+    def test_compact(self):
+        """Compaction moves the journal into the file"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.repo.compact()
+
+        self.assertEqual(os.path.getsize("data.json.journal"), 0)
+        self.assertIsNotNone(self.restart().get("review", review.id))
+
+    def test_compact_syncs_the_rename_first(self):
+        """The new file is in the directory before the journal is emptied"""
+        self.repo.save(make_review())
+        calls = []
+        reset = Journal.reset
+
+        def record_reset(journal):
+            """Records the reset and runs it"""
+            calls.append("reset")
+            reset(journal)
+
+        with mock.patch(
+            "src.persistence.segments.sync_directory",
+            side_effect=lambda directory: calls.append("sync"),
+        ), mock.patch.object(Journal, "reset", record_reset):
+            self.repo.compact()
+
+        self.assertEqual(calls, ["sync", "reset"])
+
+
+class TestWriteBehindFileRepository(RepositoryContract, unittest.TestCase):
+    """Runs the contract against FileRepository with write-behind"""
+
+    def repository_class(self):
+        """Builds a journaled FileRepository with write-behind"""
+        return FileRepository(journal=True, write_behind=True)
+
+    def tearDown(self):
+        """Stops the background writer before removing its files"""
+        self.repo.close()
+        super().tearDown()
+
+    def test_writes_are_coalesced(self):
+        """Many writes to one object in a batch cost a single record"""
+        self.repo.flush()
+        start = os.path.getsize("data.json.journal")
+        review = make_review()
+        self.repo.save(review)
+        for i in range(10):
+            review.comment = f"Comment {i}"
+            self.repo.update(review)
+
+        self.repo.flush()
+
+        with open("data.json.journal", "rb") as file:
+            file.seek(start)
+            records = [Journal.decode(line) for line in file]
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["data"]["comment"], "Comment 9")
+        self.assertEqual(
+            self.repo._FileRepository__write_behind.stats()["queue_depth"], 0
+        )
+
+
+class TestLazyFileRepository(
+    SharedFilesContract, RepositoryContract, unittest.TestCase
+):
+    """Runs the contract against FileRepository in lazy mode"""
+
+    def repository_class(self):
+        """Builds a lazy FileRepository"""
+        return FileRepository(lazy=True)
+
+    def restart(self, **kwargs) -> FileRepository:
+        """Forgets the data in memory and loads it again from disk"""
+        forget_shared_data()
+
+        return FileRepository(lazy=True, **kwargs)
+
+    def test_records_are_hydrated_on_read(self):
+        """Records are only turned into instances when read"""
+        first, second = make_review(), make_review(user_id="user-2")
+        self.repo.save(first)
+        self.repo.save(second)
+
+        repo = self.restart(lazy_cache_size=1)
+
+        self.assertEqual(repo.lazy_stats()["hydrations"], 0)
+        self.assertEqual(repo.get("review", first.id).comment, "Nice")
+        self.assertEqual(
+            [r.id for r in repo.lookup("review", user_id="user-2")],
+            [second.id],
+        )
+        self.assertEqual(repo.lazy_stats()["cached_instances"], 1)
+
+        repo.get("review", first.id)
+
+        self.assertEqual(repo.lazy_stats()["hydrations"], 3)
+
+    def test_evicted_changes_are_kept(self):
+        """An updated instance evicted from the cache keeps its changes"""
+        review = make_review()
+        self.repo.save(review)
+        repo = self.restart(lazy_cache_size=1)
+
+        loaded = repo.get("review", review.id)
+        loaded.comment = "Changed"
+        repo.update(loaded)
+        repo.get("country", repo.get_all("country")[0].id)
+
+        self.assertEqual(repo.get("review", review.id).comment, "Changed")
+
+
+class TestJournal(unittest.TestCase):
+    """Checks the journal survives torn writes"""
+
+    def test_torn_record_is_dropped(self):
+        """A half written record is ignored and removed"""
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "journal")
+            journal = Journal(filename)
+            journal.append({"n": 1})
+            journal.append({"n": 2})
+            journal.close()
+
+            with open(filename, "ab") as file:
+                file.write(Journal.encode({"n": 3})[:-5])
+
+            journal = Journal(filename)
+            self.assertEqual([r["n"] for r in journal.replay()], [1, 2])
+
+            journal.append({"n": 4})
+            journal.close()
+
+            journal = Journal(filename)
+            self.assertEqual([r["n"] for r in journal.replay()], [1, 2, 4])
+            journal.close()
+
+
+class TestPickleRepository(
+    SharedFilesContract, RepositoryContract, unittest.TestCase
+):
+    """Runs the contract against PickleRepository"""
+
+    repository_class = PickleRepository
+
+    def tearDown(self):
+        """Waits for the merges before removing their files"""
+        self.repo.close()
+        super().tearDown()
+
+    def test_merge_keeps_the_deltas_of_other_workers(self):
+        """The deltas another worker appended are part of the base"""
+        reviews = self.save_around_other_worker()
+        deltas = os.stat("data.pkl.deltas")
+
+        self.repo.merge()
+
+        # Emptied in place, the other workers keep appending to it
+        self.assertEqual(os.stat("data.pkl.deltas").st_ino, deltas.st_ino)
+        self.assertEqual(os.path.getsize("data.pkl.deltas"), 0)
+        with open("data.pkl", "rb") as file:
+            stored = pickle.load(file)["review"]
+        for review in reviews:
+            self.assertIn(review.id, stored)
+
+    def test_saves_keep_the_writes_of_other_workers(self):
+        """Without deltas, rewriting the base keeps the other's writes"""
+        self.repo = PickleRepository(deltas=False)
+        reviews = self.save_around_other_worker()
+
+        restarted = PickleRepository(deltas=False)
+
+        for review in reviews:
+            self.assertIsNotNone(restarted.get("review", review.id))
+
+    def test_concurrent_merges(self):
+        """Two workers merging while they append keep every object"""
+        with mock.patch(
+            "src.persistence.pickled.PICKLE_MERGE_MAX_BYTES", 2048
+        ):
+            self.save_in_both_workers()
+
+        self.assertEqual(len(PickleRepository().get_all("review")), 80)
+
+
+class TestMmapRepository(
+    SharedFilesContract, RepositoryContract, unittest.TestCase
+):
+    """Runs the contract against MmapRepository"""
+
+    repository_class = MmapRepository
+
+    def test_compact_moves_changes_to_the_snapshot(self):
+        """Compacted objects are read back from the snapshot"""
+        reviews = [make_review(place_id=f"place-{n % 2}") for n in range(4)]
+        for review in reviews:
+            self.repo.save(review)
+        self.repo.delete(reviews[1])
+
+        self.repo.compact()
+        restarted = MmapRepository()
+
+        self.assertEqual(os.path.getsize("data.snapshot.journal"), 0)
+        self.assertEqual(
+            [r.id for r in restarted.get_all("review")],
+            [reviews[0].id, reviews[2].id, reviews[3].id],
+        )
+        self.assertEqual(
+            restarted.get("review", reviews[3].id).place_id, "place-1"
+        )
+        self.assertIsNone(restarted.get("review", reviews[1].id))
+        self.assertEqual(
+            [r.id for r in restarted.lookup("review", place_id="place-0")],
+            [reviews[0].id, reviews[2].id],
+        )
+
+    def test_journal_overlays_the_snapshot(self):
+        """Changes made after a compaction survive a restart"""
+        kept, changed, deleted = [make_review() for _ in range(3)]
+        for review in (kept, changed, deleted):
+            self.repo.save(review)
+        self.repo.compact()
+
+        changed = self.repo.get("review", changed.id)
+        changed.place_id = "place-2"
+        self.repo.update(changed)
+        self.repo.delete(self.repo.get("review", deleted.id))
+        added = self.repo.save(make_review(place_id="place-2"))
+
+        restarted = MmapRepository()
+
+        self.assertEqual(
+            [r.id for r in restarted.get_all("review")],
+            [kept.id, changed.id, added.id],
+        )
+        self.assertIsNone(restarted.get("review", deleted.id))
+        self.assertEqual(
+            [r.id for r in restarted.lookup("review", place_id="place-1")],
+            [kept.id],
+        )
+        self.assertEqual(
+            [r.id for r in restarted.lookup("review", place_id="place-2")],
+            [changed.id, added.id],
+        )
+
+
+class TestDeltaPickleRepository(unittest.TestCase):
+    """Checks the deltas of PickleRepository"""
+
+    def setUp(self):
+        """Starts every test with a fresh repository in a temp directory"""
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+        self.repo = PickleRepository()
+
+    def tearDown(self):
+        """Goes back to the original directory"""
+        self.repo.close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_changes_only_append_deltas(self):
+        """The base isn't rewritten by a change"""
+        self.repo.merge()
+        base = os.stat("data.pkl")
+
+        self.repo.save(make_review())
+
+        self.assertEqual(os.stat("data.pkl").st_ino, base.st_ino)
+        self.assertGreater(os.path.getsize("data.pkl.deltas"), 0)
+
+    def test_deleting_a_missing_object_writes_nothing(self):
+        """delete returns False and doesn't append a delta"""
+        size = os.path.getsize("data.pkl.deltas")
+
+        self.assertFalse(self.repo.delete(make_review()))
+        self.assertEqual(os.path.getsize("data.pkl.deltas"), size)
+
+    def test_restart_applies_the_deltas(self):
+        """The deltas are applied over the base on start"""
+        kept, changed, deleted = [make_review() for _ in range(3)]
+        for review in (kept, changed, deleted):
+            self.repo.save(review)
+        self.repo.merge()
+
+        changed.place_id = "place-2"
+        self.repo.update(changed)
+        self.repo.delete(deleted)
+        added = make_review(place_id="place-2")
+        self.repo.save(added)
+
+        # A torn delta, as left by a crash in the middle of an append
+        with open("data.pkl.deltas", "ab") as file:
+            file.write(b"\x40\x00\x00\x00partial")
+
+        restarted = PickleRepository()
+
+        self.assertEqual(
+            [r.id for r in restarted.get_all("review")],
+            [kept.id, changed.id, added.id],
+        )
+        self.assertEqual(
+            [r.id for r in restarted.lookup("review", place_id="place-2")],
+            [changed.id, added.id],
+        )
+
+    def test_merge_drops_the_merged_deltas(self):
+        """Merged deltas are in the base and not in the deltas anymore"""
+        review = make_review()
+        self.repo.save(review)
+
+        self.repo.merge()
+
+        self.assertEqual(os.path.getsize("data.pkl.deltas"), 0)
+        with open("data.pkl", "rb") as file:
+            self.assertIn(review.id, pickle.load(file)["review"])
+
+    def test_segmented_merge(self):
+        """With the segmented layout a merge only writes changed models"""
+        repo = PickleRepository(layout="segmented")
+        repo.merge()
+        country = os.stat(os.path.join("data.pkl.d", "country.pkl"))
+
+        review = make_review()
+        repo.save(review)
+        repo.merge()
+
+        self.assertEqual(
+            os.stat(os.path.join("data.pkl.d", "country.pkl")).st_ino,
+            country.st_ino,
+        )
+        self.assertIsNotNone(
+            PickleRepository(layout="segmented").get("review", review.id)
+        )
+
+
+class SegmentedContract(RepositoryContract):
+    """Tests of the segmented layout, where every model has its own file"""
+
+    segment_extension: str
+
+    def test_only_changed_segments_are_written(self):
+        """Saving a review doesn't rewrite the other models"""
+        self.repo.save(make_review())
+        country = os.path.join(
+            self.segments_dirname, f"country{self.segment_extension}"
+        )
+        inode = os.stat(country).st_ino
+
+        self.repo.save(make_review())
+
+        self.assertEqual(os.stat(country).st_ino, inode)
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(
+                    self.segments_dirname, f"review{self.segment_extension}"
+                )
+            )
+        )
+
+
+class TestSegmentedFileRepository(SegmentedContract, unittest.TestCase):
+    """Runs the contract against FileRepository with one file per model"""
+
+    segments_dirname = "data.json.d"
+    segment_extension = ".json"
+
+    def repository_class(self):
+        """Builds a segmented FileRepository"""
+        return FileRepository(layout="segmented")
+
+
+class TestSegmentedPickleRepository(SegmentedContract, unittest.TestCase):
+    """Runs the contract against PickleRepository with one file per model"""
+
+    segments_dirname = "data.pkl.d"
+    segment_extension = ".pkl"
+
+    def repository_class(self):
+        """
+        Builds a segmented PickleRepository that writes the segments
+        on every change
+        """
+        return PickleRepository(layout="segmented", deltas=False)
+
+    def test_reload(self):
+        """Segments are loaded back on start"""
+        review = make_review()
+        self.repo.save(review)
+
+        repo = PickleRepository(layout="segmented", deltas=False)
+        loaded = repo.get("review", review.id)
+
+        self.assertIsNotNone(loaded)
+        self.assertEqual(repo.lookup("review", place_id="place-1"), [loaded])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,296 @@
+""" Checks the cached and conditional JSON responses """
+
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from flask import Flask
+from sqlalchemy.orm import Session
+
+from src import db
+from src.models.country import Country
+from src.models.review import Review
+from src.persistence.db import DBRepository
+from src.persistence.repository import stamp
+from src.responses import (
+    FragmentCache,
+    cache,
+    conditional,
+    json_entity,
+    json_list,
+)
+
+
+def make_review() -> Review:
+    """Builds a review with its id and timestamps"""
+    review = Review(
+        place_id="place-1", user_id="user-1", comment="Ok", rating=3
+    )
+    stamp(review)
+
+    return review
+
+
+class TestResponses(unittest.TestCase):
+    """Tests of json_list and of the cache behind it"""
+
+    def setUp(self):
+        """Pushes a request context and resizes the shared cache"""
+        self.app = Flask(__name__)
+        self.context = self.app.test_request_context()
+        self.context.push()
+
+        self.max_bytes = cache.max_bytes
+        cache.max_bytes = 1024 * 1024
+        cache.clear()
+
+    def tearDown(self):
+        """Restores the shared cache"""
+        cache.max_bytes = self.max_bytes
+        cache.clear()
+        self.context.pop()
+
+    def read(self, reviews: list) -> list:
+        """Returns the decoded body of the response of the reviews"""
+        response = json_list(reviews)
+        self.assertEqual(response.mimetype, "application/json")
+
+        return json.loads(response.get_data())
+
+    def test_fragments_match_to_dict(self):
+        """The spliced list is the list of the dicts, encoded once"""
+        reviews = [make_review() for _ in range(3)]
+        before = cache.stats()
+
+        self.assertEqual(self.read(reviews), [r.to_dict() for r in reviews])
+        self.assertEqual(self.read(reviews), [r.to_dict() for r in reviews])
+
+        self.assertEqual(cache.stats()["misses"] - before["misses"], 3)
+        self.assertEqual(cache.stats()["hits"] - before["hits"], 3)
+        self.assertEqual(self.read([]), [])
+
+    def test_changes_invalidate(self):
+        """Setting a column or a new updated_at encodes the entity again"""
+        review = make_review()
+        self.read([review])
+
+        review.comment = "Changed"
+        self.assertEqual(self.read([review])[0]["comment"], "Changed")
+
+        # Like a database refresh, which doesn't go through setattr
+        review.__dict__["rating"] = 5
+        self.assertEqual(self.read([review])[0]["rating"], 3)
+        review.__dict__["updated_at"] = review.updated_at + timedelta(1)
+        self.assertEqual(self.read([review])[0]["rating"], 5)
+
+    def test_memory_is_bounded(self):
+        """The least recently used entities are evicted past max_bytes"""
+        small = FragmentCache(max_bytes=1)
+        reviews = [make_review() for _ in range(3)]
+
+        for review in reviews:
+            small.fragment(review)
+
+        self.assertEqual(small.stats()["entries"], 0)
+
+        small.max_bytes = len(small.fragment(reviews[0])) * 2
+        for review in reviews:
+            small.fragment(review)
+
+        self.assertEqual(small.stats()["entries"], 2)
+        self.assertGreaterEqual(small.stats()["evictions"], 1)
+        self.assertLessEqual(small.stats()["bytes"], small.max_bytes)
+
+    def test_not_modified_lists_are_not_encoded(self):
+        """A 304 uses the cached digests, without building the body"""
+        reviews = [make_review() for _ in range(3)]
+        etag = json_list(reviews).headers["ETag"]
+        before = cache.stats()
+        splice = mock.Mock()
+
+        with self.app.test_request_context(headers={"If-None-Match": etag}):
+            response = conditional(reviews, splice)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        splice.assert_not_called()
+        self.assertEqual(cache.stats()["misses"], before["misses"])
+        self.assertEqual(cache.stats()["hits"] - before["hits"], 3)
+
+    def test_cache_can_be_turned_off(self):
+        """With max_bytes at 0 every entity is encoded every time"""
+        cache.max_bytes = 0
+        review = make_review()
+        review.updated_at = datetime(2024, 1, 1)
+
+        self.read([review])
+        self.read([review])
+
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class TestConditionalResponses(unittest.TestCase):
+    """Tests of the ETag, Last-Modified and 304 of the responses"""
+
+    def setUp(self):
+        """Serves a list of reviews and every review of it"""
+        self.reviews = [make_review() for _ in range(2)]
+        self.app = Flask(__name__)
+        self.client = self.app.test_client()
+
+        self.app.add_url_rule(
+            "/reviews", "list", lambda: json_list(self.reviews)
+        )
+        self.app.add_url_rule(
+            "/reviews/<int:index>",
+            "entity",
+            lambda index: json_entity(self.reviews[index]),
+        )
+
+    def test_validators(self):
+        """Responses have an ETag and the latest updated_at"""
+        self.reviews[1].updated_at = datetime(2024, 1, 2, 3, 4, 5, 6)
+        self.reviews[0].updated_at = datetime(2024, 1, 1)
+
+        first = self.client.get("/reviews")
+        entity = self.client.get("/reviews/0")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.headers["ETag"].startswith('"'))
+        self.assertEqual(
+            first.headers["Last-Modified"], "Tue, 02 Jan 2024 03:04:05 GMT"
+        )
+        self.assertEqual(entity.get_json(), self.reviews[0].to_dict())
+        self.assertNotEqual(entity.headers["ETag"], first.headers["ETag"])
+        self.assertEqual(
+            self.client.get("/reviews").headers["ETag"],
+            first.headers["ETag"],
+        )
+
+    def test_matching_etag_is_not_modified(self):
+        """A client with the current ETag gets a 304 and no body"""
+        etag = self.client.get("/reviews/1").headers["ETag"]
+
+        response = self.client.get(
+            "/reviews/1", headers={"If-None-Match": etag}
+        )
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_changes_change_the_etag(self):
+        """Updating, adding or removing an entity changes the list ETag"""
+        etag = self.client.get("/reviews").headers["ETag"]
+        headers = {"If-None-Match": etag}
+        self.assertEqual(
+            self.client.get("/reviews", headers=headers).status_code, 304
+        )
+
+        self.reviews[0].updated_at += timedelta(seconds=1)
+        self.assertEqual(
+            self.client.get("/reviews", headers=headers).status_code, 200
+        )
+
+        etag = self.client.get("/reviews").headers["ETag"]
+        self.reviews.append(make_review())
+        self.assertNotEqual(self.client.get("/reviews").headers["ETag"], etag)
+        self.reviews.pop()
+        self.assertEqual(self.client.get("/reviews").headers["ETag"], etag)
+
+    def test_if_modified_since(self):
+        """Last-Modified is compared without the fractions of a second"""
+        self.reviews[1].updated_at = datetime(2024, 1, 2, 3, 4, 5, 6)
+        self.reviews[0].updated_at = datetime(2024, 1, 1)
+
+        for since, status in (
+            ("Tue, 02 Jan 2024 03:04:05 GMT", 304),
+            ("Tue, 02 Jan 2024 03:04:04 GMT", 200),
+        ):
+            response = self.client.get(
+                "/reviews", headers={"If-Modified-Since": since}
+            )
+            self.assertEqual(response.status_code, status)
+
+        # If-None-Match wins over If-Modified-Since
+        response = self.client.get(
+            "/reviews",
+            headers={
+                "If-None-Match": '"other"',
+                "If-Modified-Since": "Tue, 02 Jan 2024 03:04:05 GMT",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class TestDatabaseETags(unittest.TestCase):
+    """Tests of the ETags of entities stored in the database"""
+
+    def setUp(self):
+        """Creates the schema and pushes a request context"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        db.init_app(self.app)
+        self.context = self.app.test_request_context()
+        self.context.push()
+        db.create_all()
+
+        self.max_bytes = cache.max_bytes
+        cache.max_bytes = 1024 * 1024
+        cache.clear()
+
+    def tearDown(self):
+        """Drops the database and restores the shared cache"""
+        cache.max_bytes = self.max_bytes
+        cache.clear()
+        db.drop_all()
+        self.context.pop()
+
+    def test_updates_in_the_same_second(self):
+        """Updates within the second of updated_at change the ETag"""
+        repo = DBRepository()
+        country = Country(name="Z", code="AA")
+        repo.save(country)
+        country.name = "A"
+        repo.update(country)
+
+        first = json_entity(repo.get("country", country.id))
+        updated_at = country.updated_at
+
+        country.name = "B"
+        repo.update(country)
+        db.session.expire_all()
+        second = json_entity(repo.get("country", country.id))
+
+        if country.updated_at == updated_at:
+            # The case of a timestamp with a resolution of a second
+            self.assertNotEqual(first.get_data(), second.get_data())
+        self.assertEqual(second.get_json()["name"], "B")
+        self.assertNotEqual(first.headers["ETag"], second.headers["ETag"])
+
+    def test_commits_drop_the_rows_encoded_meanwhile(self):
+        """A row encoded before the commit of its change isn't kept"""
+        country = Country(name="Z", code="AA")
+        country.updated_at = datetime(2024, 1, 1)
+        db.session.add(country)
+        db.session.commit()
+        country_id = country.id
+        json_entity(country)
+
+        country.name = "B"
+
+        # Another thread reads the row before the change is committed
+        with Session(db.engine) as other:
+            stale = other.get(Country, country_id)
+            self.assertEqual(json_entity(stale).get_json()["name"], "Z")
+        self.assertEqual(cache.stats()["entries"], 1)
+
+        db.session.commit()
+
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(json_entity(country).get_json()["name"], "B")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+""" Checks the hash-partitioned ShardedRepository """
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import zlib
+
+from src.models.amenity import Amenity
+from src.models.city import City
+from src.models.country import Country
+from src.models.review import Review
+from src.persistence.memory import MemoryRepository
+from src.persistence.sharded import (
+    ShardedRepository,
+    create_shards,
+    rebalance,
+)
+
+
+def make_review(place_id="place-1") -> Review:
+    """Builds a review that isn't stored anywhere yet"""
+    return Review(place_id=place_id, user_id="user-1", comment="Ok", rating=3)
+
+
+class TestMemoryShards(unittest.TestCase):
+    """Tests of a ShardedRepository over isolated memory repositories"""
+
+    def setUp(self):
+        """Builds a repository of three memory shards"""
+        self.repo = ShardedRepository(create_shards("memory", 3))
+
+    def test_models_write_through_the_shards(self):
+        """The models create, read and update their objects in the shards"""
+        with mock.patch("src.persistence.repo", self.repo):
+            country = Country.create("Sharded", "SH")
+            city = City.create({"name": "One", "country_code": "SH"})
+            City.update(str(city.id), {"name": "Two"})
+
+            self.assertIn(country, Country.get_all())
+            self.assertRaises(
+                ValueError,
+                City.create,
+                {"name": "Three", "country_code": "missing"},
+            )
+
+        self.assertIs(self.repo.get("city", str(city.id)), city)
+        self.assertEqual(city.name, "Two")
+        self.assertEqual(
+            sum(
+                shard.get("city", str(city.id)) is not None
+                for shard in self.repo.shards
+            ),
+            1,
+        )
+
+    def test_objects_are_placed_by_the_hash_of_their_id(self):
+        """Every object is in the shard given by its id, and only there"""
+        reviews = [make_review() for _ in range(30)]
+        for review in reviews:
+            self.repo.save(review)
+
+        for review in reviews:
+            index = zlib.crc32(review.id.encode()) % 3
+            for position, shard in enumerate(self.repo.shards):
+                self.assertEqual(
+                    shard.get("review", review.id) is review,
+                    position == index,
+                )
+            self.assertIs(self.repo.get("review", review.id), review)
+
+        self.assertTrue(all(s.get_all("review") for s in self.repo.shards))
+
+    def test_reads_are_merged(self):
+        """get_all, lookup and get_many gather every shard"""
+        reviews = [make_review(f"place-{n % 2}") for n in range(10)]
+        self.repo.save_many(reviews)
+
+        self.assertCountEqual(self.repo.get_all("review"), reviews)
+        self.assertCountEqual(
+            self.repo.lookup("review", place_id="place-1"), reviews[1::2]
+        )
+        self.assertEqual(
+            list(self.repo.get_many("review", [r.id for r in reviews[:4]])),
+            [r.id for r in reviews[:4]],
+        )
+        self.assertIsNotNone(self.repo.get_by("country", code="UY"))
+
+    def test_writes_go_to_one_shard(self):
+        """update and delete reach the shard of the object"""
+        reviews = [make_review() for _ in range(6)]
+        self.repo.save_many(reviews)
+        reviews[0].comment = "Changed"
+
+        self.repo.update(reviews[0])
+
+        self.assertEqual(
+            self.repo.get("review", reviews[0].id).comment, "Changed"
+        )
+        self.assertTrue(self.repo.delete(reviews[0]))
+        self.assertEqual(self.repo.delete_many(reviews), 5)
+        self.assertEqual(self.repo.get_all("review"), [])
+
+    def test_integer_ids_stay_in_the_first_shard(self):
+        """Objects whose id comes from the database aren't spread"""
+        amenities = [Amenity(name=f"Amenity {n}") for n in range(5)]
+        self.repo.save_many(amenities)
+
+        self.assertEqual(self.repo.shards[0].get_all("amenity"), amenities)
+
+    def test_rebalance(self):
+        """Objects move to their shard of the new layout, and no other"""
+        reviews = [make_review() for _ in range(40)]
+        self.repo.save_many(reviews)
+        first_shards = list(self.repo.shards)
+
+        for count in (5, 2):
+            total = len(self.repo.get_all("review"))
+            target, moved = rebalance(self.repo, count, "memory")
+
+            self.assertEqual(target.shards[:2], first_shards[:2])
+            self.assertEqual(len(target.get_all("review")), total)
+            self.assertGreater(moved["review"], 0)
+            for review in reviews:
+                self.assertIs(
+                    target.shard_of("review", review.id).get(
+                        "review", review.id
+                    ),
+                    review,
+                )
+
+            self.repo = target
+
+        self.assertEqual(rebalance(self.repo, 2)[1]["review"], 0)
+
+    def test_isolated_shards(self):
+        """Isolated memory repositories don't share their data"""
+        shard = MemoryRepository(isolated=True)
+        shard.save(make_review())
+
+        self.assertEqual(MemoryRepository(isolated=True).get_all("review"), [])
+
+
+class TestDatabaseShards(unittest.TestCase):
+    """Tests of a ShardedRepository over SQLite databases"""
+
+    def setUp(self):
+        """Builds two SQLite shards in a temp directory"""
+        self.tmp = tempfile.TemporaryDirectory()
+        url = "sqlite:///" + os.path.join(self.tmp.name, "shard_{shard}.db")
+        self.env = mock.patch.dict(os.environ, {"SHARD_DATABASE_URL": url})
+        self.env.start()
+
+        self.repo = ShardedRepository(create_shards("db", 2), populate=False)
+        self.repo.upgrade()
+
+    def tearDown(self):
+        """Closes the sessions and engines of the shards"""
+        self.env.stop()
+        self.repo.release()
+        for shard in self.repo.shards:
+            shard.session.get_bind().dispose()
+        self.tmp.cleanup()
+
+    def test_save_read_and_rebalance(self):
+        """Countries are spread over the databases and moved to new ones"""
+        countries = [Country(name=f"C{n}", code=f"C{n}") for n in range(12)]
+        self.repo.save_many(countries)
+        codes = sorted(c.code for c in countries)
+        self.repo.release()
+
+        self.assertEqual(
+            sorted(c.code for c in self.repo.get_all("country")), codes
+        )
+        self.assertTrue(
+            all(shard.get_all("country") for shard in self.repo.shards)
+        )
+        self.assertEqual(
+            self.repo.get("country", str(countries[3].id)).code, "C3"
+        )
+
+        target, moved = rebalance(self.repo, 3, "db")
+        target.release()
+
+        self.assertGreater(moved["country"], 0)
+        self.assertEqual(
+            sorted(c.code for c in target.get_all("country")), codes
+        )
+        for shard in target.shards:
+            for country in shard.get_all("country"):
+                self.assertIs(target.shard_of("country", country.id), shard)
+
+        target.release()
+        target.shards[2].session.get_bind().dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+""" Checks the TieredRepository and the back-pressure of WriteBehind """
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from src import db
+from src.migrate import upgrade_database
+from src.models.amenity import Amenity
+from src.models.city import City
+from src.models.country import Country
+from src.models.user import User
+from src.persistence.db import DBRepository
+from src.persistence.tiered import TieredRepository
+from src.persistence.write_behind import WriteBehind
+
+
+class TestTieredRepository(unittest.TestCase):
+    """Tests of the memory tier written behind to a SQLite file"""
+
+    def setUp(self):
+        """Builds a database with one country, then the tiered repository"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + (
+            os.path.join(self.tmp.name, "hbnb.db")
+        )
+        db.init_app(self.app)
+
+        with self.app.app_context():
+            upgrade_database()
+            DBRepository().save(Country(name="Stored", code="ST"))
+
+        self.repo = TieredRepository()
+        self.repo.init_app(self.app)
+        # Stores the seeded objects, so the tests start with no backlog
+        self.repo.flush()
+
+    def tearDown(self):
+        """Stops the writer and removes the database"""
+        self.repo.close()
+
+        with self.app.app_context():
+            db.engine.dispose()
+
+        self.tmp.cleanup()
+
+    def stored(self, model: str, **fields) -> list:
+        """Returns the ids and names in the database matching the fields"""
+        with self.app.app_context():
+            return [
+                {"id": obj.id, "name": obj.name}
+                for obj in DBRepository().lookup(model, **fields)
+            ]
+
+    def test_database_is_loaded_in_memory(self):
+        """The objects stored before the app started are read from memory"""
+        country = self.repo.get_by("country", code="ST")
+
+        self.assertEqual(country.name, "Stored")
+        self.assertIs(self.repo.get("country", str(country.id)), country)
+
+    def test_writes_are_drained_to_the_database(self):
+        """Saved objects are readable at once, stored after a flush"""
+        city = City(name="Montevideo", country_code="UY")
+        self.repo.save(city)
+        city.name = "Mvd"
+        self.repo.update(city)
+
+        self.assertIs(self.repo.get_by("city", name="Mvd"), city)
+
+        self.repo.flush()
+
+        self.assertEqual(self.repo.backlog(), 0)
+        self.assertEqual(
+            [c["name"] for c in self.stored("city", country_code="UY")],
+            ["Mvd"],
+        )
+
+    def test_deletes_are_drained_to_the_database(self):
+        """Deleted objects leave the database on the next flush"""
+        country = self.repo.get_by("country", code="ST")
+
+        self.assertTrue(self.repo.delete(country))
+        self.assertIsNone(self.repo.get_by("country", code="ST"))
+        self.assertEqual(self.repo.backlog(), 1)
+
+        self.repo.flush()
+
+        self.assertEqual(self.stored("country", code="ST"), [])
+
+    def test_integer_ids_are_written_through(self):
+        """Models whose id comes from the database get it on save"""
+        amenity = Amenity(name="Pool")
+        self.repo.save(amenity)
+
+        self.assertIsInstance(amenity.id, int)
+        self.assertEqual(self.stored("amenity", name="Pool")[0]["id"], 1)
+        self.assertIs(self.repo.get("amenity", amenity.id), amenity)
+
+    def test_models_write_through_the_repository(self):
+        """Users created and updated by the model are in the memory tier"""
+        with mock.patch("src.persistence.repo", self.repo):
+            user = User.create(
+                {
+                    "email": "tiered@example.com",
+                    "first_name": "Ada",
+                    "last_name": "Lovelace",
+                    "password": "secret",
+                }
+            )
+            self.assertIs(self.repo.get("user", str(user.id)), user)
+
+            User.update(str(user.id), {"first_name": "Augusta"})
+
+        self.assertEqual(
+            self.repo.get_by("user", email="tiered@example.com").first_name,
+            "Augusta",
+        )
+
+        self.repo.flush()
+
+        with self.app.app_context():
+            stored = DBRepository().get_by("user", email="tiered@example.com")
+            self.assertEqual(stored.first_name, "Augusta")
+
+    def write_elsewhere(self, name: str) -> str:
+        """Renames the stored country in the database, like another worker"""
+        with self.app.app_context():
+            country = DBRepository().get_by("country", code="ST")
+            country.name = name
+            DBRepository().update(country)
+
+            return str(country.id)
+
+    def test_writes_of_other_workers_are_read_again(self):
+        """Objects committed by another worker are read from the database"""
+        country_id = self.write_elsewhere("Elsewhere")
+        self.assertEqual(self.repo.get("country", country_id).name, "Stored")
+
+        self.repo.invalidate_many([("country", country_id)])
+
+        country = self.repo.get("country", country_id)
+        self.assertEqual(country.name, "Elsewhere")
+        self.assertIs(self.repo.get_by("country", name="Elsewhere"), country)
+
+        with self.app.app_context():
+            DBRepository().delete(DBRepository().get("country", country_id))
+        self.repo.clear()
+
+        self.assertIsNone(self.repo.get("country", country_id))
+
+    def test_changes_not_flushed_are_kept(self):
+        """An object changed in memory isn't read again until it is stored"""
+        country = self.repo.get_by("country", code="ST")
+        country.name = "Here"
+        self.repo.update(country)
+        self.write_elsewhere("Elsewhere")
+
+        self.repo.invalidate_many([("country", str(country.id))])
+
+        self.assertIs(self.repo.get("country", str(country.id)), country)
+        self.assertEqual(country.name, "Here")
+
+    def test_close_flushes_the_backlog(self):
+        """Nothing waits once the repository is closed"""
+        self.repo.save_many(
+            [Country(name=f"C{n}", code=f"C{n}") for n in range(3)]
+        )
+
+        self.repo.close()
+
+        self.assertEqual(self.repo.backlog(), 0)
+        self.assertEqual(len(self.stored("country", name="C1")), 1)
+
+
+class TestBackPressure(unittest.TestCase):
+    """Tests of the max_backlog and the flush errors of WriteBehind"""
+
+    def test_writers_block_over_the_backlog(self):
+        """The writer that fills the backlog waits for the flush"""
+        batches = []
+        writer = WriteBehind(batches.append, interval=60, max_backlog=3)
+
+        writer.mark("review", "1")
+        writer.mark("review", "2")
+        self.assertEqual(batches, [])
+
+        thread = threading.Thread(target=writer.mark, args=("review", "3"))
+        thread.start()
+        thread.join(timeout=5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(
+            batches, [[("review", "1"), ("review", "2"), ("review", "3")]]
+        )
+        self.assertEqual(writer.stats()["throttled_writes"], 1)
+        self.assertEqual(writer.stats()["max_backlog"], 3)
+
+        writer.close()
+
+    def fail(self, batch):
+        """Flush of a store that is down"""
+        raise OSError("store is down")
+
+    def test_failing_flush_reaches_the_writers(self):
+        """A waiting writer gets the error, the retries are paced"""
+        writer = WriteBehind(
+            self.fail, interval=0.05, wait=True, max_failures=3
+        )
+
+        with self.assertRaises(OSError):
+            writer.mark("review", "1")
+
+        errors = writer.stats()["errors"]
+        self.assertGreaterEqual(errors, 3)
+        self.assertLess(errors, 10)
+        self.assertEqual(writer.stats()["queue_depth"], 1)
+
+        with self.assertRaises(OSError):
+            writer.close()
+
+    def test_close_releases_writers_after_the_last_flush(self):
+        """A writer released by close only returns if its change is stored"""
+        writer = WriteBehind(
+            self.fail, interval=0.01, wait=True, max_failures=1000
+        )
+        errors = []
+
+        def mark():
+            """Records the error of the writer"""
+            try:
+                writer.mark("review", "1")
+            except OSError as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=mark)
+        thread.start()
+        time.sleep(0.05)
+
+        with self.assertRaises(OSError):
+            writer.close()
+        thread.join(timeout=5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
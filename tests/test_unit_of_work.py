@@ -0,0 +1,159 @@
+""" Checks the request-scoped unit of work """
+
+import unittest
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from src import db, unit_of_work
+from src.migrate import upgrade_database
+from src.models.city import City
+from src.models.country import Country
+from src.persistence.db import DBRepository
+
+
+class TestUnitOfWork(unittest.TestCase):
+    """Tests of the commits done by requests and transactions"""
+
+    def setUp(self):
+        """Builds an app with routes that change several objects"""
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["UNIT_OF_WORK"] = True
+        db.init_app(self.app)
+        unit_of_work.init_app(self.app)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        upgrade_database()
+
+        self.repo = DBRepository()
+        self.commits = 0
+        event.listen(db.engine, "commit", self.count)
+
+        @self.app.post("/countries/<code>")
+        def create(code):
+            """Saves a country and one of its cities"""
+            self.repo.save(Country(name=code, code=code))
+            self.repo.save(City(name=f"{code} city", country_code=code))
+            return {}, 201
+
+        @self.app.post("/invalid/<code>")
+        def invalid(code):
+            """Saves a country, then fails with a client error"""
+            self.repo.save(Country(name=code, code=code))
+            return {}, 400
+
+        @self.app.get("/countries/<code>")
+        def read(code):
+            """Reads a country"""
+            country = self.repo.get_by("country", code=code)
+            return {"found": country is not None}
+
+        @self.app.post("/flushed/<code>")
+        def flushed(code):
+            """Flushes a country without going through the repository"""
+            db.session.add(Country(name=code, code=code))
+            db.session.flush()
+            return {}, 201
+
+        @self.app.post("/broken/<code>")
+        def broken(code):
+            """Saves a country, then raises"""
+            self.repo.save(Country(name=code, code=code))
+            raise RuntimeError("broken")
+
+    def tearDown(self):
+        """Drops the database"""
+        event.remove(db.engine, "commit", self.count)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def count(self, connection):
+        """Counts the commits that reach the database"""
+        self.commits += 1
+
+    def test_request_commits_once(self):
+        """Every change of a successful request is in a single commit"""
+        before = unit_of_work.stats()
+
+        response = self.app.test_client().post("/countries/AR")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(len(self.repo.lookup("city", country_code="AR")), 1)
+
+        after = unit_of_work.stats()
+        self.assertEqual(after["requests"], before["requests"] + 1)
+        self.assertEqual(after["last_commits_per_request"], 1)
+
+    def test_requests_without_changes_do_not_commit(self):
+        """A read only request closes its session without a commit"""
+        before = unit_of_work.stats()
+
+        response = self.app.test_client().get("/countries/AR")
+
+        self.assertEqual(response.get_json(), {"found": False})
+        self.assertEqual(self.commits, 0)
+        self.assertEqual(unit_of_work.stats()["commits"], before["commits"])
+        self.assertEqual(unit_of_work.stats()["last_commits_per_request"], 0)
+
+    def test_flushed_changes_are_committed(self):
+        """Changes flushed outside of the repositories are committed"""
+        response = self.app.test_client().post("/flushed/UY")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.commits, 1)
+        self.assertIsNotNone(self.repo.get_by("country", code="UY"))
+
+    def test_failed_requests_roll_back(self):
+        """Error responses and exceptions discard the request's changes"""
+        client = self.app.test_client()
+
+        self.assertEqual(client.post("/invalid/BR").status_code, 400)
+        self.app.testing = False
+        self.assertEqual(client.post("/broken/CL").status_code, 500)
+
+        self.assertEqual(self.commits, 0)
+        self.assertIsNone(self.repo.get_by("country", code="BR"))
+        self.assertIsNone(self.repo.get_by("country", code="CL"))
+
+    def test_transaction(self):
+        """A transaction outside of a request commits once, or not at all"""
+        with unit_of_work.transaction():
+            self.repo.save(Country(name="Peru", code="PE"))
+            self.repo.save(City(name="Lima", country_code="PE"))
+
+        self.assertEqual(self.commits, 1)
+
+        with self.assertRaises(RuntimeError):
+            with unit_of_work.transaction():
+                self.repo.save(Country(name="Bolivia", code="BO"))
+                raise RuntimeError("rolled back")
+
+        self.assertEqual(self.commits, 1)
+        self.assertIsNone(self.repo.get_by("country", code="BO"))
+        self.assertIsNotNone(self.repo.get_by("country", code="PE"))
+
+    def test_other_sessions_end_with_the_unit_of_work(self):
+        """Sessions flushed in a transaction are committed with it"""
+        other = DBRepository(scoped_session(sessionmaker(bind=db.engine)))
+
+        with self.assertRaises(RuntimeError):
+            with unit_of_work.transaction():
+                other.save(Country(name="Bolivia", code="BO"))
+                raise RuntimeError("rolled back")
+
+        with unit_of_work.transaction():
+            other.save(Country(name="Peru", code="PE"))
+
+        self.assertEqual(self.commits, 1)
+        self.assertIsNone(self.repo.get_by("country", code="BO"))
+        self.assertIsNotNone(self.repo.get_by("country", code="PE"))
+        other.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
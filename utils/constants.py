@@ -4,3 +4,144 @@ REPOSITORY_ENV_VAR = "REPOSITORY"
 
 FILE_STORAGE_FILENAME = "data.json"
 PICKLE_STORAGE_FILENAME = "data.pkl"
+# Locked by the workers around the writes of the shared files
+FILE_LOCK_FILENAME = "data.json.lock"
+PICKLE_LOCK_FILENAME = "data.pkl.lock"
+
+# Journaled FileRepository, enabled with FILE_JOURNAL=1
+FILE_JOURNAL_ENV_VAR = "FILE_JOURNAL"
+FILE_JOURNAL_FILENAME = "data.json.journal"
+# The snapshot is rewritten when the journal reaches MAX_BYTES, or when it
+# is at least MIN_BYTES and RATIO times the size of the snapshot
+FILE_JOURNAL_COMPACT_MIN_BYTES = 1024 * 1024
+FILE_JOURNAL_COMPACT_MAX_BYTES = 64 * 1024 * 1024
+FILE_JOURNAL_COMPACT_RATIO = 1.0
+
+# Write-behind FileRepository, enabled with FILE_WRITE_BEHIND=1
+FILE_WRITE_BEHIND_ENV_VAR = "FILE_WRITE_BEHIND"
+FILE_FLUSH_INTERVAL = 1.0
+FILE_FLUSH_MAX_CHANGES = 500
+# always: with write-behind, writes wait for their batch to be synced
+# batch: every write (or every write-behind batch) is synced to disk
+# os: nothing is synced, the OS decides when the data reaches the disk
+FILE_DURABILITY_ENV_VAR = "FILE_DURABILITY"
+FILE_DURABILITY_DEFAULT = "batch"
+
+# Pickle deltas, every change is appended to PICKLE_DELTAS_FILENAME and
+# merged into the base file in the background (disabled with
+# PICKLE_DELTAS=0). Deltas are merged when they reach MAX_BYTES, or when
+# they are at least MIN_BYTES and RATIO times the size of the base file
+PICKLE_DELTAS_ENV_VAR = "PICKLE_DELTAS"
+PICKLE_DELTAS_FILENAME = "data.pkl.deltas"
+PICKLE_MERGE_MIN_BYTES = 1024 * 1024
+PICKLE_MERGE_MAX_BYTES = 64 * 1024 * 1024
+PICKLE_MERGE_RATIO = 1.0
+
+# Connection pool of ProductionConfig. The defaults of the pool size and
+# overflow are derived from the gunicorn workers and threads: each
+# worker process has its own pool, sized for its threads, and all of
+# them together stay within DB_MAX_CONNECTIONS
+GUNICORN_WORKERS_ENV_VAR = "WEB_CONCURRENCY"
+GUNICORN_THREADS_ENV_VAR = "GUNICORN_THREADS"
+DB_MAX_CONNECTIONS_ENV_VAR = "DB_MAX_CONNECTIONS"
+DB_MAX_CONNECTIONS_DEFAULT = 100
+DB_POOL_SIZE_ENV_VAR = "DB_POOL_SIZE"
+DB_MAX_OVERFLOW_ENV_VAR = "DB_MAX_OVERFLOW"
+DB_POOL_TIMEOUT_ENV_VAR = "DB_POOL_TIMEOUT"
+DB_POOL_TIMEOUT_DEFAULT = 30
+DB_POOL_RECYCLE_ENV_VAR = "DB_POOL_RECYCLE"
+DB_POOL_RECYCLE_DEFAULT = 1800
+DB_POOL_PRE_PING_ENV_VAR = "DB_POOL_PRE_PING"
+
+# Rows fetched at a time by DBRepository.iter_all
+DB_STREAM_BATCH_SIZE = 1000
+
+# Read replicas, a comma separated list of database URLs. Each one is
+# a Flask-SQLAlchemy bind named REPLICA_BIND_PREFIX plus its position
+DB_REPLICA_URLS_ENV_VAR = "DATABASE_REPLICA_URLS"
+REPLICA_BIND_PREFIX = "replica_"
+
+# Sharded repository, selected with REPOSITORY=sharded: SHARD_COUNT
+# shards of the SHARD_BACKEND kind (memory or db). The database of
+# shard n is SHARD_DATABASE_URL with {shard} replaced by n
+SHARD_COUNT_ENV_VAR = "SHARD_COUNT"
+SHARD_COUNT_DEFAULT = 4
+SHARD_BACKEND_ENV_VAR = "SHARD_BACKEND"
+SHARD_BACKEND_DEFAULT = "memory"
+SHARD_DATABASE_URL_ENV_VAR = "SHARD_DATABASE_URL"
+SHARD_DATABASE_URL_DEFAULT = "sqlite:///hbnb_shard_{shard}.db"
+
+# Tiered repository, selected with REPOSITORY=tiered: changes are drained
+# from memory to the database every FLUSH_INTERVAL seconds, or as soon as
+# FLUSH_MAX_CHANGES objects changed. Writers block while TIERED_MAX_BACKLOG
+# objects wait to be drained
+TIERED_FLUSH_INTERVAL = 0.5
+TIERED_FLUSH_MAX_CHANGES = 500
+TIERED_MAX_BACKLOG_ENV_VAR = "TIERED_MAX_BACKLOG"
+TIERED_MAX_BACKLOG_DEFAULT = 10000
+
+# Read-through cache in front of the repository, enabled with
+# REPOSITORY_CACHE=1. Every model keeps up to REPOSITORY_CACHE_SIZE
+# objects for REPOSITORY_CACHE_TTL seconds, REPOSITORY_CACHE_LIMITS
+# overrides them by model as "model=size:ttl,..." (a size of 0 turns
+# the cache off for the model)
+REPOSITORY_CACHE_ENV_VAR = "REPOSITORY_CACHE"
+REPOSITORY_CACHE_SIZE_ENV_VAR = "REPOSITORY_CACHE_SIZE"
+REPOSITORY_CACHE_SIZE_DEFAULT = 1000
+REPOSITORY_CACHE_TTL_ENV_VAR = "REPOSITORY_CACHE_TTL"
+REPOSITORY_CACHE_TTL_DEFAULT = 30.0
+REPOSITORY_CACHE_LIMITS_ENV_VAR = "REPOSITORY_CACHE_LIMITS"
+# Countries and amenities rarely change
+REPOSITORY_CACHE_LIMITS_DEFAULT = "country=500:3600,amenity=500:600"
+
+# Most bytes of entity JSON kept to build the list responses
+# (see src/responses.py), 0 turns the cache off
+RESPONSE_CACHE_MAX_BYTES_ENV_VAR = "RESPONSE_CACHE_MAX_BYTES"
+RESPONSE_CACHE_MAX_BYTES_DEFAULT = 16 * 1024 * 1024
+
+# Invalidation bus between the workers of a host (see src/invalidation.py),
+# enabled by setting INVALIDATION_BUS_PATH to a SQLite file. Workers
+# poll it every INVALIDATION_INTERVAL seconds, the longest a cached
+# object can be stale, and events are kept INVALIDATION_RETENTION seconds
+INVALIDATION_BUS_PATH_ENV_VAR = "INVALIDATION_BUS_PATH"
+INVALIDATION_INTERVAL_ENV_VAR = "INVALIDATION_INTERVAL"
+INVALIDATION_INTERVAL_DEFAULT = 0.5
+INVALIDATION_RETENTION_ENV_VAR = "INVALIDATION_RETENTION"
+INVALIDATION_RETENTION_DEFAULT = 60.0
+
+# Storage layout of the file and pickle repositories:
+# single (one file for every model) or segmented (one file per model)
+STORAGE_LAYOUT_ENV_VAR = "STORAGE_LAYOUT"
+FILE_SEGMENTS_DIRNAME = "data.json.d"
+PICKLE_SEGMENTS_DIRNAME = "data.pkl.d"
+
+# Lazy FileRepository, enabled with FILE_LAZY=1: records are only turned
+# into model instances when read. FILE_LAZY_CACHE_SIZE bounds how many
+# instances are kept per repository (0 keeps every read instance)
+FILE_LAZY_ENV_VAR = "FILE_LAZY"
+FILE_LAZY_CACHE_SIZE_ENV_VAR = "FILE_LAZY_CACHE_SIZE"
+
+# Names of every model, as used by the repositories
+MODEL_NAMES = (
+    "country",
+    "user",
+    "amenity",
+    "city",
+    "review",
+    "place",
+    "placeamenity",
+)
+
+# Background snapshots of MemoryRepository, enabled with MEMORY_SNAPSHOTS=1:
+# a forked child writes the data every INTERVAL seconds, or as soon as
+# MAX_CHANGES objects changed; a child still running after TIMEOUT
+# seconds is killed
+MEMORY_SNAPSHOTS_ENV_VAR = "MEMORY_SNAPSHOTS"
+MEMORY_SNAPSHOT_FILENAME = "data.memory.pkl"
+MEMORY_SNAPSHOT_INTERVAL = 60.0
+MEMORY_SNAPSHOT_MAX_CHANGES = 1000
+MEMORY_SNAPSHOT_TIMEOUT = 300.0
+
+# Memory-mapped snapshot repository, selected with REPOSITORY=mmap
+MMAP_SNAPSHOT_FILENAME = "data.snapshot"
+MMAP_JOURNAL_FILENAME = "data.snapshot.journal"
@@ -11,7 +11,12 @@ def populate_db(repo: Repository) -> None:
         Country(name="Uruguay", code="UY"),
     ]
 
-    for country in countries:
-        repo.save(country)
+    repo.save_many(
+        [
+            country
+            for country in countries
+            if repo.get_by("country", code=country.code) is None
+        ]
+    )
 
     print("Memory DB populated")